@@ -0,0 +1,244 @@
+import base64
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from chat import history, inbox
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a ``(timestamp, id)`` keyset, newest first.
+
+    Cursors are opaque, no count query is issued and every page is a plain
+    index range scan, so deep pages cost the same as the first one.
+    """
+    page_size = api_settings.PAGE_SIZE
+    ordering_field = 'created_at'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        position = self.get_position(request)
+
+        if position is not None:
+            queryset = self.filter_after(queryset, position)
+
+        queryset = queryset.order_by(*self.get_ordering())
+        return self.paginate_results(list(queryset[:self.page_size + 1]))
+
+    def get_ordering(self):
+        return (f'-{self.ordering_field}', '-pk')
+
+    def filter_after(self, queryset, position):
+        """Restrict ``queryset`` to rows strictly after ``position``."""
+        value, pk = position
+        return queryset.filter(
+            Q(**{f'{self.ordering_field}__lt': value})
+            | Q(**{self.ordering_field: value, 'pk__lt': pk})
+        )
+
+    def position_of(self, obj):
+        return (getattr(obj, self.ordering_field), obj.pk)
+
+    def paginate_results(self, results):
+        """Trim a list fetched with ``page_size + 1`` items and remember where it ended."""
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if self.has_next:
+            self.next_position = self.position_of(results[-1])
+        return results
+
+    def get_position(self, request):
+        """Decode the request's cursor into a keyset position."""
+        self.request = request
+        self.has_next = False
+        self.next_position = None
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            decoded = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            return self.load_position(decoded)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def load_position(self, raw):
+        value, pk = raw.rsplit('|', 1)
+        timestamp = parse_datetime(value)
+        if timestamp is None:
+            raise ValueError(raw)
+        return timestamp, int(pk)
+
+    def dump_position(self, position):
+        value, pk = position
+        return f'{value.isoformat()}|{pk}'
+
+    def encode_cursor(self, position):
+        raw = self.dump_position(position)
+        return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                    'format': 'uri',
+                },
+                'results': schema,
+            },
+        }
+
+
+class UserKeysetPagination(KeysetPagination):
+    ordering_field = 'date_joined'
+
+
+class RankKeysetPagination(KeysetPagination):
+    """Keyset pagination on a ``(rank, id)`` annotation, best match first."""
+    ordering_field = 'rank'
+
+    def load_position(self, raw):
+        value, pk = raw.rsplit('|', 1)
+        return float(value), int(pk)
+
+    def dump_position(self, position):
+        value, pk = position
+        return f'{value!r}|{pk}'
+
+
+class IdKeysetPagination(KeysetPagination):
+    """Keyset pagination on the primary key alone, for tables without timestamps."""
+
+    def get_ordering(self):
+        return ('-pk',)
+
+    def filter_after(self, queryset, position):
+        return queryset.filter(pk__lt=position)
+
+    def position_of(self, obj):
+        return obj.pk
+
+    def load_position(self, raw):
+        return int(raw)
+
+    def dump_position(self, position):
+        return str(position)
+
+
+class WindowPagination(KeysetPagination):
+    """
+    Pages through a precomputed, ordered window (e.g. a cached ranking).
+    The opaque cursor holds the window's snapshot and the offset of the
+    next page in it.
+    """
+
+    def paginate_window(self, get_window, request):
+        """``get_window(snapshot)`` returns ``(snapshot, items)``."""
+        snapshot, offset = self.get_position(request) or (None, 0)
+        current, items = get_window(snapshot)
+        if current != snapshot:
+            # The snapshot expired: start over on the current one.
+            offset = 0
+        page = list(items[offset:offset + self.page_size])
+
+        self.has_next = offset + self.page_size < len(items)
+        if self.has_next:
+            self.next_position = (current, offset + self.page_size)
+        return page
+
+    def load_position(self, raw):
+        snapshot, offset = raw.split('|')
+        return int(snapshot), int(offset)
+
+    def dump_position(self, position):
+        snapshot, offset = position
+        return f'{snapshot}|{offset}'
+
+
+class PagePagination(KeysetPagination):
+    """
+    Pages through pre-rendered pages (e.g. the Explore cache). The opaque
+    cursor holds the version of the pages and the number of the next one.
+    """
+
+    def paginate_pages(self, get_page, request):
+        """``get_page(position)`` returns ``(results, next_position)``."""
+        position = self.get_position(request)
+        results, self.next_position = get_page(position)
+
+        self.has_next = self.next_position is not None
+        return results
+
+    def load_position(self, raw):
+        version, number = raw.split('|')
+        return int(version), int(number)
+
+    def dump_position(self, position):
+        version, number = position
+        return f'{version}|{number}'
+
+
+class ChatHistoryPagination(KeysetPagination):
+    """
+    Pages through a room's messages, newest first, using the recent-message
+    list in Redis before falling back to the database (see ``chat.history``).
+    """
+    page_size = settings.CHAT_HISTORY_PAGE_SIZE
+
+    def paginate_history(self, room_id, request):
+        position = self.get_position(request)
+        results, self.next_position = history.page(room_id, position, self.page_size)
+
+        self.has_next = self.next_position is not None
+        return results
+
+
+class InboxPagination(KeysetPagination):
+    """
+    Pages through a user's conversations, most recently active first,
+    straight from the inbox kept in Redis (see ``chat.inbox``).
+    """
+    page_size = settings.CHAT_INBOX_PAGE_SIZE
+
+    def paginate_inbox(self, user_id, request):
+        position = self.get_position(request)
+        results, self.next_position = inbox.page(user_id, position, self.page_size)
+
+        self.has_next = self.next_position is not None
+        return results
+
+    def load_position(self, raw):
+        score, member = raw.rsplit('|', 1)
+        int(member)
+        return float(score), member
+
+    def dump_position(self, position):
+        score, member = position
+        return f'{score!r}|{member}'
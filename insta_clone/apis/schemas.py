@@ -1,10 +1,13 @@
 from drf_spectacular.utils import (
     extend_schema_view, extend_schema,
+    OpenApiParameter,
 )
 
-from posts.serializers import PostSerializer
+from chat.serializers import ChatMessageSerializer, ConversationSerializer
 
-from users.serializers import UserRegisterSerializer
+from posts.serializers import PostSerializer, TrendingTagSerializer
+
+from users.serializers import UserRegisterSerializer, UserSearchSerializer
 
 
 user_register_schema = extend_schema_view(
@@ -17,11 +20,32 @@ user_register_schema = extend_schema_view(
 )
 
 
+user_search_schema = extend_schema_view(
+    get=extend_schema(
+        summary="Search users by username prefix",
+        description="Typeahead lookup of users whose username starts with `q` (case-insensitive). "
+                    "Exact matches come first, then users with more followers.",
+        parameters=[
+            OpenApiParameter(name='q', required=True, description="Username prefix."),
+        ],
+        responses={200: UserSearchSerializer(many=True)},
+        tags=["Users"]
+    )
+)
+
+
 post_list_create_schema = extend_schema_view(
     get=extend_schema(
         summary="List and create posts",
         description="GET: Retrieves posts from users that the current user follows, ordered by creation date.\n"
                    "POST: Creates a new post for the current authenticated user.",
+        parameters=[
+            OpenApiParameter(
+                name='order', enum=['ranked'], required=False,
+                description="Rank posts by recency, engagement velocity and author affinity "
+                            "instead of creation date."
+            ),
+        ],
         responses={
             200: PostSerializer(many=True),
             201: PostSerializer,
@@ -36,3 +60,93 @@ post_list_create_schema = extend_schema_view(
         tags=["Posts"]
     )
 )
+
+
+post_search_schema = extend_schema_view(
+    get=extend_schema(
+        summary="Search posts by caption",
+        description="Full-text search over post captions, ranked by relevance. "
+                    "Supports quoted phrases, `or` and `-word` exclusions.",
+        parameters=[
+            OpenApiParameter(name='q', required=True, description="Search terms."),
+        ],
+        responses={200: PostSerializer(many=True)},
+        tags=["Posts"]
+    )
+)
+
+
+tag_posts_schema = extend_schema_view(
+    get=extend_schema(
+        summary="List posts by hashtag",
+        description="Retrieves posts whose caption contains the hashtag, newest first. "
+                    "The tag is matched case-insensitively, with or without the leading `#`.",
+        responses={200: PostSerializer(many=True)},
+        tags=["Posts"]
+    )
+)
+
+
+trending_tags_schema = extend_schema_view(
+    get=extend_schema(
+        summary="Trending hashtags",
+        description="Hashtags used most in new posts over the recent sliding window.",
+        responses={200: TrendingTagSerializer(many=True)},
+        tags=["Posts"]
+    )
+)
+
+
+explore_schema = extend_schema_view(
+    get=extend_schema(
+        summary="Explore trending posts",
+        description="Retrieves trending posts from all users, ranked by recent like and comment "
+                    "activity. The list is precomputed periodically and served from cache.",
+        responses={200: PostSerializer(many=True)},
+        tags=["Posts"]
+    )
+)
+
+
+chat_history_schema = extend_schema_view(
+    get=extend_schema(
+        summary="Chat room history",
+        description="Retrieves a room's messages, newest first. Recent messages are served "
+                    "from memory; follow `next` for older pages.",
+        responses={200: ChatMessageSerializer(many=True)},
+        tags=["Chat"]
+    )
+)
+
+
+inbox_schema = extend_schema_view(
+    get=extend_schema(
+        summary="Direct-message inbox",
+        description="Lists the authenticated user's conversations, most recently active first, "
+                    "with unread counts and the last message. Served from memory.",
+        responses={200: ConversationSerializer(many=True)},
+        tags=["Chat"]
+    )
+)
+
+
+conversation_history_schema = extend_schema_view(
+    get=extend_schema(
+        summary="Conversation history",
+        description="Retrieves a direct-message conversation's messages, newest first. "
+                    "Only participants may read it.",
+        responses={200: ChatMessageSerializer(many=True)},
+        tags=["Chat"]
+    )
+)
+
+
+conversation_read_schema = extend_schema_view(
+    post=extend_schema(
+        summary="Mark conversation read",
+        description="Resets the authenticated user's unread count for the conversation.",
+        request=None,
+        responses={204: None},
+        tags=["Chat"]
+    )
+)
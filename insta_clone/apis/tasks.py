@@ -3,9 +3,89 @@ from celery import shared_task
 from django.conf import settings
 from django.core.mail import send_mail
 
+from chat import inbox
+
+from insta_clone.storage import renditions_for
+
+from posts import explore, like_buffer, ranking, timeline, uploads
+from posts import counters as post_counters
+from posts.models import Post
+
+from users import counters as user_counters
+from users.models import User
+
 
 @shared_task
 def send_profile_creation_email(user_id, user_email):
     subject = "Profile Creation"
     message = f"Your profile with ID {user_id} has been created"
     return send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [user_email])
+
+
+@shared_task
+def render_post_image(post_id, name):
+    post = Post.objects.filter(id=post_id).first()
+    # Skip posts deleted or re-uploaded since the task was queued.
+    if post is not None and post.image.name == name:
+        renditions = renditions_for(post.image)
+        Post.objects.filter(id=post_id, image=name).update(renditions=renditions)
+
+
+@shared_task
+def render_profile_picture(user_id, name):
+    user = User.objects.filter(id=user_id).first()
+    if user is not None and user.profile_picture.name == name:
+        renditions = renditions_for(user.profile_picture)
+        User.objects.filter(id=user_id, profile_picture=name).update(renditions=renditions)
+
+
+@shared_task
+def fan_out_post(post_id):
+    post = Post.objects.filter(id=post_id).first()
+    if post is not None:
+        timeline.fan_out(post)
+
+
+@shared_task
+def remove_post_from_timelines(post_id, author_id):
+    timeline.remove_post(post_id, author_id)
+
+
+@shared_task
+def rebuild_timeline(user_id):
+    return timeline.rebuild(user_id)
+
+
+@shared_task
+def reconcile_post_counters(chunk_size=1000):
+    return post_counters.reconcile(chunk_size=chunk_size)
+
+
+@shared_task
+def recount_follow_counters(chunk_size=1000):
+    return user_counters.recount(chunk_size=chunk_size)
+
+
+@shared_task
+def flush_pending_likes(max_posts=1000):
+    return like_buffer.flush(max_posts=max_posts)
+
+
+@shared_task
+def persist_inboxes(max_conversations=1000):
+    return inbox.persist(max_conversations=max_conversations)
+
+
+@shared_task
+def refresh_feed_rankings():
+    return ranking.refresh()
+
+
+@shared_task
+def refresh_explore():
+    return explore.render()[1]
+
+
+@shared_task
+def expire_upload_sessions():
+    return uploads.expire()
@@ -1,10 +1,27 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.test import override_settings
 from django.urls import reverse
 
+from PIL import Image
+
 from rest_framework import status
+from rest_framework.settings import api_settings
 from rest_framework.test import APITestCase
 
-from posts.models import Post, Like
+from apis.pagination import KeysetPagination, WindowPagination, InboxPagination
+from chat import history, inbox
+from chat.models import Message, Room
+from posts import ranking, timeline
+from posts.models import Post, Like, Comment, UploadSession, StoredFile
+from users import search
 
 User = get_user_model()
 
@@ -87,6 +104,33 @@ class UserListAPITestCase(APITestCase):
         self.assertEqual(len(response.data['results']), 0)
 
 
+class UserSearchAPITestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        search._hot_prefixes.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password', email='user1@example.com')
+        self.user2 = User.objects.create_user(username='user2', password='password', email='user2@example.com')
+        self.url = reverse('user-search')
+
+    def test_search(self):
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(self.url, {'q': 'USER'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['username'] for row in response.data], ['user1', 'user2'])
+        self.assertEqual(set(response.data[0]), {'id', 'username', 'profile_picture', 'renditions'})
+
+    def test_search_without_authentication(self):
+        response = self.client.get(self.url, {'q': 'user'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_named_search_keeps_profile(self):
+        named = User.objects.create_user(username='search', password='password', email='search@example.com')
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(reverse('user-detail', kwargs={'username': 'search'}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], named.id)
+
+
 class UserDetailAPITestCase(APITestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username='user1', password='password1', email='user1@gmail.com')
@@ -165,6 +209,7 @@ class UserDetailAPITestCase(APITestCase):
 
 class FollowToggleViewTest(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user1 = User.objects.create_user(username='user1', password='password', email='user1@example.com')
         self.user2 = User.objects.create_user(username='user2', password='password', email='user2@example.com')
         self.url = reverse('follow', kwargs={'username': self.user2.username})
@@ -182,6 +227,31 @@ class FollowToggleViewTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertFalse(self.user2.followers.filter(id=self.user1.id).exists())
 
+    def test_follow_returns_counts(self):
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.post(self.url)
+        self.assertTrue(response.data['is_following'])
+        self.assertEqual(response.data['followers_count'], 1)
+        self.user1.refresh_from_db()
+        self.assertEqual(self.user1.following_count, 1)
+
+    def test_put_and_delete_are_idempotent(self):
+        self.client.force_authenticate(user=self.user1)
+        self.client.put(self.url)
+        response = self.client.put(self.url)
+        self.assertTrue(response.data['is_following'])
+        self.assertEqual(response.data['followers_count'], 1)
+
+        response = self.client.delete(self.url)
+        self.assertFalse(response.data['is_following'])
+        self.assertEqual(response.data['followers_count'], 0)
+
+    def test_follow_user_deleted_meanwhile(self):
+        self.client.force_authenticate(user=self.user1)
+        with mock.patch('apis.views.follows.toggle', return_value=None):
+            response = self.client.post(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_follow_self(self):
         self.client.force_authenticate(user=self.user1)
         url = reverse('follow', kwargs={'username': self.user1.username})
@@ -193,8 +263,44 @@ class FollowToggleViewTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+class FollowListAPITestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password', email='user1@example.com')
+        self.user2 = User.objects.create_user(username='user2', password='password', email='user2@example.com')
+        self.user3 = User.objects.create_user(username='user3', password='password', email='user3@example.com')
+        self.user1.followers.add(self.user2)
+        self.user1.followers.add(self.user3)
+        self.user2.followers.add(self.user3)
+
+    def test_followers(self):
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.get(reverse('followers', kwargs={'username': 'user1'}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [user['username'] for user in response.data['results']],
+            ['user3', 'user2']
+        )
+
+    @mock.patch.object(KeysetPagination, 'page_size', 1)
+    def test_following_pages(self):
+        self.client.force_authenticate(user=self.user2)
+        url = reverse('following', kwargs={'username': 'user3'})
+        first = self.client.get(url)
+        second = self.client.get(first.data['next'])
+        self.assertEqual(first.data['results'][0]['username'], 'user2')
+        self.assertEqual(second.data['results'][0]['username'], 'user1')
+        self.assertIsNone(second.data['next'])
+
+    def test_unknown_user(self):
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.get(reverse('followers', kwargs={'username': 'nobody'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
 class PostListCreateAPITestCase(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user1 = User.objects.create_user(username='user1', password='password', email='user1@example.com')
         self.user2 = User.objects.create_user(username='user2', password='password', email='user2@example.com')
         self.user1.following.add(self.user2)
@@ -208,6 +314,63 @@ class PostListCreateAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['results']), 1)  
 
+    def test_get_posts_from_timeline(self):
+        timeline.rebuild(self.user1.id)
+        newer = Post.objects.create(user=self.user2, image='image3.jpg', caption='caption3')
+        timeline.fan_out(newer)
+
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [post['id'] for post in response.data['results']],
+            [newer.id, self.post2.id]
+        )
+
+    def test_get_ranked_posts(self):
+        newer = Post.objects.create(user=self.user2, image='image3.jpg', caption='caption3')
+        Like.objects.create(user=self.user1, post=self.post2)
+
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(self.url, {'order': 'ranked'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([post['id'] for post in response.data['results']], [newer.id, self.post2.id])
+
+        ranking.refresh()
+        cache.delete(ranking.ranked_feed_key(self.user1.id))
+        response = self.client.get(self.url, {'order': 'ranked'})
+        self.assertEqual([post['id'] for post in response.data['results']], [self.post2.id, newer.id])
+
+    @mock.patch.object(WindowPagination, 'page_size', 1)
+    def test_ranked_posts_pagination(self):
+        Post.objects.create(user=self.user2, image='image3.jpg', caption='caption3')
+        self.client.force_authenticate(user=self.user1)
+
+        first = self.client.get(self.url, {'order': 'ranked'})
+        second = self.client.get(first.data['next'])
+        self.assertEqual(len(first.data['results']), 1)
+        self.assertEqual(len(second.data['results']), 1)
+        self.assertNotEqual(first.data['results'][0]['id'], second.data['results'][0]['id'])
+        self.assertIsNone(second.data['next'])
+
+    @mock.patch.object(WindowPagination, 'page_size', 1)
+    def test_ranked_pages_stay_on_their_snapshot(self):
+        newer = Post.objects.create(user=self.user2, image='image3.jpg', caption='caption3')
+        self.client.force_authenticate(user=self.user1)
+
+        first = self.client.get(self.url, {'order': 'ranked'})
+        # Re-rank between pages so the current window flips its order.
+        Like.objects.create(user=self.user1, post=self.post2)
+        ranking.refresh()
+        cache.delete(ranking.ranked_feed_key(self.user1.id))
+
+        second = self.client.get(first.data['next'])
+        self.assertEqual(
+            [first.data['results'][0]['id'], second.data['results'][0]['id']],
+            [newer.id, self.post2.id]
+        )
+        self.assertIsNone(second.data['next'])
+
     def test_get_posts_without_authentication(self):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -224,6 +387,294 @@ class PostListCreateAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+class PostSearchAPITestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password', email='user1@example.com')
+        self.best = Post.objects.create(user=self.user1, image='image1.jpg', caption='cat cat cat')
+        self.tied = [
+            Post.objects.create(user=self.user1, image='image2.jpg', caption='my cat')
+            for _ in range(2)
+        ]
+        Post.objects.create(user=self.user1, image='image3.jpg', caption='dog')
+        self.url = reverse('post-search')
+
+    def test_search(self):
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(self.url, {'q': 'cats'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [post['id'] for post in response.data['results']],
+            [self.best.id, self.tied[1].id, self.tied[0].id]
+        )
+
+    @mock.patch.object(KeysetPagination, 'page_size', 1)
+    def test_search_pagination_through_ties(self):
+        self.client.force_authenticate(user=self.user1)
+        seen = []
+        url = self.url + '?q=cat'
+        while url:
+            response = self.client.get(url)
+            seen += [post['id'] for post in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, [self.best.id, self.tied[1].id, self.tied[0].id])
+
+
+class HashtagAPITestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password', email='user1@example.com')
+        self.client.force_authenticate(user=self.user1)
+
+    def create_post(self, caption):
+        response = self.client.post(reverse('posts'), {'caption': caption})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def test_tag_posts(self):
+        first = self.create_post('Morning #Sun')
+        second = self.create_post('#sun #sea')
+        response = self.client.get(reverse('tag-posts', kwargs={'tag': 'SUN'}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([post['id'] for post in response.data['results']], [second, first])
+
+    def test_trending_tags(self):
+        self.create_post('#sun #sea')
+        self.create_post('#sun')
+        response = self.client.get(reverse('trending-tags'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{'tag': 'sun', 'uses': 2}, {'tag': 'sea', 'uses': 1}])
+
+
+class ProfilePictureAPITestCase(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username='user1', password='password', email='user1@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('user-detail', kwargs={'username': 'user1'})
+
+    def upload(self, color):
+        buffer = BytesIO()
+        Image.new('RGB', (16, 16), color).save(buffer, 'PNG')
+        buffer.name = 'me.png'
+        buffer.seek(0)
+        with mock.patch('apis.views.render_profile_picture'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(self.url, {'profile_picture': buffer}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return User.objects.get(id=self.user.id).profile_picture.name
+
+    def test_identical_reupload_keeps_one_reference(self):
+        name = self.upload((255, 0, 0))
+        self.assertEqual(self.upload((255, 0, 0)), name)
+        self.assertEqual(StoredFile.objects.get(name=name).refcount, 1)
+
+        self.upload((0, 0, 255))
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+
+
+class UploadAPITestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        buffer = BytesIO()
+        Image.new('RGB', (64, 48), (10, 200, 10)).save(buffer, 'JPEG')
+        self.data = buffer.getvalue()
+        self.user1 = User.objects.create_user(username='user1', password='password', email='user1@example.com')
+        self.client.force_authenticate(user=self.user1)
+
+    def put_range(self, url, start, end):
+        return self.client.put(
+            url, self.data[start:end + 1], content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.data)}',
+        )
+
+    def test_resumable_upload(self):
+        response = self.client.post(reverse('uploads'), {'size': len(self.data), 'caption': 'hi #upload'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        url = reverse('upload-detail', kwargs={'session_id': response.data['id']})
+
+        middle = len(self.data) // 2
+        response = self.put_range(url, 0, middle - 1)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['format'], response.data['width']), ('jpeg', 64))
+
+        response = self.put_range(url, 0, middle - 1)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['received'], middle)
+
+        self.assertEqual(self.client.get(url).data['received'], middle)
+        self.assertEqual(self.put_range(url, middle, len(self.data) - 1).data['received'], len(self.data))
+
+        response = self.client.post(url + 'finalize/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        post = Post.objects.get(id=response.data['id'])
+        self.assertEqual((post.user, post.caption), (self.user1, 'hi #upload'))
+        self.assertEqual(post.post_hashtags.get().hashtag.name, 'upload')
+
+    def upload(self):
+        session = UploadSession.objects.create(user=self.user1, size=len(self.data), caption='#again')
+        url = reverse('upload-detail', kwargs={'session_id': session.id})
+        self.put_range(url, 0, len(self.data) - 1)
+        return url + 'finalize/'
+
+    def test_post_is_published_on_commit(self):
+        url = self.upload()
+        with mock.patch('apis.views.publish_post') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.client.post(url).status_code, status.HTTP_201_CREATED)
+                publish.assert_not_called()
+        publish.assert_called_once()
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_failed_indexing_creates_nothing(self):
+        url = self.upload()
+        with mock.patch('apis.views.hashtags.index_posts', side_effect=DatabaseError), \
+                mock.patch('apis.views.publish_post') as publish, \
+                self.captureOnCommitCallbacks(execute=True), self.assertRaises(DatabaseError), \
+                self.assertLogs('django.request', 'ERROR'):
+            self.client.post(url)
+        publish.assert_not_called()
+        self.assertFalse(Post.objects.exists())
+        self.assertTrue(UploadSession.objects.exists())
+
+    def test_upload_size_limit(self):
+        with override_settings(UPLOAD_MAX_SIZE=10):
+            response = self.client.post(reverse('uploads'), {'size': 11})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_of_other_user(self):
+        session = UploadSession.objects.create(user=self.user1, size=len(self.data))
+        other = User.objects.create_user(username='user2', password='password', email='user2@example.com')
+        self.client.force_authenticate(user=other)
+        url = reverse('upload-detail', kwargs={'session_id': session.id})
+        self.assertEqual(self.put_range(url, 0, 9).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class MediaServingTestCase(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.digest = '0' * 63 + 'a'
+        self.content = bytes(range(256)) * 4
+        for name in ['posts/photo.jpg', f'posts/{self.digest}.jpg', 'uploads/partial/x.part']:
+            os.makedirs(os.path.join(media_root, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(media_root, name), 'wb') as file:
+                file.write(self.content)
+
+    def get(self, path, **headers):
+        return self.client.get('/media/' + path, headers=headers)
+
+    def test_full_response(self):
+        response = self.get('posts/photo.jpg')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_content_addressed_is_immutable(self):
+        response = self.get(f'posts/{self.digest}.jpg')
+        self.assertEqual(response['ETag'], f'"{self.digest}"')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_not_modified(self):
+        etag = self.get('posts/photo.jpg')['ETag']
+        response = self.get('posts/photo.jpg', If_None_Match=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_range(self):
+        response = self.get('posts/photo.jpg', Range='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '10')
+
+        response = self.get('posts/photo.jpg', Range='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+
+    def test_range_not_satisfiable(self):
+        response = self.get('posts/photo.jpg', Range=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_stale_if_range_gets_full_body(self):
+        response = self.get('posts/photo.jpg', Range='bytes=0-9', If_Range='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(MEDIA_SENDFILE_BACKEND='x-accel-redirect')
+    def test_x_accel_redirect(self):
+        response = self.get('posts/photo.jpg')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/posts/photo.jpg')
+        self.assertEqual(response.content, b'')
+
+    def test_private_and_missing_files(self):
+        self.assertEqual(self.get('uploads/partial/x.part').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.get('posts/../uploads/partial/x.part').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.get('../settings.py').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.get('posts/missing.jpg').status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(MEDIA_REQUIRE_AUTHENTICATION=True)
+    def test_authentication_required(self):
+        self.assertEqual(self.get('posts/photo.jpg').status_code, status.HTTP_404_NOT_FOUND)
+        user = User.objects.create_user(username='user1', password='password', email='user1@example.com')
+        self.client.force_login(user)
+        response = self.get('posts/photo.jpg')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Cache-Control'].startswith('private'))
+
+
+class ExploreAPITestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password', email='user1@example.com')
+        self.user2 = User.objects.create_user(username='user2', password='password', email='user2@example.com')
+        self.user2.followers.add(self.user1)
+        self.post1 = Post.objects.create(user=self.user1, image='image1.jpg', caption='caption1')
+        self.post2 = Post.objects.create(user=self.user2, image='image2.jpg', caption='caption2')
+        Like.objects.create(user=self.user1, post=self.post2)
+        Like.objects.create(user=self.user2, post=self.post2)
+        Like.objects.create(user=self.user2, post=self.post1)
+        ranking.refresh()
+        self.url = reverse('explore')
+
+    def test_get_explore(self):
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([post['id'] for post in results], [self.post2.id, self.post1.id])
+        self.assertEqual(
+            [(post['liked_by_me'], post['author_followed']) for post in results],
+            [(True, True), (False, False)]
+        )
+        self.assertTrue(results[0]['url'].startswith('http://testserver/'))
+        self.assertNotIn('user_id', results[0])
+
+    @mock.patch.object(api_settings, 'PAGE_SIZE', 1)
+    def test_explore_pagination(self):
+        self.client.force_authenticate(user=self.user1)
+        first = self.client.get(self.url)
+        second = self.client.get(first.data['next'])
+        self.assertEqual([post['id'] for post in second.data['results']], [self.post1.id])
+        self.assertIsNone(second.data['next'])
+
+    def test_get_explore_without_authentication(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
 class PostDetailAPITestCase(APITestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username='user1', password='password', email='user1@example.com')
@@ -270,6 +721,7 @@ class PostDetailAPITestCase(APITestCase):
 
 class LikeToggleAPITestCase(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user1 = User.objects.create_user(username='user1', password='password', email='user1@example.com')
         self.user2 = User.objects.create_user(username='user2', password='password', email='user2@example.com')
         self.post1 = Post.objects.create(user=self.user1, image='image1.jpg', caption='caption1')
@@ -280,14 +732,37 @@ class LikeToggleAPITestCase(APITestCase):
         response = self.client.post(url)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(self.post1.likes.count(), 1)
+        self.post1.refresh_from_db()
+        self.assertEqual(self.post1.likes_count, 1)
 
     def test_unlike_post(self):
         Like.objects.create(user=self.user2, post=self.post1)
+        Post.objects.filter(id=self.post1.id).update(likes_count=1)
         self.client.force_authenticate(user=self.user2)
         url = reverse('like', kwargs={'post_id': self.post1.id})
         response = self.client.post(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(self.post1.likes.count(), 0)
+        self.post1.refresh_from_db()
+        self.assertEqual(self.post1.likes_count, 0)
+
+    def test_put_like_is_idempotent(self):
+        self.client.force_authenticate(user=self.user2)
+        url = reverse('like', kwargs={'post_id': self.post1.id})
+        self.client.put(url)
+        response = self.client.put(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['liked'])
+        self.assertEqual(response.data['likes_count'], 1)
+        self.assertEqual(self.post1.likes.count(), 1)
+
+    def test_delete_like_is_idempotent(self):
+        self.client.force_authenticate(user=self.user2)
+        url = reverse('like', kwargs={'post_id': self.post1.id})
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['liked'])
+        self.assertEqual(response.data['likes_count'], 0)
 
     def test_like_post_without_authentication(self):
         url = reverse('like', kwargs={'post_id': self.post1.id})
@@ -320,6 +795,14 @@ class CommentListCreateAPITestCase(APITestCase):
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_comment_updates_counter(self):
+        self.client.force_authenticate(user=self.user2)
+        url = reverse('comments', kwargs={'post_id': self.post1.id})
+        response = self.client.post(url, {'text': 'This is a comment'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.post1.refresh_from_db()
+        self.assertEqual(self.post1.comments_count, 1)
+
     def test_get_comments(self):
         self.client.force_authenticate(user=self.user2)
         url = reverse('comments', kwargs={'post_id': self.post1.id})
@@ -331,3 +814,149 @@ class CommentListCreateAPITestCase(APITestCase):
         url = reverse('comments', kwargs={'post_id': self.post1.id})
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class KeysetPaginationTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='password', email='user1@example.com')
+        self.post1 = Post.objects.create(user=self.user1, image='image1.jpg', caption='caption1')
+        self.comments = [
+            Comment.objects.create(user=self.user1, post=self.post1, text=f'comment{i}')
+            for i in range(3)
+        ]
+        self.url = reverse('comments', kwargs={'post_id': self.post1.id})
+
+    @mock.patch.object(KeysetPagination, 'page_size', 2)
+    def test_follow_next_cursor(self):
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(
+            [comment['text'] for comment in response.data['results']],
+            ['comment2', 'comment1']
+        )
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [comment['text'] for comment in response.data['results']],
+            ['comment0']
+        )
+        self.assertIsNone(response.data['next'])
+
+    @mock.patch.object(KeysetPagination, 'page_size', 2)
+    def test_ties_on_created_at(self):
+        Comment.objects.filter(post=self.post1).update(created_at=self.comments[0].created_at)
+        self.client.force_authenticate(user=self.user1)
+        first = self.client.get(self.url)
+        second = self.client.get(first.data['next'])
+        texts = [comment['text'] for comment in first.data['results'] + second.data['results']]
+        self.assertEqual(texts, ['comment2', 'comment1', 'comment0'])
+
+    def test_invalid_cursor(self):
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(self.url + '?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ChatHistoryAPITestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user1', password='password', email='user1@example.com')
+        self.room = Room.objects.create(name='lobby')
+        for index in range(3):
+            Message.objects.create(room=self.room, user=self.user, body=str(index))
+        self.url = reverse('chat-history', args=['lobby'])
+
+    def test_history_pages(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['message'] for item in response.data['results']], ['2', '1', '0'])
+        self.assertEqual(response.data['results'][0]['user'], 'user1')
+        self.assertIsNone(response.data['next'])
+
+    def test_missing_room(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('chat-history', args=['nowhere']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_cursor(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(self.url, {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_requires_authentication(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class InboxAPITestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='password', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', password='password', email='bob@example.com')
+        self.carol = User.objects.create_user(username='carol', password='password', email='carol@example.com')
+        self.with_bob = inbox.open_conversation(self.alice, 'bob')
+        self.with_carol = inbox.open_conversation(self.alice, 'carol')
+        self.url = reverse('chat-inbox')
+
+    def send(self, conversation, sender, body):
+        message = Message.objects.create(room=conversation.room, user=sender, body=body)
+        item = history.entry(message.id, sender.username, body, message.created_at)
+        inbox.sent(conversation.id, conversation.member_ids, sender.id, item)
+
+    def test_inbox_orders_by_activity(self):
+        self.send(self.with_bob, self.bob, 'hi alice')
+        self.send(self.with_carol, self.carol, 'hey')
+        self.send(self.with_bob, self.bob, 'still there?')
+
+        self.client.force_authenticate(user=self.alice)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([item['user'] for item in results], ['bob', 'carol'])
+        self.assertEqual([item['unread'] for item in results], [2, 1])
+        self.assertEqual(results[0]['last_message']['message'], 'still there?')
+
+        self.client.force_authenticate(user=self.bob)
+        results = self.client.get(self.url).data['results']
+        self.assertEqual([(item['user'], item['unread']) for item in results], [('alice', 0)])
+
+    def test_inbox_pages(self):
+        self.send(self.with_bob, self.bob, 'one')
+        self.send(self.with_carol, self.carol, 'two')
+        self.client.force_authenticate(user=self.alice)
+        with mock.patch.object(InboxPagination, 'page_size', 1):
+            first = self.client.get(self.url).data
+            second = self.client.get(first['next']).data
+        self.assertEqual([item['user'] for item in first['results'] + second['results']], ['carol', 'bob'])
+        self.assertIsNone(second['next'])
+
+    def test_mark_read(self):
+        self.send(self.with_bob, self.bob, 'hi alice')
+        url = reverse('conversation-read', args=[self.with_bob.id])
+        self.client.force_authenticate(user=self.carol)
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.force_authenticate(user=self.alice)
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(self.url).data['results'][0]['unread'], 0)
+
+    def test_conversation_history_is_private(self):
+        self.send(self.with_bob, self.bob, 'secret')
+        url = reverse('conversation-history', args=[self.with_bob.id])
+        self.client.force_authenticate(user=self.alice)
+        response = self.client.get(url)
+        self.assertEqual([item['message'] for item in response.data['results']], ['secret'])
+
+        self.client.force_authenticate(user=self.carol)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('chat-history', args=[self.with_bob.room.name]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_requires_authentication(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
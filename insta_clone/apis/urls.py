@@ -1,10 +1,17 @@
 from django.urls import path
 
 from .views import (
-    UserListAPIView, UserDetailAPIView,
-    FollowToggleView, PostListCreateAPIView,
+    UserListAPIView, UserSearchAPIView,
+    UserDetailAPIView,
+    FollowToggleView, FollowersListAPIView,
+    FollowingListAPIView, PostListCreateAPIView,
     PostDetailAPIView, LikeToggleView,
-    CommentListCreateAPIView,
+    CommentListCreateAPIView, PostSearchAPIView,
+    ExploreAPIView, TrendingTagsAPIView,
+    TagPostListAPIView, UploadSessionCreateView,
+    UploadSessionView, UploadFinalizeView,
+    ChatHistoryAPIView, InboxAPIView,
+    ConversationHistoryAPIView, ConversationReadView,
 )
 
 
@@ -14,6 +21,11 @@ urlpatterns = [
         UserListAPIView.as_view(), 
         name='users'
     ),
+    path(
+        "search/users/",
+        UserSearchAPIView.as_view(),
+        name='user-search'
+    ),
     path(
         "users/<str:username>/", 
         UserDetailAPIView.as_view(), 
@@ -24,11 +36,56 @@ urlpatterns = [
         FollowToggleView.as_view(), 
         name='follow'
     ),
+    path(
+        "users/<str:username>/followers/", 
+        FollowersListAPIView.as_view(), 
+        name='followers'
+    ),
+    path(
+        "users/<str:username>/following/", 
+        FollowingListAPIView.as_view(), 
+        name='following'
+    ),
     path(
         "posts/",
         PostListCreateAPIView.as_view(),
         name='posts'
     ),
+    path(
+        "posts/search/",
+        PostSearchAPIView.as_view(),
+        name='post-search'
+    ),
+    path(
+        "uploads/",
+        UploadSessionCreateView.as_view(),
+        name='uploads'
+    ),
+    path(
+        "uploads/<uuid:session_id>/",
+        UploadSessionView.as_view(),
+        name='upload-detail'
+    ),
+    path(
+        "uploads/<uuid:session_id>/finalize/",
+        UploadFinalizeView.as_view(),
+        name='upload-finalize'
+    ),
+    path(
+        "explore/",
+        ExploreAPIView.as_view(),
+        name='explore'
+    ),
+    path(
+        "tags/trending/",
+        TrendingTagsAPIView.as_view(),
+        name='trending-tags'
+    ),
+    path(
+        "tags/<str:tag>/",
+        TagPostListAPIView.as_view(),
+        name='tag-posts'
+    ),
     path(
         "posts/<int:post_id>/",
         PostDetailAPIView.as_view(),
@@ -43,5 +100,25 @@ urlpatterns = [
         "posts/<int:post_id>/comments/",
         CommentListCreateAPIView.as_view(),
         name='comments'
-    )
+    ),
+    path(
+        "chat/rooms/<str:room_name>/messages/",
+        ChatHistoryAPIView.as_view(),
+        name='chat-history'
+    ),
+    path(
+        "chat/inbox/",
+        InboxAPIView.as_view(),
+        name='chat-inbox'
+    ),
+    path(
+        "chat/conversations/<int:conversation_id>/messages/",
+        ConversationHistoryAPIView.as_view(),
+        name='conversation-history'
+    ),
+    path(
+        "chat/conversations/<int:conversation_id>/read/",
+        ConversationReadView.as_view(),
+        name='conversation-read'
+    ),
 ]
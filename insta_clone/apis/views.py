@@ -1,29 +1,56 @@
-from django.db.models import Count
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
 
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema
 
 from rest_framework import generics, status, filters
+from rest_framework.exceptions import NotFound
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
+from rest_framework.throttling import ScopedRateThrottle
 from rest_framework.views import APIView
 
+from apis.pagination import (
+    KeysetPagination, UserKeysetPagination,
+    IdKeysetPagination, WindowPagination,
+    PagePagination, RankKeysetPagination,
+    ChatHistoryPagination, InboxPagination,
+)
 from apis.permissions import IsProfileOwnerOrAdmin, IsPostOwnerOrAdmin
-from apis.schemas import user_register_schema, post_list_create_schema
-from apis.tasks import send_profile_creation_email
+from apis.schemas import (
+    user_register_schema, user_search_schema,
+    post_list_create_schema, post_search_schema,
+    explore_schema, tag_posts_schema, trending_tags_schema,
+    chat_history_schema, inbox_schema,
+    conversation_history_schema, conversation_read_schema,
+)
+from apis.tasks import (
+    send_profile_creation_email, fan_out_post,
+    remove_post_from_timelines, rebuild_timeline,
+    render_post_image, render_profile_picture,
+)
+
+from chat import inbox
+from chat.models import Room, Conversation
 
+from users import follows
+from users import search as user_search
 from users.models import User
 from users.serializers import (
     UserSerializer, UserDetailSerializer,
-    UserRegisterSerializer,
+    UserRegisterSerializer, UserSearchSerializer,
 )
 
-from posts.models import Post, Like, Comment
+from posts import counters, explore, hashtags, likes, ranking, timeline, uploads
+from posts import search as post_search
+from posts.models import Post, Comment, UploadSession
 from posts.serializers import (
     PostSerializer, PostDetailSerializer,
-    CommentSerializer, 
+    CommentSerializer, TrendingTagSerializer,
+    UploadSessionSerializer,
 )
 
 
@@ -51,6 +78,7 @@ class UserRegisterView(APIView):
 
 class UserListAPIView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
+    pagination_class = UserKeysetPagination
     filter_backends = [filters.SearchFilter]
     search_fields = ['username',]
 
@@ -58,13 +86,23 @@ class UserListAPIView(generics.ListAPIView):
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
-    queryset = User.objects.annotate(
-        followers_count=Count('followers', distinct=True),
-        following_count=Count('following', distinct=True)
-    ).order_by('-date_joined')
+    queryset = User.objects.order_by('-date_joined')
     serializer_class = UserSerializer
 
 
+@user_search_schema
+class UserSearchAPIView(APIView):
+    """Username typeahead backed by a prefix index instead of ``SearchFilter``."""
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'user_search'
+
+    def get(self, request):
+        users = user_search.search(request.query_params.get('q'))
+        serializer = UserSearchSerializer(users, many=True, context={'request': request})
+        return Response(serializer.data)
+
+
 class UserDetailAPIView(APIView):
     permission_classes = [IsAuthenticated, IsProfileOwnerOrAdmin]
 
@@ -72,13 +110,7 @@ class UserDetailAPIView(APIView):
         return UserDetailSerializer(*args, **kwargs)
     
     def get(self, request, username):
-        user = get_object_or_404(
-            User.objects.annotate(
-                followers_count=Count('followers', distinct=True),
-                following_count=Count('following', distinct=True)
-            ),
-            username=username
-        )
+        user = get_object_or_404(User, username=username)
         serializer = UserDetailSerializer(user)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -89,7 +121,14 @@ class UserDetailAPIView(APIView):
         self.check_object_permissions(request, user)
 
         if serializer.is_valid():
-            serializer.save()
+            previous = user.profile_picture.name
+            user = serializer.save()
+            if 'profile_picture' in serializer.validated_data:
+                # Saving took a new reference even to identical content
+                if previous:
+                    user.profile_picture.storage.delete(previous)
+                if user.profile_picture:
+                    render_profile_picture.delay(user.id, user.profile_picture.name)
             return Response(serializer.data, status=status.HTTP_200_OK)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -105,37 +144,103 @@ class UserDetailAPIView(APIView):
 
 
 class FollowToggleView(APIView):
+    """
+    POST toggles the follow state; PUT and DELETE idempotently
+    follow/unfollow for clients that know the desired state.
+    """
     permission_classes = [IsAuthenticated]
 
-    @extend_schema(exclude=True)
-    def post(self, request, username):
-        """Toggle follow/unfollow action."""
-        target_user = get_object_or_404(User, username=username)
+    def change(self, request, username, operation):
+        target_user = get_object_or_404(User.objects.only('id'), username=username)
 
-        if request.user == target_user:
+        if request.user.id == target_user.id:
             return Response({"error": "You cannot follow yourself"}, 
                             status=status.HTTP_400_BAD_REQUEST)
 
-        if request.user in target_user.followers.all():
-            target_user.followers.remove(request.user)
-            message = "Unfollowed successfully"
-        else:
-            target_user.followers.add(request.user)
-            message = "Followed successfully"
+        result = operation(request.user.id, target_user.id)
+        if result is None:
+            # Deleted since it was looked up.
+            raise NotFound("User not found.")
+
+        if result.changed and result.is_following:
+            timeline.add_author(request.user.id, target_user.id)
+        elif result.changed:
+            timeline.remove_author(request.user.id, target_user.id)
 
+        message = "Followed successfully" if result.is_following else "Unfollowed successfully"
         return Response({
                 "message": message, 
-                "is_following": request.user in target_user.followers.all()
+                "is_following": result.is_following,
+                "followers_count": result.followers_count,
             }, 
              status=status.HTTP_200_OK
             )
 
+    @extend_schema(exclude=True)
+    def post(self, request, username):
+        """Toggle follow/unfollow action."""
+        return self.change(request, username, follows.toggle)
+
+    @extend_schema(exclude=True)
+    def put(self, request, username):
+        """Follow, doing nothing if already following."""
+        return self.change(request, username, follows.follow)
+
+    @extend_schema(exclude=True)
+    def delete(self, request, username):
+        """Unfollow, doing nothing if not following."""
+        return self.change(request, username, follows.unfollow)
+
+
+class FollowersListAPIView(generics.ListAPIView):
+    """
+    Users following ``username``, most recent follows first, paginated by
+    keyset over the ``followers`` through table.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = UserSerializer
+    pagination_class = IdKeysetPagination
+    filter_column = 'from_user_id'
+    related_user = 'to_user'
+
+    def get_queryset(self):
+        user = get_object_or_404(User.objects.only('id'), username=self.kwargs['username'])
+        return (
+            User.followers.through.objects
+            .filter(**{self.filter_column: user.id})
+            .select_related(self.related_user)
+        )
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        users = [getattr(row, self.related_user) for row in page]
+        serializer = self.get_serializer(users, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class FollowingListAPIView(FollowersListAPIView):
+    """Users that ``username`` follows, most recent follows first."""
+    filter_column = 'to_user_id'
+    related_user = 'from_user'
+
 
 #Posts
+def publish_post(post, tags):
+    """Count a new post's hashtags and queue its renditions and fan-out."""
+    hashtags.record(tags)
+    if post.image:
+        render_post_image.delay(post.id, post.image.name)
+    fan_out_post.delay(post.id)
+
+
 @post_list_create_schema
 class PostListCreateAPIView(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = PostSerializer
+    pagination_class = KeysetPagination
+
+    def get_posts(self):
+        return Post.objects.select_related('user')
 
     def get_queryset(self):
         user = self.request.user
@@ -146,17 +251,47 @@ class PostListCreateAPIView(generics.ListCreateAPIView):
         followed_users = user.following.all()
 
         return (
-            Post.objects.filter(user__in=followed_users)
-            .annotate(
-                likes_count=Count('likes', distinct=True),
-                comments_count=Count('comments', distinct=True)
-            )
-            .select_related('user') 
+            self.get_posts()
+            .filter(user__in=followed_users)
             .order_by('-created_at')
         )
 
+    def list(self, request, *args, **kwargs):
+        """Serve the feed from the materialized timeline when it is warm."""
+        if request.query_params.get('order') == 'ranked':
+            return self.list_ranked(request)
+
+        position = self.paginator.get_position(request)
+        post_ids = timeline.get_post_ids(
+            request.user.id, before=position,
+            count=self.paginator.page_size + 1
+        )
+
+        if post_ids is None:
+            rebuild_timeline.delay(request.user.id)
+            return super().list(request, *args, **kwargs)
+
+        posts = timeline.hydrate(post_ids, self.get_posts())
+        page = self.paginator.paginate_results(posts)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def list_ranked(self, request):
+        """Serve the feed from the user's cached ranked window."""
+        paginator = WindowPagination()
+        post_ids = paginator.paginate_window(
+            lambda snapshot: ranking.ranked_window(request.user.id, snapshot), request
+        )
+        posts = timeline.hydrate(post_ids, self.get_posts())
+        serializer = self.get_serializer(posts, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            post = serializer.save(user=self.request.user)
+            tags = hashtags.index_posts([post])[post.id]
+
+        publish_post(post, tags)
 
 
 class PostDetailAPIView(APIView):
@@ -165,16 +300,12 @@ class PostDetailAPIView(APIView):
 
     def get(self, request, post_id):
         post = get_object_or_404(
-        Post.objects.annotate(
-            likes_count=Count('likes', distinct=True),
-            comments_count=Count('comments', distinct=True)
-        )
-        .select_related('user') 
+        Post.objects.select_related('user') 
         .prefetch_related('comments__user') 
         , id=post_id
         )
 
-        serializer = PostDetailSerializer(post)
+        serializer = PostDetailSerializer(post, context={'request': request})
         return Response(serializer.data)
 
     def delete(self, request, post_id):
@@ -183,31 +314,177 @@ class PostDetailAPIView(APIView):
         self.check_object_permissions(request, post) 
 
         post.delete()
+        remove_post_from_timelines.delay(post_id, post.user_id)
         return Response({"message": "Post deleted successfully"}, 
                         status=status.HTTP_204_NO_CONTENT)
     
 
+class UploadSessionCreateView(generics.CreateAPIView):
+    """Start a resumable image upload; see ``posts.uploads``."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = UploadSessionSerializer
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'uploads'
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+
+class UploadSessionView(APIView):
+    """
+    GET reports how many bytes were received, PUT appends the byte range
+    given by ``Content-Range`` from the raw request body, DELETE cancels.
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'uploads'
+
+    def get_serializer(self, *args, **kwargs):
+        return UploadSessionSerializer(*args, **kwargs)
+
+    def get(self, request, session_id):
+        session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+        return Response(UploadSessionSerializer(session).data)
+
+    @extend_schema(request={'application/octet-stream': OpenApiTypes.BINARY})
+    def put(self, request, session_id):
+        # The body is read straight from the stream; request.data is never
+        # touched, so nothing is buffered by the parsers.
+        try:
+            session = uploads.write_range(
+                session_id, request.user,
+                request.headers.get('Content-Range'), request.stream,
+            )
+        except UploadSession.DoesNotExist:
+            raise NotFound("Upload not found.")
+        except uploads.OffsetMismatch as error:
+            return Response({"detail": str(error), "received": error.received},
+                            status=status.HTTP_409_CONFLICT)
+        except uploads.UploadError as error:
+            return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(UploadSessionSerializer(session).data)
+
+    def delete(self, request, session_id):
+        session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+        uploads.discard(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadFinalizeView(APIView):
+    """Turn a completely uploaded session into a post."""
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'uploads'
+
+    @extend_schema(request=None, responses={201: PostSerializer})
+    def post(self, request, session_id):
+        session = get_object_or_404(
+            UploadSession.objects.select_related('user'), id=session_id, user=request.user
+        )
+        try:
+            with transaction.atomic():
+                post = uploads.finalize(session)
+                tags = hashtags.index_posts([post])[post.id]
+                transaction.on_commit(lambda: publish_post(post, tags))
+        except uploads.UploadError as error:
+            return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = PostSerializer(post, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@post_search_schema
+class PostSearchAPIView(generics.ListAPIView):
+    """Full-text caption search, best match first."""
+    permission_classes = [IsAuthenticated]
+    pagination_class = RankKeysetPagination
+    serializer_class = PostSerializer
+
+    def get_queryset(self):
+        return post_search.search_posts(
+            self.request.query_params.get('q'),
+            Post.objects.select_related('user'),
+        )
+
+
+@tag_posts_schema
+class TagPostListAPIView(generics.ListAPIView):
+    """Posts carrying a hashtag, newest first, from the ``PostHashtag`` index."""
+    permission_classes = [IsAuthenticated]
+    pagination_class = IdKeysetPagination
+    serializer_class = PostSerializer
+
+    def get_queryset(self):
+        return Post.objects.select_related('user').filter(
+            post_hashtags__hashtag__name=hashtags.normalize(self.kwargs['tag'])
+        )
+
+
+@trending_tags_schema
+class TrendingTagsAPIView(APIView):
+    """Most used hashtags over the sliding window, from Redis counters."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        serializer = TrendingTagSerializer(
+            [{'tag': tag, 'uses': uses} for tag, uses in hashtags.trending()],
+            many=True,
+        )
+        return Response(serializer.data)
+
+
+@explore_schema
+class ExploreAPIView(APIView):
+    """Trending posts, served from pages pre-rendered by ``refresh_explore``."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        paginator = PagePagination()
+        rows = paginator.paginate_pages(explore.get_page, request)
+        return paginator.get_paginated_response(explore.apply_viewer(rows, request))
+
+
 class LikeToggleView(APIView):
+    """
+    POST toggles the like; PUT and DELETE idempotently like/unlike for
+    clients that know the desired state. Each is a single SQL statement.
+    """
     permission_classes = [IsAuthenticated]
 
+    def respond(self, result, status_code=status.HTTP_200_OK):
+        if result is None:
+            raise NotFound("Post not found.")
+
+        return Response({
+                "message": "Liked post" if result.liked else "Unliked post",
+                "liked": result.liked,
+                "likes_count": result.likes_count,
+            },
+            status=status_code
+        )
+
     @extend_schema(exclude=True)
     def post(self, request, post_id):
-        user = request.user
-        post = get_object_or_404(Post, id=post_id)
-        like, created = Like.objects.get_or_create(user=user, post=post)
+        result = likes.toggle(request.user.id, post_id)
 
-        if not created:
-            like.delete()
-            return Response({"message": "Unliked post"}, 
-                            status=status.HTTP_200_OK)
+        if result is not None and result.liked:
+            return self.respond(result, status.HTTP_201_CREATED)
+        return self.respond(result)
 
-        return Response({"message": "Liked post"}, 
-                        status=status.HTTP_201_CREATED)
+    @extend_schema(exclude=True)
+    def put(self, request, post_id):
+        return self.respond(likes.like(request.user.id, post_id))
+
+    @extend_schema(exclude=True)
+    def delete(self, request, post_id):
+        return self.respond(likes.unlike(request.user.id, post_id))
 
 
 class CommentListCreateAPIView(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = CommentSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         post_id = self.kwargs['post_id']
@@ -216,4 +493,54 @@ class CommentListCreateAPIView(generics.ListCreateAPIView):
     def perform_create(self, serializer):
         post_id = self.kwargs['post_id']
         post = Post.objects.get(id=post_id)  
-        serializer.save(user=self.request.user, post=post)
+
+        with transaction.atomic():
+            serializer.save(user=self.request.user, post=post)
+            counters.increment(post.id, 'comments_count')
+
+
+#Chat
+@chat_history_schema
+class ChatHistoryAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, room_name):
+        # Direct-message rooms are only listed to their participants
+        room = get_object_or_404(Room, name=room_name, conversation__isnull=True)
+        paginator = ChatHistoryPagination()
+        results = paginator.paginate_history(room.id, request)
+        return paginator.get_paginated_response(results)
+
+
+@inbox_schema
+class InboxAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        paginator = InboxPagination()
+        results = paginator.paginate_inbox(request.user.id, request)
+        return paginator.get_paginated_response(results)
+
+
+@conversation_history_schema
+class ConversationHistoryAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, conversation_id):
+        conversation = get_object_or_404(
+            Conversation, id=conversation_id, participants__user=request.user
+        )
+        paginator = ChatHistoryPagination()
+        results = paginator.paginate_history(conversation.room_id, request)
+        return paginator.get_paginated_response(results)
+
+
+@conversation_read_schema
+class ConversationReadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, conversation_id):
+        if not Conversation.objects.filter(id=conversation_id, participants__user=request.user).exists():
+            raise NotFound()
+        inbox.mark_read(conversation_id, request.user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
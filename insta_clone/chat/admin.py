@@ -1,3 +1,35 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Room, Message, Conversation, Participant
+
+
+@admin.register(Room)
+class RoomAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'created_at')
+    search_fields = ('name',)
+    ordering = ('name',)
+    readonly_fields = ('created_at',)
+
+
+@admin.register(Message)
+class MessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'room', 'user', 'body', 'created_at')
+    list_filter = ('created_at', 'room')
+    search_fields = ('body', 'user__username', 'room__name')
+    ordering = ('-created_at',)
+    readonly_fields = ('created_at',)
+
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'room', 'last_activity_at', 'created_at')
+    search_fields = ('room__name',)
+    ordering = ('-last_activity_at',)
+    readonly_fields = ('created_at',)
+
+
+@admin.register(Participant)
+class ParticipantAdmin(admin.ModelAdmin):
+    list_display = ('id', 'conversation', 'user', 'unread_count', 'last_activity_at')
+    search_fields = ('user__username', 'conversation__room__name')
+    ordering = ('-last_activity_at',)
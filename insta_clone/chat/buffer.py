@@ -0,0 +1,139 @@
+"""
+Write-behind persistence of chat messages.
+
+Consumers hand each message to the process-wide ``MessageBuffer`` and
+return immediately; the buffer writes everything queued with one
+``bulk_create`` once ``CHAT_FLUSH_SIZE`` messages are waiting or
+``CHAT_FLUSH_INTERVAL_MS`` after the first of them arrived, whichever
+comes first. Relaying a message therefore never waits for the database.
+
+Ids are reserved from the table's sequence ``CHAT_ID_BLOCK_SIZE`` at a
+time, so each message has its final id (for history cursors) before it is
+stored, at the cost of one query per block rather than per message.
+
+Messages still buffered when the process dies are lost, at most one
+interval's worth. A batch that fails to write is retried, but while the
+database is unavailable no more than ``CHAT_BUFFER_MAX_PENDING`` messages
+are kept; the oldest beyond that are dropped.
+"""
+import asyncio
+import logging
+from collections import deque
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+
+from channels.db import database_sync_to_async
+
+from .models import Message, Room
+
+logger = logging.getLogger(__name__)
+
+
+@database_sync_to_async
+def get_room_id(name):
+    """Return the id of the room called ``name``, creating it if needed."""
+    return Room.objects.get_or_create(name=name)[0].id
+
+
+@database_sync_to_async
+def _reserve_ids(count):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+            [Message._meta.db_table, count],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class IdAllocator:
+    def __init__(self):
+        self.reserved = deque()
+
+    async def next(self):
+        """Return an unused ``Message`` id."""
+        if not self.reserved:
+            self.reserved.extend(await _reserve_ids(settings.CHAT_ID_BLOCK_SIZE))
+        return self.reserved.popleft()
+
+
+class MessageBuffer:
+    def __init__(self):
+        self.pending = []
+        self._timer = None
+        self._flushes = set()
+
+    def add(self, message):
+        """Queue an unsaved ``Message``; must be called from the event loop."""
+        self.pending.append(message)
+        loop = asyncio.get_running_loop()
+        if len(self.pending) >= settings.CHAT_FLUSH_SIZE:
+            self._cancel_timer()
+            self._spawn(loop, self.flush())
+        elif self._timer is None or self._timer.get_loop() is not loop or self._timer.done():
+            self._timer = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(settings.CHAT_FLUSH_INTERVAL_MS / 1000)
+        self._timer = None
+        await self.flush()
+
+    def _cancel_timer(self):
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+        self._timer = None
+
+    def _spawn(self, loop, coroutine):
+        # Keep a reference so the task is not garbage collected mid-flush.
+        task = loop.create_task(coroutine)
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self):
+        """Write every queued message, returning how many were written."""
+        batch, self.pending = self.pending, []
+        if not batch:
+            return 0
+        try:
+            await database_sync_to_async(Message.objects.bulk_create)(batch)
+        except IntegrityError:
+            # e.g. a room was deleted; store the rest of the batch one by one.
+            stored, unsaved = await database_sync_to_async(self._store_each)(batch)
+            self._retry(unsaved)
+            return stored
+        except DatabaseError:
+            logger.exception("Could not store %d chat messages; retrying", len(batch))
+            self._retry(batch)
+            return 0
+        return len(batch)
+
+    def _retry(self, batch):
+        """Put ``batch`` back in front of the queue and flush again later."""
+        if not batch:
+            return
+        self.pending[:0] = batch
+        overflow = len(self.pending) - settings.CHAT_BUFFER_MAX_PENDING
+        if overflow > 0:
+            logger.error("Dropped %d chat messages waiting for the database", overflow)
+            del self.pending[:overflow]
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.get_running_loop().create_task(self._flush_later())
+
+    def _store_each(self, batch):
+        """Return how many messages were stored and those left for a retry."""
+        stored = 0
+        for index, message in enumerate(batch):
+            try:
+                with transaction.atomic():
+                    message.save(force_insert=True)
+            except IntegrityError:
+                logger.exception("Dropped chat message %s", message.id)
+            except DatabaseError:
+                logger.exception("Could not store %d chat messages; retrying", len(batch) - index)
+                return stored, batch[index:]
+            else:
+                stored += 1
+        return stored, []
+
+ids = IdAllocator()
+buffer = MessageBuffer()
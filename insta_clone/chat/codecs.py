@@ -0,0 +1,105 @@
+"""
+Wire formats for ``ChatConsumer``.
+
+Clients pick a format with the WebSocket subprotocol:
+
+* ``chat.json`` - compact JSON text frames, encoded with ``orjson`` when it
+  is installed and the standard library otherwise;
+* ``chat.msgpack`` - MessagePack binary frames, available when ``msgpack``
+  is installed (it is pinned in requirements.txt).
+
+Connections that offer neither get the JSON format, so existing clients
+keep working. Relayed messages are encoded once per format when they are
+sent to the group, and every member forwards the pre-encoded frame for its
+format instead of encoding the same payload again. Several pre-encoded
+frames are joined into one array frame without decoding them.
+"""
+import json
+import struct
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JsonCodec:
+    name = 'json'
+    subprotocol = 'chat.json'
+    binary = False
+
+    if orjson is not None:
+        def encode(self, payload):
+            return orjson.dumps(payload).decode()
+
+        def decode(self, data):
+            return orjson.loads(data)
+    else:
+        def encode(self, payload):
+            return json.dumps(payload, separators=(',', ':'))
+
+        def decode(self, data):
+            return json.loads(data)
+
+    def join(self, frames):
+        return '[' + ','.join(frames) + ']'
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+    subprotocol = 'chat.msgpack'
+    binary = True
+
+    def encode(self, payload):
+        return msgpack.packb(payload, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+    def join(self, frames):
+        count = len(frames)
+        if count < 16:
+            header = bytes([0x90 | count])
+        elif count < 1 << 16:
+            header = b'\xdc' + struct.pack('>H', count)
+        else:
+            header = b'\xdd' + struct.pack('>I', count)
+        return header + b''.join(frames)
+
+
+CODECS = {codec.name: codec for codec in [JsonCodec()] + ([MsgpackCodec()] if msgpack else [])}
+
+DEFAULT = CODECS['json']
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def negotiate(offered):
+    """Return the first codec among the ``offered`` subprotocols, or ``None``."""
+    for subprotocol in offered or []:
+        for codec in CODECS.values():
+            if codec.subprotocol == subprotocol:
+                return codec
+    return None
+
+
+def decode(codec, text_data=None, bytes_data=None):
+    """Decode an inbound frame; JSON text is accepted on every connection."""
+    try:
+        if bytes_data is not None and codec.binary:
+            return codec.decode(bytes_data)
+        return DEFAULT.decode(text_data if text_data is not None else bytes_data)
+    except Exception as error:
+        raise DecodeError(str(error)) from error
+
+
+def encode_all(payload):
+    """Encode ``payload`` once for each format, keyed by codec name."""
+    return {name: codec.encode(payload) for name, codec in CODECS.items()}
@@ -1,35 +1,216 @@
-import json
+import logging
 
+from django.conf import settings
+from django.utils import timezone
+
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from . import codecs, history, inbox, presence, ratelimit
+from .outbound import OutboundQueue
+from .buffer import buffer, get_room_id, ids
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    async def get_room_name(self):
+        """The room to join, or ``None`` to refuse the connection."""
+        room_name = self.scope["url_route"]["kwargs"]["room_name"]
+        # Direct-message rooms are only reachable through DirectMessageConsumer
+        return None if inbox.is_direct(room_name) else room_name
+
     async def connect(self):
-        self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
+        self.room_name = await self.get_room_name()
+        if self.room_name is None:
+            await self.close()
+            return
         self.room_group_name = f"chat_{self.room_name}"
+        self.room_id = await get_room_id(self.room_name)
+
+        # See chat.codecs; clients that offer no known subprotocol get JSON.
+        codec = codecs.negotiate(self.scope.get("subprotocols"))
+        self.codec = codec or codecs.DEFAULT
 
         # Join room group
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
 
-        await self.accept()
+        await self.accept(subprotocol=codec.subprotocol if codec else None)
+        self.outbound = OutboundQueue(self)
+
+        # Only signed-in users appear in the roster
+        user = self.scope.get("user")
+        self.username = user.username if user is not None and user.is_authenticated else None
+        self.typing = False
+        self.limits = ratelimit.Limits(user.pk if self.username else None)
+        if self.username:
+            await presence.join(self.room_id, self.username, self.channel_name)
+            await self.presence_changed()
 
     async def disconnect(self, close_code):
+        if getattr(self, "room_name", None) is None:
+            return
         # Leave room group
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
+        if hasattr(self, "outbound"):
+            self.outbound.close()
+        if getattr(self, "username", None):
+            await presence.leave(self.room_id, self.username, self.channel_name)
+            await self.presence_changed()
+
+    async def presence_changed(self):
+        await presence.changed(self.channel_layer, self.room_id, self.room_group_name)
+
+    async def send_frame(self, frame):
+        if self.codec.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def send_payload(self, payload):
+        await self.send_frame(self.codec.encode(payload))
+
+    async def limited(self, code):
+        """Apply ``CHAT_RATE_ACTION`` to a frame over a limit; see chat.ratelimit."""
+        action = settings.CHAT_RATE_ACTION
+        if action == 'close':
+            logger.warning("Closing chat connection %s: over limit (%d)", self.channel_name, code)
+            await self.close(code=code)
+        elif action == 'warn':
+            error = "Frame too large" if code == ratelimit.TOO_LARGE else "Rate limited"
+            await self.send_payload({"type": "error", "error": error})
+
     # Receive message from WebSocket
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json["message"]
+    async def receive(self, text_data=None, bytes_data=None):
+        # Checked before decoding, so oversized or flooding frames cost little
+        code = self.limits.frame(text_data if text_data is not None else bytes_data)
+        if code is not None:
+            await self.limited(code)
+            return
+
+        try:
+            payload = codecs.decode(self.codec, text_data, bytes_data)
+        except codecs.DecodeError:
+            await self.send_payload({"type": "error", "error": "Malformed frame"})
+            return
+        if not isinstance(payload, dict):
+            await self.send_payload({"type": "error", "error": "Malformed frame"})
+            return
+
+        command = payload.get("command")
+        if command == "history":
+            await self.send_history(payload)
+            return
+        if command == "ping":
+            if self.username and await presence.heartbeat(self.room_id, self.username, self.channel_name):
+                await self.presence_changed()
+            await self.send_payload({"type": "pong"})
+            return
+        if command == "typing":
+            if self.username and await presence.typing(self.room_id, self.username):
+                self.typing = True
+                await self.presence_changed()
+            return
+        if command is not None:
+            await self.handle_command(command, payload)
+            return
+
+        message = payload.get("message")
+        if not isinstance(message, str) or not message:
+            await self.send_payload({"type": "error", "error": "Invalid message"})
+            return
+        if not await self.limits.message():
+            await self.limited(ratelimit.RATE_LIMITED)
+            return
+
+        user = self.scope.get("user")
+        user_id = user.pk if user is not None and user.is_authenticated else None
+        message_id = await ids.next()
+        created_at = timezone.now()
 
-        # Send message to room group
+        # Stored in the background; see chat.buffer.
+        buffer.add(Message(
+            id=message_id, room_id=self.room_id, user_id=user_id,
+            body=message, created_at=created_at,
+        ))
+        item = history.entry(message_id, user.username if user_id else None, message, created_at)
+        await history.push(self.room_id, item)
+
+        # Sending ends the typing indicator; only ask Redis if one was set
+        if self.typing:
+            self.typing = False
+            if await presence.stopped_typing(self.room_id, self.username):
+                await self.presence_changed()
+
+        # Send message to room group, encoded once per wire format
         await self.channel_layer.group_send(
-            self.room_group_name, {"type": "chat.message", "message": message}
+            self.room_group_name, {
+                "type": "chat.message",
+                "frames": codecs.encode_all({"type": "message", **item}),
+            }
+        )
+        await self.message_sent(item)
+
+    async def handle_command(self, command, payload):
+        await self.send_payload({"type": "error", "error": "Unknown command"})
+
+    async def message_sent(self, item):
+        """Called once a message has been relayed to the room."""
+
+    async def send_history(self, command):
+        """Reply to ``{"command": "history", "before": <cursor>, "limit": <n>}``."""
+        try:
+            position = history.decode_cursor(command["before"]) if command.get("before") else None
+            limit = min(int(command.get("limit") or settings.CHAT_HISTORY_PAGE_SIZE),
+                        settings.CHAT_HISTORY_PAGE_SIZE)
+        except (TypeError, ValueError):
+            await self.send_payload({"type": "error", "error": "Invalid history command"})
+            return
+
+        items, next_position = await database_sync_to_async(history.page)(
+            self.room_id, position, max(limit, 1)
         )
+        await self.send_payload({
+            "type": "history",
+            "messages": items,
+            "next": history.encode_cursor(next_position) if next_position else None,
+        })
 
     # Receive message from room group
     async def chat_message(self, event):
-        message = event["message"]
+        # Queue the frame pre-encoded for this connection's format; see chat.outbound
+        self.outbound.put(event["frames"][self.codec.name])
 
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({"message": message}))
\ No newline at end of file
+    # Receive a coalesced roster/typing snapshot from room group
+    async def chat_presence(self, event):
+        self.outbound.put(event["frames"][self.codec.name], presence=True)
+
+
+class DirectMessageConsumer(ChatConsumer):
+    """The signed-in user's conversation with ``username``; see chat.inbox."""
+
+    async def get_room_name(self):
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            return None
+        conversation = await database_sync_to_async(inbox.open_conversation)(
+            user, self.scope["url_route"]["kwargs"]["username"]
+        )
+        if conversation is None:
+            return None
+        self.conversation_id = conversation.id
+        self.member_ids = conversation.member_ids
+        return conversation.room.name
+
+    async def handle_command(self, command, payload):
+        if command == "read":
+            await database_sync_to_async(inbox.mark_read)(self.conversation_id, self.scope["user"].pk)
+            return
+        await super().handle_command(command, payload)
+
+    async def message_sent(self, item):
+        await database_sync_to_async(inbox.sent)(
+            self.conversation_id, self.member_ids, self.scope["user"].pk, item
+        )
@@ -0,0 +1,135 @@
+"""
+Chat history.
+
+The newest ``CHAT_HISTORY_SIZE`` messages of each room are kept in a
+capped Redis list (``chat:history:<room_id>``, newest first), pushed as
+they are relayed. History pages are cut from that list and continue in
+the database from the oldest listed message's ``(created_at, id)``
+position, so a reconnecting client's first pages never touch Postgres.
+
+Message ids are allocated before the write-behind buffer stores the row
+(see ``chat.buffer``), so listed messages already carry their final
+position and cursors stay valid once the rows land.
+"""
+import asyncio
+import base64
+import json
+import weakref
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from django_redis import get_redis_connection
+from redis import asyncio as aioredis
+
+from .models import Message
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_connection():
+    return get_redis_connection('default')
+
+
+def get_async_connection():
+    """An asyncio Redis client on the cache's server, one per event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = aioredis.from_url(settings.CACHES['default']['LOCATION'])
+    return _async_clients[loop]
+
+
+def history_key(room_id):
+    return f"chat:history:{room_id}"
+
+
+def entry(message_id, username, body, created_at):
+    return {
+        "id": message_id,
+        "user": username,
+        "message": body,
+        "created_at": created_at.isoformat(),
+    }
+
+
+def position_of(item):
+    return parse_datetime(item["created_at"]), item["id"]
+
+
+def encode_cursor(position):
+    created_at, pk = position
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{pk}".encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor into a position; raises ``ValueError`` if malformed."""
+    try:
+        value, pk = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').rsplit('|', 1)
+    except (TypeError, UnicodeError, AttributeError):
+        raise ValueError(cursor)
+    created_at = parse_datetime(value)
+    if created_at is None:
+        raise ValueError(cursor)
+    return created_at, int(pk)
+
+
+async def push(room_id, item):
+    """Add a relayed message to the head of the room's list."""
+    key = history_key(room_id)
+    async with get_async_connection().pipeline(transaction=False) as pipe:
+        pipe.lpush(key, json.dumps(item))
+        pipe.ltrim(key, 0, settings.CHAT_HISTORY_SIZE - 1)
+        await pipe.execute()
+
+
+def _listed(room_id):
+    # Concurrent writers and cold-list refills may interleave or repeat
+    # entries, so order by position and drop duplicates.
+    items = {}
+    for raw in get_connection().lrange(history_key(room_id), 0, -1):
+        item = json.loads(raw)
+        items[item["id"]] = item
+    return sorted(items.values(), key=position_of, reverse=True)
+
+
+def _stored(room_id, position, limit):
+    messages = Message.objects.filter(room_id=room_id)
+    if position is not None:
+        created_at, pk = position
+        messages = messages.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+        )
+    messages = messages.select_related('user').order_by('-created_at', '-id')[:limit]
+    return [
+        entry(message.id, message.user.username if message.user else None, message.body, message.created_at)
+        for message in messages
+    ]
+
+
+def page(room_id, position=None, limit=None):
+    """
+    Return ``(items, next_position)`` for up to ``limit`` messages older
+    than ``position``, newest first. ``next_position`` is ``None`` on the
+    last page.
+    """
+    limit = limit or settings.CHAT_HISTORY_PAGE_SIZE
+    listed = _listed(room_id)
+    items = [item for item in listed if position is None or position_of(item) < position]
+
+    if len(items) <= limit:
+        # Continue below the list (or the cursor, if that is older).
+        start = position_of(items[-1]) if items else position
+        stored = _stored(room_id, start, limit + 1 - len(items))
+        if not listed and position is None and stored:
+            # Refill a cold list; newer messages pushed meanwhile stay ahead.
+            key = history_key(room_id)
+            pipe = get_connection().pipeline()
+            pipe.rpush(key, *[json.dumps(item) for item in stored[:settings.CHAT_HISTORY_SIZE]])
+            pipe.ltrim(key, 0, settings.CHAT_HISTORY_SIZE - 1)
+            pipe.execute()
+        items += stored
+
+    has_next = len(items) > limit
+    items = items[:limit]
+    return items, position_of(items[-1]) if has_next else None
@@ -0,0 +1,303 @@
+"""
+Direct-message conversations and inboxes.
+
+A conversation between two users is a ``Room`` named ``dm_<id>_<id>`` with
+a ``Participant`` row per user. Its messages go through the same buffer and
+history as any room; ``DirectMessageConsumer`` serves it at
+``ws/dm/<username>/``.
+
+Inboxes are kept in Redis and updated as messages are sent and read, so
+listing one never counts messages:
+
+* ``chat:inbox:<user_id>`` - sorted set of the user's conversations scored
+  by last activity;
+* ``chat:unread:<user_id>`` - hash of unread counts per conversation;
+* ``chat:conversation:<id>`` - hash with the members' usernames and the
+  last message, the inbox preview.
+
+Sending and reading are Lua scripts that refuse to touch an inbox not yet
+loaded from the database (marked by the ``LOADED`` member). The caller loads
+it and retries, so a flushed Redis refills without losing updates. Changed
+conversations are marked in ``chat:inbox:dirty`` and the periodic
+``persist_inboxes`` task copies their counts and previews to the database.
+"""
+import json
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from django_redis import get_redis_connection
+
+from .models import Conversation, Participant, Room
+
+User = get_user_model()
+
+DIRTY_KEY = 'chat:inbox:dirty'
+DIRECT_PREFIX = 'dm_'
+
+# Sorted-set member marking a loaded inbox; scored below every activity.
+LOADED = '0'
+
+# KEYS: conversation, dirty, then each member's inbox and unread keys
+# ARGV: conversation id, timestamp, last message, sender id, member ids...
+# Returns the members whose inbox is not loaded, changing nothing if any.
+_SENT = """
+local cold = {}
+for i = 1, #ARGV - 4 do
+    if not redis.call('ZSCORE', KEYS[1 + 2 * i], '0') then
+        table.insert(cold, ARGV[4 + i])
+    end
+end
+if #cold > 0 then return cold end
+
+redis.call('HSET', KEYS[1], 'last', ARGV[3])
+for i = 1, #ARGV - 4 do
+    redis.call('ZADD', KEYS[1 + 2 * i], ARGV[2], ARGV[1])
+    if ARGV[4 + i] ~= ARGV[4] then
+        redis.call('HINCRBY', KEYS[2 + 2 * i], ARGV[1], 1)
+    end
+end
+redis.call('SADD', KEYS[2], ARGV[1])
+return cold
+"""
+
+# KEYS: inbox, unread, dirty; ARGV: conversation id, user id
+_READ = """
+if not redis.call('ZSCORE', KEYS[1], '0') then return {ARGV[2]} end
+if redis.call('HDEL', KEYS[2], ARGV[1]) == 1 then
+    redis.call('SADD', KEYS[3], ARGV[1])
+end
+return {}
+"""
+
+# KEYS: inbox, unread; ARGV: (conversation id, timestamp, unread count)...
+_LOAD = """
+if redis.call('ZSCORE', KEYS[1], '0') then return 0 end
+redis.call('ZADD', KEYS[1], 0, '0')
+for i = 1, #ARGV, 3 do
+    redis.call('ZADD', KEYS[1], ARGV[i + 1], ARGV[i])
+    if ARGV[i + 2] ~= '0' then
+        redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 2])
+    end
+end
+return 1
+"""
+
+
+def get_connection():
+    return get_redis_connection('default')
+
+
+def inbox_key(user_id):
+    return f"chat:inbox:{user_id}"
+
+
+def unread_key(user_id):
+    return f"chat:unread:{user_id}"
+
+
+def conversation_key(conversation_id):
+    return f"chat:conversation:{conversation_id}"
+
+
+def room_name(*user_ids):
+    low, high = sorted(user_ids)
+    return f"{DIRECT_PREFIX}{low}_{high}"
+
+
+def is_direct(name):
+    return name.startswith(DIRECT_PREFIX)
+
+
+def open_conversation(user, username):
+    """
+    Return ``user``'s conversation with ``username``, creating it on first
+    use, or ``None`` if there is no such other user. The conversation's
+    ``member_ids`` are set on it.
+    """
+    peer = User.objects.filter(username=username).exclude(pk=user.pk).first()
+    if peer is None:
+        return None
+
+    with transaction.atomic():
+        room, _ = Room.objects.get_or_create(name=room_name(user.pk, peer.pk))
+        conversation, created = Conversation.objects.get_or_create(room=room)
+        if created:
+            Participant.objects.bulk_create([
+                Participant(conversation=conversation, user=user),
+                Participant(conversation=conversation, user=peer),
+            ])
+    # Refreshed on every open, so renamed users catch up.
+    get_connection().hset(conversation_key(conversation.id), 'members', json.dumps({
+        user.pk: user.username, peer.pk: peer.username,
+    }))
+    conversation.room = room
+    conversation.member_ids = [user.pk, peer.pk]
+    return conversation
+
+
+def _retry_cold(run):
+    # A script returns the users whose inbox must be loaded before it applies.
+    cold = run()
+    if cold:
+        load([int(user_id) for user_id in cold])
+        run()
+
+
+def sent(conversation_id, member_ids, sender_id, item):
+    """Record a message ``item`` (see ``chat.history.entry``) sent to a conversation."""
+    conn = get_connection()
+    script = conn.register_script(_SENT)
+    keys = [conversation_key(conversation_id), DIRTY_KEY]
+    for user_id in member_ids:
+        keys += [inbox_key(user_id), unread_key(user_id)]
+    timestamp = datetime.fromisoformat(item["created_at"]).timestamp()
+    args = [conversation_id, repr(timestamp), json.dumps(item), sender_id, *member_ids]
+    _retry_cold(lambda: script(keys=keys, args=args))
+
+
+def mark_read(conversation_id, user_id):
+    conn = get_connection()
+    script = conn.register_script(_READ)
+    keys = [inbox_key(user_id), unread_key(user_id), DIRTY_KEY]
+    _retry_cold(lambda: script(keys=keys, args=[conversation_id, user_id]))
+
+
+def load(user_ids):
+    """Fill the Redis inboxes of ``user_ids`` from the database, unless already loaded."""
+    participants = (
+        Participant.objects.filter(user_id__in=user_ids)
+        .select_related('conversation')
+        .order_by()
+    )
+    inboxes = defaultdict(list)
+    conversations = {}
+    for participant in participants:
+        conversation = participant.conversation
+        conversations[conversation.id] = conversation
+        # Conversations without messages stay out of the inbox.
+        if conversation.last_message is not None:
+            inboxes[participant.user_id] += [
+                conversation.id,
+                repr(participant.last_activity_at.timestamp()),
+                participant.unread_count,
+            ]
+
+    members = defaultdict(dict)
+    for participant in Participant.objects.filter(conversation_id__in=conversations).select_related('user'):
+        members[participant.conversation_id][participant.user_id] = participant.user.username
+
+    conn = get_connection()
+    script = conn.register_script(_LOAD)
+    pipe = conn.pipeline(transaction=False)
+    # Previews newer than the database's are kept.
+    for conversation in conversations.values():
+        key = conversation_key(conversation.id)
+        pipe.hsetnx(key, 'members', json.dumps(members[conversation.id]))
+        if conversation.last_message is not None:
+            pipe.hsetnx(key, 'last', json.dumps(conversation.last_message))
+    for user_id in user_ids:
+        script(keys=[inbox_key(user_id), unread_key(user_id)], args=inboxes[user_id], client=pipe)
+    pipe.execute()
+
+
+def page(user_id, position=None, limit=None):
+    """
+    Return ``(items, next_position)`` for up to ``limit`` conversations of
+    ``user_id`` that come after ``position``, most recently active first.
+    Positions are ``(score, member)`` pairs as stored in the inbox.
+    """
+    limit = limit or settings.CHAT_INBOX_PAGE_SIZE
+    conn = get_connection()
+    key = inbox_key(user_id)
+
+    pipe = conn.pipeline(transaction=False)
+    pipe.zscore(key, LOADED)
+    if position is None:
+        pipe.zrevrangebyscore(key, '+inf', '(0', start=0, num=limit + 1, withscores=True)
+    else:
+        score, conversation_id = position
+        # Sorted sets order ties by member, newest (greatest) first in reverse.
+        pipe.zrevrangebyscore(key, score, score, withscores=True)
+        pipe.zrevrangebyscore(key, f'({score}', '(0', start=0, num=limit + 1, withscores=True)
+    loaded, *ranges = pipe.execute()
+    if loaded is None:
+        load([user_id])
+        return page(user_id, position, limit)
+
+    entries = ranges[0]
+    if position is not None:
+        ties = [entry for entry in ranges[0] if entry[0] < str(position[1]).encode()]
+        entries = ties + ranges[1]
+    has_next = len(entries) > limit
+    entries = entries[:limit]
+    if not entries:
+        return [], None
+
+    ids = [member.decode() for member, _ in entries]
+    pipe = conn.pipeline(transaction=False)
+    pipe.hmget(unread_key(user_id), ids)
+    for conversation_id in ids:
+        pipe.hmget(conversation_key(conversation_id), 'members', 'last')
+    unread, *details = pipe.execute()
+
+    items = []
+    for (member, score), count, (members, last) in zip(entries, unread, details):
+        peers = [name for pk, name in json.loads(members or '{}').items() if pk != str(user_id)]
+        items.append({
+            "id": int(member),
+            "user": peers[0] if peers else None,
+            "unread": int(count or 0),
+            "last_message": json.loads(last) if last else None,
+            "last_activity_at": datetime.fromtimestamp(score, dt_timezone.utc).isoformat(),
+        })
+    member, score = entries[-1]
+    return items, (score, member.decode()) if has_next else None
+
+
+def persist(max_conversations=1000):
+    """
+    Copy counts and previews of changed conversations to the database. If
+    the write fails the conversations stay marked as changed.
+    """
+    conn = get_connection()
+    ids = [int(value) for value in conn.spop(DIRTY_KEY, max_conversations) or []]
+    if not ids:
+        return 0
+
+    participants = list(Participant.objects.filter(conversation_id__in=ids).order_by())
+    pipe = conn.pipeline(transaction=False)
+    for conversation_id in ids:
+        pipe.hget(conversation_key(conversation_id), 'last')
+    for participant in participants:
+        pipe.zscore(inbox_key(participant.user_id), participant.conversation_id)
+        pipe.hget(unread_key(participant.user_id), participant.conversation_id)
+    values = pipe.execute()
+    previews, rest = values[:len(ids)], values[len(ids):]
+
+    conversations = []
+    for conversation_id, last in zip(ids, previews):
+        if last is not None:
+            last_message = json.loads(last)
+            conversations.append(Conversation(
+                id=conversation_id, last_message=last_message,
+                last_activity_at=datetime.fromisoformat(last_message["created_at"]),
+            ))
+    for index, participant in enumerate(participants):
+        score, unread = rest[2 * index], rest[2 * index + 1]
+        participant.unread_count = int(unread or 0)
+        if score is not None:
+            participant.last_activity_at = datetime.fromtimestamp(score, dt_timezone.utc)
+
+    try:
+        with transaction.atomic():
+            Conversation.objects.bulk_update(conversations, ['last_message', 'last_activity_at'])
+            Participant.objects.bulk_update(participants, ['unread_count', 'last_activity_at'])
+    except Exception:
+        # Marked again so the next run retries them.
+        conn.sadd(DIRTY_KEY, *ids)
+        raise
+    return len(ids)
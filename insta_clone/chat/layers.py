@@ -0,0 +1,165 @@
+"""
+A channel layer sharded over several child layers (e.g. one
+``RedisChannelLayer`` per Redis host).
+
+Group names (``chat_<room>``) are placed on a consistent-hash ring with
+``virtual_nodes`` points per shard, so each room's membership and fan-out
+live on exactly one shard and adding or removing a shard only moves the
+rooms that land on (or leave) it - about ``1/n`` of them.
+
+Channels are sticky per process: every channel a layer instance creates
+lives on that process's home shard (picked on the same ring) and its name
+carries the shard, ``<shard>.<child channel name>``, so direct sends route
+without a lookup. A channel that joins a group on another shard also
+listens there, and only there, for as long as it is a member. Child layers
+share one client prefix so they accept each other's channel names.
+
+Each shard a channel listens on has one long-lived reader task feeding the
+channel's local queue. A child receive in flight may already have popped a
+message (``RedisChannelLayer``'s ``BZPOPMIN``), so readers are only cancelled
+once the channel leaves that shard or stops receiving altogether.
+"""
+import asyncio
+import bisect
+import hashlib
+import os
+import socket
+from collections import defaultdict
+
+from django.utils.module_loading import import_string
+
+from channels.layers import BaseChannelLayer
+
+
+def _point(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of keys onto named nodes."""
+
+    def __init__(self, nodes, virtual_nodes=160):
+        points = sorted(
+            (_point(f"{node}#{replica}"), node)
+            for node in nodes
+            for replica in range(virtual_nodes)
+        )
+        self.points = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        index = bisect.bisect(self.points, _point(key)) % len(self.points)
+        return self.nodes[index]
+
+
+class ShardedChannelLayer(BaseChannelLayer):
+    extensions = ["groups", "flush"]
+
+    def __init__(self, shards, virtual_nodes=160, **kwargs):
+        super().__init__(**kwargs)
+        self.shards = {
+            name: import_string(config["BACKEND"])(**config.get("CONFIG", {}))
+            for name, config in shards.items()
+        }
+        prefixes = [layer.client_prefix for layer in self.shards.values() if hasattr(layer, "client_prefix")]
+        for layer in self.shards.values():
+            if prefixes and hasattr(layer, "client_prefix"):
+                layer.client_prefix = prefixes[0]
+
+        self.ring = HashRing(self.shards, virtual_nodes)
+        self.home = self.ring.node_for(f"{socket.gethostname()}:{os.getpid()}:{id(self)}")
+        # channel -> shard -> groups joined there, for this process's channels
+        self.memberships = defaultdict(lambda: defaultdict(set))
+        # channel -> messages read from any shard; (channel, shard) -> reader
+        self.queues = {}
+        self.readers = {}
+
+    def shard_for_group(self, group):
+        return self.ring.node_for(group)
+
+    def split(self, channel):
+        shard, _, name = channel.partition(".")
+        if shard not in self.shards or not name:
+            raise ValueError(f"Channel {channel!r} does not belong to a shard")
+        return shard, name
+
+    # Channel layer API
+
+    async def new_channel(self, prefix="specific."):
+        name = await self.shards[self.home].new_channel(prefix)
+        return f"{self.home}.{name}"
+
+    async def send(self, channel, message):
+        shard, name = self.split(channel)
+        await self.shards[shard].send(name, message)
+
+    async def receive(self, channel):
+        home, _ = self.split(channel)
+        if channel not in self.queues:
+            self.queues[channel] = asyncio.Queue()
+        for shard in {home, *self.memberships.get(channel, ())}:
+            self.listen(channel, shard)
+        try:
+            return await self.queues[channel].get()
+        except asyncio.CancelledError:
+            # A consumer cancels its receive when it stops; once it has left
+            # its groups nothing more is owed to the channel.
+            if not self.memberships.get(channel):
+                self.stop(channel)
+            raise
+
+    def listen(self, channel, shard):
+        if (channel, shard) not in self.readers:
+            self.readers[channel, shard] = asyncio.get_running_loop().create_task(
+                self._read(channel, shard)
+            )
+
+    def stop(self, channel, shard=None):
+        for key in list(self.readers):
+            if key[0] == channel and (shard is None or key[1] == shard):
+                self.readers.pop(key).cancel()
+        if shard is None:
+            self.queues.pop(channel, None)
+
+    async def _read(self, channel, shard):
+        _, name = self.split(channel)
+        queue = self.queues[channel]
+        while True:
+            queue.put_nowait(await self.shards[shard].receive(name))
+
+    async def flush(self):
+        for layer in self.shards.values():
+            await layer.flush()
+
+    async def close(self):
+        for layer in self.shards.values():
+            if hasattr(layer, "close_pools"):
+                await layer.close_pools()
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        shard = self.shard_for_group(group)
+        home, name = self.split(channel)
+        await self.shards[shard].group_add(group, name)
+        if shard != home:
+            self.memberships[channel][shard].add(group)
+            if channel in self.queues:
+                self.listen(channel, shard)
+
+    async def group_discard(self, group, channel):
+        shard = self.shard_for_group(group)
+        _, name = self.split(channel)
+        await self.shards[shard].group_discard(group, name)
+        joined = self.memberships.get(channel)
+        if joined is not None and shard in joined:
+            joined[shard].discard(group)
+            if not joined[shard]:
+                # Only messages for the groups just left can be in flight there.
+                del joined[shard]
+                self.stop(channel, shard)
+            if not joined:
+                del self.memberships[channel]
+
+    async def group_send(self, group, message):
+        await self.shards[self.shard_for_group(group)].group_send(group, message)
@@ -1,3 +1,104 @@
+from django.contrib.auth import get_user_model
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+User = get_user_model()
+
+
+class Room(models.Model):
+    name = models.CharField(
+        max_length=100, unique=True
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    def __str__(self):
+        return self.name
+
+
+class Message(models.Model):
+    room = models.ForeignKey(
+        Room, on_delete=models.CASCADE,
+        related_name='messages'
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL,
+        related_name='chat_messages',
+        null=True, blank=True
+    )
+    body = models.TextField(
+
+    )
+    # Set when the consumer receives the message, not when the buffer
+    # writes it, so history keeps the order users saw.
+    created_at = models.DateTimeField(
+        default=timezone.now
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['room', '-created_at', '-id'],
+                name='message_room_created_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.room} | {self.user} | {self.body}"
+
+
+class Conversation(models.Model):
+    """A direct-message conversation; its messages are those of ``room``."""
+    room = models.OneToOneField(
+        Room, on_delete=models.CASCADE,
+        related_name='conversation'
+    )
+    # Copied from Redis periodically (see chat.inbox).
+    last_message = models.JSONField(
+        null=True, blank=True
+    )
+    last_activity_at = models.DateTimeField(
+        default=timezone.now
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    def __str__(self):
+        return str(self.room)
+
+
+class Participant(models.Model):
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE,
+        related_name='participants'
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        related_name='conversations'
+    )
+    # Copied from Redis periodically (see chat.inbox).
+    unread_count = models.PositiveIntegerField(
+        default=0
+    )
+    last_activity_at = models.DateTimeField(
+        default=timezone.now
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['conversation', 'user'],
+                name='participant_unique'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-last_activity_at'],
+                name='participant_user_activity_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} in {self.conversation}"
@@ -0,0 +1,185 @@
+"""
+Per-connection outbound queues.
+
+Group events no longer await the socket: ``ChatConsumer`` puts each
+pre-encoded frame on its connection's ``OutboundQueue`` and goes back to
+draining the channel layer, so a stalled client cannot make events pile
+up there. A writer task sends whatever is queued, joining bursts of up to
+``CHAT_OUTBOUND_MAX_BATCH`` frames into one array frame (see
+``chat.codecs``); a newer presence snapshot replaces a queued one.
+
+A queue may hold ``CHAT_OUTBOUND_MAX_QUEUE`` frames, the oldest no more
+than ``CHAT_OUTBOUND_MAX_LAG_MS`` old. Past either limit the connection is
+lagging and ``CHAT_OUTBOUND_OVERFLOW`` decides: ``'drop'`` discards the
+oldest frames and tells the client how many it missed, ``'close'`` closes
+the socket so the client reconnects and catches up from history.
+
+Each process keeps running totals and publishes them with the deepest
+queue seen to the ``chat:outbound:stats`` hash every
+``CHAT_OUTBOUND_STATS_INTERVAL`` seconds; ``read_stats`` collects them.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .history import get_async_connection, get_connection
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = 'chat:outbound:stats'
+
+# Application close code for connections that fell too far behind.
+LAGGING = 4008
+
+
+class OutboundStats:
+    def __init__(self):
+        self.process = f"{socket.gethostname()}:{os.getpid()}"
+        self.queues = set()
+        self.sent_frames = 0
+        self.sent_batches = 0
+        self.dropped = 0
+        self.closed = 0
+        self.max_depth = 0
+        self.published_at = time.monotonic()
+        self._publishing = None
+
+    def observe(self, depth):
+        self.max_depth = max(self.max_depth, depth)
+        now = time.monotonic()
+        if now - self.published_at >= settings.CHAT_OUTBOUND_STATS_INTERVAL:
+            self.published_at = now
+            # Keep a reference so the task is not garbage collected.
+            self._publishing = asyncio.get_running_loop().create_task(self.publish())
+
+    def snapshot(self):
+        return {
+            "connections": len(self.queues),
+            "queued": sum(len(queue) for queue in self.queues),
+            "max_depth": self.max_depth,
+            "sent_frames": self.sent_frames,
+            "sent_batches": self.sent_batches,
+            "dropped": self.dropped,
+            "closed": self.closed,
+        }
+
+    async def publish(self):
+        snapshot = self.snapshot()
+        self.max_depth = 0
+        async with get_async_connection().pipeline(transaction=False) as pipe:
+            pipe.hset(STATS_KEY, self.process, json.dumps(snapshot))
+            # Processes that stop publishing age out with the hash.
+            pipe.expire(STATS_KEY, max(settings.CHAT_OUTBOUND_STATS_INTERVAL * 6, 60))
+            await pipe.execute()
+
+
+stats = OutboundStats()
+
+
+def read_stats():
+    """Return the last published stats of each process, keyed by host:pid."""
+    return {
+        process.decode(): json.loads(value)
+        for process, value in get_connection().hgetall(STATS_KEY).items()
+    }
+
+
+class OutboundQueue:
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.codec = consumer.codec
+        # (enqueued at, frame, is presence snapshot)
+        self.frames = deque()
+        self.missed = 0
+        # When the oldest frame of the batch being sent was queued.
+        self.sending_since = None
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._writer = asyncio.get_running_loop().create_task(self._write())
+        stats.queues.add(self)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def put(self, frame, presence=False):
+        if self.closed:
+            return
+        now = time.monotonic()
+        if presence:
+            # Only the newest roster matters.
+            self.frames = deque(entry for entry in self.frames if not entry[2])
+        if self._lagging(now):
+            self._overflow(now)
+            if self.closed:
+                return
+        self.frames.append((now, frame, presence))
+        self._ready.set()
+        stats.observe(len(self.frames))
+
+    def _lagging(self, now):
+        if len(self.frames) >= settings.CHAT_OUTBOUND_MAX_QUEUE:
+            return True
+        # A send stuck on a stalled socket counts, even with nothing queued behind it.
+        oldest = self.sending_since or (self.frames[0][0] if self.frames else None)
+        return oldest is not None and now - oldest > settings.CHAT_OUTBOUND_MAX_LAG_MS / 1000
+
+    def _overflow(self, now):
+        if settings.CHAT_OUTBOUND_OVERFLOW == 'close':
+            logger.warning("Closing chat connection %s: %d frames behind",
+                           self.consumer.channel_name, len(self.frames))
+            stats.closed += 1
+            self.close()
+            self._closing = asyncio.get_running_loop().create_task(self.consumer.close(code=LAGGING))
+            return
+
+        cutoff = now - settings.CHAT_OUTBOUND_MAX_LAG_MS / 1000
+        dropped = 0
+        # Drop everything too old, and at least enough to make room.
+        while self.frames and (
+            self.frames[0][0] < cutoff or len(self.frames) >= settings.CHAT_OUTBOUND_MAX_QUEUE
+        ):
+            self.frames.popleft()
+            dropped += 1
+        self.missed += dropped
+        stats.dropped += dropped
+
+    async def _write(self):
+        try:
+            await self._drain()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket is gone; the consumer's disconnect cleans up.
+            logger.debug("Chat writer for %s stopped", self.consumer.channel_name, exc_info=True)
+            self.close()
+
+    async def _drain(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self.frames:
+                if self.missed:
+                    notice = self.codec.encode({"type": "dropped", "count": self.missed})
+                    self.missed = 0
+                    await self.consumer.send_frame(notice)
+
+                count = min(len(self.frames), settings.CHAT_OUTBOUND_MAX_BATCH)
+                self.sending_since = self.frames[0][0]
+                batch = [self.frames.popleft()[1] for _ in range(count)]
+                await self.consumer.send_frame(batch[0] if count == 1 else self.codec.join(batch))
+                self.sending_since = None
+                stats.sent_frames += count
+                stats.sent_batches += 1
+
+    def close(self):
+        self.closed = True
+        self.frames.clear()
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        stats.queues.discard(self)
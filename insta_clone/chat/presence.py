@@ -0,0 +1,132 @@
+"""
+Presence and typing indicators.
+
+Who is in a room lives in a sorted set per room (``chat:presence:<room_id>``)
+scored by each connection's last heartbeat; connections that stop pinging
+for ``CHAT_PRESENCE_TTL`` seconds drop out. Typing users live in
+``chat:typing:<room_id>`` scored by when the indicator lapses. Repeated
+typing notifications are debounced with ``SET NX PX`` per user, so a burst
+of keystrokes costs one Redis write per ``CHAT_TYPING_DEBOUNCE_MS``.
+
+Changes are never broadcast one by one. The first change in a room claims
+``chat:presence:pending:<room_id>`` and, ``CHAT_PRESENCE_INTERVAL_MS``
+later, sends a single roster-and-typing snapshot to the group; changes in
+between ride along. Presence therefore costs at most one group message per
+room per interval, whatever the number of events or members.
+"""
+import asyncio
+import time
+
+from django.conf import settings
+
+from . import codecs
+from .history import get_async_connection
+
+_tasks = set()
+
+
+def presence_key(room_id):
+    return f"chat:presence:{room_id}"
+
+
+def typing_key(room_id):
+    return f"chat:typing:{room_id}"
+
+
+def typing_debounce_key(room_id, username):
+    return f"chat:typing:{room_id}:{username}"
+
+
+def pending_key(room_id):
+    return f"chat:presence:pending:{room_id}"
+
+
+def member(username, channel_name):
+    # One entry per connection, so a second tab closing keeps the user online.
+    return f"{username}|{channel_name}"
+
+
+async def join(room_id, username, channel_name):
+    key = presence_key(room_id)
+    async with get_async_connection().pipeline(transaction=False) as pipe:
+        pipe.zadd(key, {member(username, channel_name): time.time()})
+        pipe.expire(key, settings.CHAT_PRESENCE_TTL * 2)
+        await pipe.execute()
+
+
+async def heartbeat(room_id, username, channel_name):
+    """Refresh a connection; returns whether lapsed connections were dropped."""
+    now = time.time()
+    key = presence_key(room_id)
+    async with get_async_connection().pipeline(transaction=False) as pipe:
+        pipe.zadd(key, {member(username, channel_name): now})
+        pipe.zremrangebyscore(key, '-inf', now - settings.CHAT_PRESENCE_TTL)
+        pipe.expire(key, settings.CHAT_PRESENCE_TTL * 2)
+        _, dropped, _ = await pipe.execute()
+    return dropped > 0
+
+
+async def leave(room_id, username, channel_name):
+    async with get_async_connection().pipeline(transaction=False) as pipe:
+        pipe.zrem(presence_key(room_id), member(username, channel_name))
+        pipe.zrem(typing_key(room_id), username)
+        await pipe.execute()
+
+
+async def typing(room_id, username):
+    """Mark ``username`` as typing; returns ``False`` while debounced."""
+    conn = get_async_connection()
+    debounce = settings.CHAT_TYPING_DEBOUNCE_MS
+    if not await conn.set(typing_debounce_key(room_id, username), 1, nx=True, px=debounce):
+        return False
+    key = typing_key(room_id)
+    async with conn.pipeline(transaction=False) as pipe:
+        pipe.zadd(key, {username: time.time() + settings.CHAT_TYPING_TTL_MS / 1000})
+        pipe.pexpire(key, settings.CHAT_TYPING_TTL_MS * 2)
+        await pipe.execute()
+    return True
+
+
+async def stopped_typing(room_id, username):
+    """Clear the indicator (e.g. once the message is sent); returns whether it was set."""
+    async with get_async_connection().pipeline(transaction=False) as pipe:
+        pipe.zrem(typing_key(room_id), username)
+        pipe.delete(typing_debounce_key(room_id, username))
+        removed, _ = await pipe.execute()
+    return removed > 0
+
+
+async def snapshot(room_id):
+    now = time.time()
+    async with get_async_connection().pipeline(transaction=False) as pipe:
+        pipe.zrangebyscore(presence_key(room_id), now - settings.CHAT_PRESENCE_TTL, '+inf')
+        pipe.zrangebyscore(typing_key(room_id), now, '+inf')
+        members, typists = await pipe.execute()
+    online = {value.decode().split('|', 1)[0] for value in members}
+    return {
+        "online": sorted(online),
+        "typing": sorted(value.decode() for value in typists if value.decode() in online),
+    }
+
+
+async def changed(channel_layer, room_id, group):
+    """Note a change in ``room_id``; the group gets one snapshot per interval."""
+    interval = settings.CHAT_PRESENCE_INTERVAL_MS
+    # Expires on its own if the process that claimed it dies first.
+    if await get_async_connection().set(pending_key(room_id), 1, nx=True, px=interval * 2):
+        task = asyncio.get_running_loop().create_task(
+            _broadcast_later(channel_layer, room_id, group)
+        )
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+
+async def _broadcast_later(channel_layer, room_id, group):
+    await asyncio.sleep(settings.CHAT_PRESENCE_INTERVAL_MS / 1000)
+    # Release first: a change after this point schedules the next snapshot.
+    await get_async_connection().delete(pending_key(room_id))
+    state = await snapshot(room_id)
+    await channel_layer.group_send(group, {
+        "type": "chat.presence",
+        "frames": codecs.encode_all({"type": "presence", **state}),
+    })
@@ -0,0 +1,120 @@
+"""
+Inbound limits for ``ChatConsumer``.
+
+Every relayed message turns into one delivery per room member, so inbound
+frames are limited before they cost anything:
+
+* frames over ``CHAT_MAX_FRAME_SIZE`` bytes (text frames as UTF-8) are
+  refused before decoding;
+* each connection gets a token bucket of ``CHAT_RATE_CONNECTION`` frames
+  per second with bursts of ``CHAT_RATE_CONNECTION_BURST``;
+* messages of a signed-in user share, across the user's connections in
+  the process, a bucket of ``CHAT_RATE_USER`` per second (bursts of
+  ``CHAT_RATE_USER_BURST``), and across processes a budget of
+  ``CHAT_RATE_USER_BUDGET`` messages per ``CHAT_RATE_USER_WINDOW`` seconds.
+
+Buckets are plain arithmetic on the monotonic clock. The shared budget is
+leased from a Redis counter ``CHAT_RATE_LEASE`` messages at a time, so
+Redis is asked at most once per lease rather than on every frame.
+``CHAT_RATE_ACTION`` decides what happens to a frame over a limit: ``'drop'``
+ignores it, ``'warn'`` ignores it and sends the client an error, ``'close'``
+closes the connection.
+"""
+import time
+import weakref
+
+from django.conf import settings
+
+from .history import get_async_connection
+
+# Close codes: the standard "message too big" and an application code
+# mirroring HTTP 429.
+TOO_LARGE = 1009
+RATE_LIMITED = 4029
+
+_user_limits = weakref.WeakValueDictionary()
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def take(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class UserLimit:
+    """A user's message allowance; shared by their connections in this process."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.bucket = TokenBucket(settings.CHAT_RATE_USER, settings.CHAT_RATE_USER_BURST)
+        self.leased = 0
+        self.blocked_until = 0
+
+    async def take(self):
+        if not self.bucket.take():
+            return False
+        if self.leased:
+            self.leased -= 1
+            return True
+        return await self._lease()
+
+    async def _lease(self):
+        now = time.time()
+        if now < self.blocked_until:
+            return False
+        window_size = settings.CHAT_RATE_USER_WINDOW
+        window = int(now // window_size)
+        key = f"chat:rate:{self.user_id}:{window}"
+        lease = settings.CHAT_RATE_LEASE
+        async with get_async_connection().pipeline(transaction=False) as pipe:
+            pipe.incrby(key, lease)
+            pipe.expire(key, window_size * 2)
+            used, _ = await pipe.execute()
+
+        # Only the part of the lease still inside the budget is granted.
+        granted = lease - max(0, used - settings.CHAT_RATE_USER_BUDGET)
+        if granted <= 0:
+            self.blocked_until = (window + 1) * window_size
+            return False
+        self.leased = granted - 1
+        return True
+
+
+def user_limit(user_id):
+    limit = _user_limits.get(user_id)
+    if limit is None:
+        # Dropped with the user's last connection.
+        limit = _user_limits[user_id] = UserLimit(user_id)
+    return limit
+
+
+class Limits:
+    """The limits that apply to one connection."""
+
+    def __init__(self, user_id=None):
+        self.connection = TokenBucket(settings.CHAT_RATE_CONNECTION, settings.CHAT_RATE_CONNECTION_BURST)
+        self.user = user_limit(user_id) if user_id is not None else None
+
+    def frame(self, data):
+        """Return the close code for a frame over a limit, or ``None``."""
+        if isinstance(data, str):
+            data = data.encode()
+        if data is not None and len(data) > settings.CHAT_MAX_FRAME_SIZE:
+            return TOO_LARGE
+        if not self.connection.take():
+            return RATE_LIMITED
+        return None
+
+    async def message(self):
+        return self.user is None or await self.user.take()
@@ -3,5 +3,6 @@ from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
-    re_path(r"ws/chat/(?P<room_name>\w+)/$", consumers.ChatConsumer.as_asgi()),
+    re_path(r"ws/chat/(?P<room_name>\w{1,100})/$", consumers.ChatConsumer.as_asgi()),
+    re_path(r"ws/dm/(?P<username>[\w.@+-]{1,150})/$", consumers.DirectMessageConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -0,0 +1,18 @@
+from rest_framework import serializers
+
+
+class ChatMessageSerializer(serializers.Serializer):
+    """The shape of a history entry; see ``chat.history.entry``."""
+    id = serializers.IntegerField()
+    user = serializers.CharField(allow_null=True)
+    message = serializers.CharField()
+    created_at = serializers.DateTimeField()
+
+
+class ConversationSerializer(serializers.Serializer):
+    """The shape of an inbox entry; see ``chat.inbox.page``."""
+    id = serializers.IntegerField()
+    user = serializers.CharField(allow_null=True)
+    unread = serializers.IntegerField()
+    last_message = ChatMessageSerializer(allow_null=True)
+    last_activity_at = serializers.DateTimeField()
@@ -1,3 +1,782 @@
-from django.test import TestCase
+import asyncio
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import re_path
+from django.utils import timezone
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from chat import codecs, history, inbox, outbound, presence, ratelimit
+from chat.buffer import MessageBuffer, buffer
+from chat.consumers import ChatConsumer, DirectMessageConsumer
+from chat.layers import HashRing, ShardedChannelLayer
+from chat.models import Message, Participant, Room
+
+User = get_user_model()
+
+IN_MEMORY_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+IN_MEMORY_SHARDS = {name: {"BACKEND": "channels.layers.InMemoryChannelLayer"} for name in "abc"}
+
+
+
+class UnsafeChannelLayer(InMemoryChannelLayer):
+    """Loses a message it has popped if cancelled before returning it, as a
+    ``BZPOPMIN`` in flight does in ``RedisChannelLayer``."""
+
+    instances = 0
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Shards take different times, so one finishes while another is mid-receive.
+        UnsafeChannelLayer.instances += 1
+        self.delay = 0.005 * UnsafeChannelLayer.instances
+
+    async def receive(self, channel):
+        message = await super().receive(channel)
+        await asyncio.sleep(self.delay)
+        return message
+
+
+SHARDED_LAYERS = {"default": {
+    "BACKEND": "chat.layers.ShardedChannelLayer",
+    "CONFIG": {"shards": IN_MEMORY_SHARDS},
+}}
+
+application = URLRouter([
+    re_path(r"ws/chat/(?P<room_name>\w{1,100})/$", ChatConsumer.as_asgi()),
+    re_path(r"ws/dm/(?P<username>[\w.@+-]{1,150})/$", DirectMessageConsumer.as_asgi()),
+])
+
+
+def connect(room, user=None, subprotocols=None, path="chat"):
+    communicator = WebsocketCommunicator(application, f"/ws/{path}/{room}/", subprotocols=subprotocols)
+    if user is not None:
+        communicator.scope["user"] = user
+    return communicator
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS, CHAT_FLUSH_SIZE=3, CHAT_FLUSH_INTERVAL_MS=50)
+class ChatPersistenceTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        buffer.pending.clear()
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password123"
+        )
+
+    async def test_messages_are_relayed_and_stored(self):
+        """Messages reach the room at once and are written after the interval."""
+        communicator = connect("lobby", self.user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        await communicator.send_json_to({"message": "hello"})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response["message"], "hello")
+        self.assertEqual(response["user"], "user")
+        self.assertEqual(await database_sync_to_async(Message.objects.count)(), 0)
+
+        await asyncio.sleep(0.2)
+        message = await database_sync_to_async(Message.objects.select_related('room').get)()
+        self.assertEqual((message.room.name, message.user_id, message.body), ("lobby", self.user.id, "hello"))
+        await communicator.disconnect()
+
+    async def test_full_buffer_flushes_in_one_insert(self):
+        """Reaching CHAT_FLUSH_SIZE writes the batch without waiting."""
+        room_id = (await database_sync_to_async(Room.objects.create)(name="batch")).id
+        local = MessageBuffer()
+        for index in range(3):
+            local.add(Message(room_id=room_id, body=str(index)))
+        self.assertIsNone(local._timer)
+
+        await asyncio.gather(*local._flushes)
+        self.assertEqual(local.pending, [])
+        bodies = await database_sync_to_async(
+            lambda: list(Message.objects.order_by('id').values_list('body', flat=True))
+        )()
+        self.assertEqual(bodies, ["0", "1", "2"])
+
+    async def test_flush_drops_unstorable_batch(self):
+        """A batch for a deleted room is dropped instead of retried forever."""
+        local = MessageBuffer()
+        local.add(Message(room_id=0, body="orphan"))
+        with self.assertLogs('chat.buffer', 'ERROR'):
+            self.assertEqual(await local.flush(), 0)
+        self.assertEqual(local.pending, [])
+
+    async def test_database_lost_while_storing_one_by_one(self):
+        """Messages not yet stored one by one are kept when the database goes away."""
+        room_id = (await database_sync_to_async(Room.objects.create)(name="flaky")).id
+        local = MessageBuffer()
+        local.pending = [Message(room_id=room_id, body=str(index)) for index in range(3)]
+        save = Message.save
+
+        def fail_after_first(message, *args, **kwargs):
+            if message.body == "1":
+                raise DatabaseError
+            save(message, *args, **kwargs)
+
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=IntegrityError), \
+                mock.patch.object(Message, 'save', fail_after_first), \
+                self.assertLogs('chat.buffer', 'ERROR'):
+            self.assertEqual(await local.flush(), 1)
+        local._cancel_timer()
+        self.assertEqual([message.body for message in local.pending], ["1", "2"])
+
+        self.assertEqual(await local.flush(), 2)
+
+    @override_settings(CHAT_BUFFER_MAX_PENDING=3)
+    async def test_failed_flush_keeps_newest_messages(self):
+        """A failing database only holds back CHAT_BUFFER_MAX_PENDING messages."""
+        room_id = (await database_sync_to_async(Room.objects.create)(name="down")).id
+        local = MessageBuffer()
+        local.pending = [Message(room_id=room_id, body=str(index)) for index in range(5)]
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=DatabaseError), \
+                self.assertLogs('chat.buffer', 'ERROR') as logs:
+            self.assertEqual(await local.flush(), 0)
+        local._cancel_timer()
+        self.assertEqual([message.body for message in local.pending], ["2", "3", "4"])
+        self.assertIn("Dropped 2 chat messages", logs.output[-1])
+
+        self.assertEqual(await local.flush(), 3)
+
+    async def test_anonymous_messages(self):
+        """Messages from anonymous connections are stored without a user."""
+        communicator = connect("lobby")
+        await communicator.connect()
+        await communicator.send_json_to({"message": "hi"})
+        self.assertIsNone((await communicator.receive_json_from())["user"])
+        await buffer.flush()
+        self.assertIsNone((await database_sync_to_async(Message.objects.get)()).user_id)
+        await communicator.disconnect()
+
+    async def test_history_command(self):
+        """A new connection replays what was said before it joined."""
+        first = connect("lobby", self.user)
+        await first.connect()
+        for text in ["one", "two", "three"]:
+            await first.send_json_to({"message": text})
+            await first.receive_json_from()
+
+        second = connect("lobby", self.user)
+        await second.connect()
+        await second.send_json_to({"command": "history", "limit": 2})
+        response = await second.receive_json_from()
+        self.assertEqual(response["type"], "history")
+        self.assertEqual([item["message"] for item in response["messages"]], ["three", "two"])
+
+        await second.send_json_to({"command": "history", "before": response["next"]})
+        response = await second.receive_json_from()
+        self.assertEqual([item["message"] for item in response["messages"]], ["one"])
+        self.assertIsNone(response["next"])
+
+        await second.send_json_to({"command": "history", "before": "bogus"})
+        self.assertEqual((await second.receive_json_from())["type"], "error")
+        await first.disconnect()
+        await second.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class ChatCodecTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        buffer.pending.clear()
+
+    async def test_negotiates_msgpack(self):
+        """Binary clients send and receive MessagePack frames."""
+        communicator = connect("lobby", subprotocols=["chat.unknown", "chat.msgpack"])
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, "chat.msgpack")
+
+        await communicator.send_to(bytes_data=codecs.msgpack.packb({"message": "hi"}))
+        frame = codecs.msgpack.unpackb(await communicator.receive_from())
+        self.assertEqual((frame["type"], frame["message"]), ("message", "hi"))
+        await communicator.disconnect()
+
+    async def test_payload_encoded_once_per_format(self):
+        """Members forward the frame encoded at group_send time."""
+        json_codec = codecs.CODECS["json"]
+        members = [
+            connect("lobby"),
+            connect("lobby", subprotocols=["chat.json"]),
+            connect("lobby", subprotocols=["chat.msgpack"]),
+        ]
+        for member in members:
+            await member.connect()
+
+        with mock.patch.object(json_codec, "encode", wraps=json_codec.encode) as encode:
+            await members[0].send_json_to({"message": "hello"})
+            received = [await member.receive_from() for member in members]
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(received[0], received[1])
+        self.assertEqual(json_codec.decode(received[0])["message"], "hello")
+        self.assertEqual(codecs.msgpack.unpackb(received[2])["message"], "hello")
+        for member in members:
+            await member.disconnect()
+
+    async def test_malformed_frame(self):
+        communicator = connect("lobby")
+        await communicator.connect()
+        await communicator.send_to(text_data="{not json")
+        self.assertEqual((await communicator.receive_json_from())["type"], "error")
+        await communicator.disconnect()
+
+    async def test_invalid_payloads(self):
+        """Frames that decode to anything but a message object get an error."""
+        communicator = connect("lobby")
+        await communicator.connect()
+        for frame in ['[1]', '"x"', '{}', '{"message": null}', '{"message": ""}', '{"message": 5}']:
+            await communicator.send_to(text_data=frame)
+            self.assertEqual((await communicator.receive_json_from())["type"], "error", frame)
+        self.assertEqual(buffer.pending, [])
+        await communicator.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS, CHAT_PRESENCE_INTERVAL_MS=100)
+class ChatPresenceTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        buffer.pending.clear()
+        self.alice = User.objects.create_user(
+            username="alice", email="alice@example.com", password="password123"
+        )
+        self.bob = User.objects.create_user(
+            username="bob", email="bob@example.com", password="password123"
+        )
+
+    async def receive_presence(self, communicator):
+        while True:
+            frames = await communicator.receive_json_from(timeout=2)
+            for frame in frames if isinstance(frames, list) else [frames]:
+                if frame["type"] == "presence":
+                    return frame
+
+    async def test_roster_updates_are_coalesced(self):
+        """Joins within one interval produce a single roster update."""
+        alice = connect("lobby", self.alice)
+        bob = connect("lobby", self.bob)
+        await alice.connect()
+        await bob.connect()
+
+        frame = await self.receive_presence(alice)
+        self.assertEqual(frame["online"], ["alice", "bob"])
+        await asyncio.sleep(0.2)
+        self.assertTrue(await alice.receive_nothing(timeout=0.1))
+
+        await bob.disconnect()
+        frame = await self.receive_presence(alice)
+        self.assertEqual(frame["online"], ["alice"])
+        await alice.disconnect()
+
+    async def test_typing_is_debounced(self):
+        """Bursts of typing notifications cost one update; sending clears it."""
+        alice = connect("lobby", self.alice)
+        bob = connect("lobby", self.bob)
+        await alice.connect()
+        await bob.connect()
+        await self.receive_presence(bob)
+
+        with mock.patch("chat.presence.changed", wraps=presence.changed) as changed:
+            for _ in range(5):
+                await alice.send_json_to({"command": "typing"})
+            frame = await self.receive_presence(bob)
+        self.assertEqual(frame["typing"], ["alice"])
+        self.assertEqual(changed.call_count, 1)
+
+        await alice.send_json_to({"message": "hi"})
+        self.assertEqual((await bob.receive_json_from())["message"], "hi")
+        self.assertEqual((await self.receive_presence(bob))["typing"], [])
+        await alice.disconnect()
+        await bob.disconnect()
+
+    @override_settings(CHAT_TYPING_DEBOUNCE_MS=1500)
+    def test_room_page_debounces_typing(self):
+        """The page sends typing frames no more often than the server counts them."""
+        response = self.client.get("/chat/lobby/")
+        self.assertContains(response, '<script id="typing-debounce-ms" type="application/json">1500</script>', html=True)
+
+    async def test_ping_drops_lapsed_connections(self):
+        """A heartbeat prunes connections that stopped pinging."""
+        alice = connect("lobby", self.alice)
+        await alice.connect()
+        await self.receive_presence(alice)
+        room_id = await database_sync_to_async(lambda: Room.objects.get(name="lobby").id)()
+        await presence.join(room_id, "ghost", "gone")
+        await presence.get_async_connection().zadd(
+            presence.presence_key(room_id), {presence.member("ghost", "gone"): 0}
+        )
+
+        await alice.send_json_to({"command": "ping"})
+        self.assertEqual((await alice.receive_json_from())["type"], "pong")
+        self.assertEqual((await self.receive_presence(alice))["online"], ["alice"])
+        await alice.disconnect()
+
+    async def test_anonymous_connections_are_not_listed(self):
+        anonymous = connect("lobby")
+        await anonymous.connect()
+        await anonymous.send_json_to({"command": "typing"})
+        self.assertTrue(await anonymous.receive_nothing(timeout=0.3))
+        await anonymous.disconnect()
+
+
+class StalledConsumer:
+    """Records frames; each send waits until ``release`` is set."""
+    channel_name = "test"
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.sent = []
+        self.closed_with = None
+        self.release = asyncio.Event()
+
+    async def send_frame(self, frame):
+        await self.release.wait()
+        self.sent.append(frame)
+
+    async def close(self, code=None):
+        self.closed_with = code
+
+
+@override_settings(CHAT_OUTBOUND_MAX_QUEUE=3, CHAT_OUTBOUND_MAX_LAG_MS=10_000)
+class OutboundQueueTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def frame(self, payload):
+        return codecs.DEFAULT.encode(payload)
+
+    async def test_bursts_are_joined(self):
+        """Frames queued behind a slow send leave as one array frame."""
+        consumer = StalledConsumer(codecs.DEFAULT)
+        queue = outbound.OutboundQueue(consumer)
+        queue.put(self.frame({"n": 1}))
+        await asyncio.sleep(0)
+        queue.put(self.frame({"n": 2}))
+        queue.put(self.frame({"n": 3}))
+
+        consumer.release.set()
+        await asyncio.sleep(0.05)
+        self.assertEqual([codecs.DEFAULT.decode(frame) for frame in consumer.sent],
+                         [{"n": 1}, [{"n": 2}, {"n": 3}]])
+        queue.close()
+
+    async def test_msgpack_join(self):
+        codec = codecs.CODECS["msgpack"]
+        frames = [codec.encode({"n": n}) for n in range(20)]
+        self.assertEqual(codec.decode(codec.join(frames)), [{"n": n} for n in range(20)])
+
+    async def test_presence_replaces_queued_presence(self):
+        consumer = StalledConsumer(codecs.DEFAULT)
+        queue = outbound.OutboundQueue(consumer)
+        queue.put(self.frame({"online": ["a"]}), presence=True)
+        queue.put(self.frame({"message": "hi"}))
+        queue.put(self.frame({"online": ["a", "b"]}), presence=True)
+        self.assertEqual([codecs.DEFAULT.decode(entry[1]) for entry in queue.frames],
+                         [{"message": "hi"}, {"online": ["a", "b"]}])
+        queue.close()
+
+    async def test_overflow_drops_oldest(self):
+        """A full queue drops its oldest frames and reports how many."""
+        consumer = StalledConsumer(codecs.DEFAULT)
+        queue = outbound.OutboundQueue(consumer)
+        dropped = outbound.stats.dropped
+        for n in range(5):
+            queue.put(self.frame({"n": n}))
+
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(outbound.stats.dropped - dropped, 2)
+        consumer.release.set()
+        await asyncio.sleep(0.05)
+        self.assertEqual(codecs.DEFAULT.decode(consumer.sent[0]), {"type": "dropped", "count": 2})
+        self.assertEqual(codecs.DEFAULT.decode(consumer.sent[1]), [{"n": 2}, {"n": 3}, {"n": 4}])
+        queue.close()
+
+    @override_settings(CHAT_OUTBOUND_OVERFLOW='close', CHAT_OUTBOUND_MAX_LAG_MS=20)
+    async def test_lagging_connection_is_closed(self):
+        """Frames older than the lag limit close the connection."""
+        consumer = StalledConsumer(codecs.DEFAULT)
+        queue = outbound.OutboundQueue(consumer)
+        queue.put(self.frame({"n": 1}))
+        queue.put(self.frame({"n": 2}))
+        await asyncio.sleep(0.05)
+        queue.put(self.frame({"n": 3}))
+
+        await asyncio.sleep(0)
+        self.assertTrue(queue.closed)
+        self.assertEqual(consumer.closed_with, outbound.LAGGING)
+        self.assertNotIn(queue, outbound.stats.queues)
+
+    @override_settings(CHAT_OUTBOUND_STATS_INTERVAL=0)
+    async def test_stats_are_published(self):
+        outbound.stats.max_depth = 0
+        consumer = StalledConsumer(codecs.DEFAULT)
+        queue = outbound.OutboundQueue(consumer)
+        queue.put(self.frame({"n": 1}))
+        await outbound.stats._publishing
+
+        published = await database_sync_to_async(outbound.read_stats)()
+        self.assertEqual(published[outbound.stats.process]["max_depth"], 1)
+        self.assertGreaterEqual(published[outbound.stats.process]["connections"], 1)
+        queue.close()
+
+
+def select_queries(context):
+    return [query for query in context.captured_queries if not query['sql'].startswith('EXPLAIN')]
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_LAYERS, CHAT_MAX_FRAME_SIZE=100,
+    CHAT_RATE_CONNECTION=0.01, CHAT_RATE_CONNECTION_BURST=3,
+)
+class ChatRateLimitTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        buffer.pending.clear()
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password123"
+        )
+
+    def test_token_bucket(self):
+        bucket = ratelimit.TokenBucket(rate=2, capacity=2)
+        now = bucket.updated_at
+        self.assertEqual([bucket.take(now) for _ in range(3)], [True, True, False])
+        self.assertTrue(bucket.take(now + 0.5))
+        self.assertFalse(bucket.take(now + 0.5))
+
+    async def test_oversized_frame_is_refused(self):
+        communicator = connect("lobby", self.user)
+        await communicator.connect()
+        await communicator.send_to(text_data='{"message": "' + "x" * 100 + '"}')
+        self.assertEqual(await communicator.receive_json_from(), {"type": "error", "error": "Frame too large"})
+        self.assertEqual(buffer.pending, [])
+        await communicator.disconnect()
+
+    def test_frame_size_counts_bytes(self):
+        """Text frames are measured encoded, so multibyte text cannot slip past."""
+        limits = ratelimit.Limits()
+        self.assertIsNone(limits.frame("x" * 100))
+        self.assertEqual(limits.frame("é" * 60), ratelimit.TOO_LARGE)
+        self.assertEqual(limits.frame(b"x" * 101), ratelimit.TOO_LARGE)
+
+    async def test_connection_rate(self):
+        """Frames past the connection's burst are dropped with a warning."""
+        communicator = connect("lobby")
+        await communicator.connect()
+        for text in ["1", "2", "3", "4"]:
+            await communicator.send_json_to({"message": text})
+        received = [await communicator.receive_json_from() for _ in range(4)]
+        self.assertEqual([item.get("message") for item in received[:3]], ["1", "2", "3"])
+        self.assertEqual(received[3], {"type": "error", "error": "Rate limited"})
+        await communicator.disconnect()
+        await buffer.flush()
+
+    @override_settings(CHAT_RATE_ACTION='close')
+    async def test_close_action(self):
+        communicator = connect("lobby")
+        await communicator.connect()
+        with self.assertLogs('chat.consumers', 'WARNING'):
+            await communicator.send_to(text_data="x" * 101)
+            self.assertEqual(await communicator.receive_output(), {"type": "websocket.close", "code": 1009})
+
+    @override_settings(CHAT_RATE_ACTION='drop', CHAT_RATE_USER=0.01, CHAT_RATE_USER_BURST=1)
+    async def test_user_rate_spans_connections(self):
+        first, second = connect("lobby", self.user), connect("lobby", self.user)
+        await first.connect()
+        await second.connect()
+        await first.send_json_to({"message": "first"})
+        await second.send_json_to({"message": "second"})
+        self.assertEqual((await first.receive_json_from())["message"], "first")
+        self.assertEqual((await second.receive_json_from())["message"], "first")
+        self.assertTrue(await first.receive_nothing())
+        await first.disconnect()
+        await second.disconnect()
+        await buffer.flush()
+
+    @override_settings(CHAT_RATE_USER_BUDGET=5, CHAT_RATE_LEASE=2)
+    async def test_shared_budget_across_processes(self):
+        """Processes lease from one Redis budget; together they stay within it."""
+        processes = [ratelimit.UserLimit(self.user.id) for _ in range(2)]
+        allowed = 0
+        for _ in range(5):
+            for limit in processes:
+                allowed += await limit.take()
+        self.assertEqual(allowed, 5)
+        self.assertFalse(await processes[0].take())
+
+
+@override_settings(CHAT_HISTORY_SIZE=3)
+class ChatHistoryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password123"
+        )
+        self.room = Room.objects.create(name="lobby")
+        start = timezone.now() - timedelta(minutes=1)
+        self.messages = [
+            Message.objects.create(room=self.room, user=self.user, body=str(index),
+                                   created_at=start + timedelta(seconds=index))
+            for index in range(5)
+        ]
+
+    def push(self, message):
+        async_to_sync(history.push)(self.room.id, history.entry(
+            message.id, self.user.username, message.body, message.created_at
+        ))
+
+    def bodies(self, items):
+        return [item["message"] for item in items]
+
+    def test_pages_continue_from_list_into_database(self):
+        """Recent pages come from Redis alone; older ones from the database."""
+        for message in self.messages:
+            self.push(message)
+
+        with CaptureQueriesContext(connection) as context:
+            items, position = history.page(self.room.id, limit=2)
+        self.assertEqual(self.bodies(items), ["4", "3"])
+        self.assertEqual(select_queries(context), [])
+
+        items, position = history.page(self.room.id, position, limit=2)
+        self.assertEqual(self.bodies(items), ["2", "1"])
+        items, position = history.page(self.room.id, position, limit=2)
+        self.assertEqual(self.bodies(items), ["0"])
+        self.assertIsNone(position)
+
+    def test_buffered_messages_are_listed(self):
+        """Messages not yet written by the buffer are served from the list."""
+        pending = Message(id=self.messages[-1].id + 100, room=self.room, user=self.user,
+                          body="pending", created_at=timezone.now())
+        self.push(pending)
+        items, _ = history.page(self.room.id, limit=2)
+        self.assertEqual(self.bodies(items), ["pending", "4"])
+
+    def test_cold_list_is_refilled(self):
+        """The first page of an empty list is read once from the database."""
+        items, _ = history.page(self.room.id, limit=2)
+        self.assertEqual(self.bodies(items), ["4", "3"])
+
+        with CaptureQueriesContext(connection) as context:
+            items, _ = history.page(self.room.id, limit=2)
+        self.assertEqual(self.bodies(items), ["4", "3"])
+        self.assertEqual(select_queries(context), [])
+
+    def test_cursor_round_trip(self):
+        position = (self.messages[0].created_at, self.messages[0].id)
+        self.assertEqual(history.decode_cursor(history.encode_cursor(position)), position)
+        with self.assertRaises(ValueError):
+            history.decode_cursor("not-a-cursor")
+
+
+class ShardedChannelLayerTest(TransactionTestCase):
+    groups = [f"chat_room{index}" for index in range(3000)]
+
+    def placement(self, nodes):
+        ring = HashRing(nodes)
+        return {group: ring.node_for(group) for group in self.groups}
+
+    def group_on_other_shard(self, layer):
+        return next(group for group in self.groups if layer.shard_for_group(group) != layer.home)
+
+    def test_groups_spread_over_shards(self):
+        counts = {}
+        for node in self.placement("abc").values():
+            counts[node] = counts.get(node, 0) + 1
+        for node in "abc":
+            self.assertGreater(counts[node], len(self.groups) / 3 * 0.8)
+
+    def test_adding_a_shard_moves_only_its_share(self):
+        """A fourth shard takes about a quarter of the rooms, all from the others."""
+        before, after = self.placement("abc"), self.placement("abcd")
+        moved = [group for group in self.groups if before[group] != after[group]]
+        self.assertLess(len(moved), len(self.groups) * 0.35)
+        self.assertTrue(all(after[group] == "d" for group in moved))
+
+    def test_removing_a_shard_moves_only_its_rooms(self):
+        before, after = self.placement("abcd"), self.placement("abc")
+        moved = {group for group in self.groups if before[group] != after[group]}
+        self.assertEqual(moved, {group for group in self.groups if before[group] == "d"})
+
+    def test_placement_is_stable_across_processes(self):
+        self.assertEqual(self.placement("abc"), self.placement(["c", "b", "a"]))
+
+    async def test_channels_are_sticky_to_the_process_shard(self):
+        layer = ShardedChannelLayer(IN_MEMORY_SHARDS)
+        names = [await layer.new_channel() for _ in range(5)]
+        self.assertEqual({layer.split(name)[0] for name in names}, {layer.home})
+
+        await layer.send(names[0], {"type": "hello"})
+        self.assertEqual(await layer.receive(names[0]), {"type": "hello"})
+
+    async def test_group_on_another_shard(self):
+        """Members listen on their group's shard while they belong to it."""
+        layer = ShardedChannelLayer(IN_MEMORY_SHARDS)
+        group = self.group_on_other_shard(layer)
+        channel = await layer.new_channel()
+        receiving = asyncio.ensure_future(layer.receive(channel))
+        await asyncio.sleep(0)
+
+        await layer.group_add(group, channel)
+        await layer.group_send(group, {"type": "chat.message"})
+        self.assertEqual(await asyncio.wait_for(receiving, 1), {"type": "chat.message"})
+        self.assertIn(group, layer.shards[layer.shard_for_group(group)].groups)
+        self.assertNotIn(group, layer.shards[layer.home].groups)
+
+        await layer.group_discard(group, channel)
+        self.assertNotIn(channel, layer.memberships)
+        self.assertEqual(list(layer.readers), [(channel, layer.home)])
+
+    async def test_no_message_lost_across_shards(self):
+        """Readers are never cancelled mid-receive, so children need not be cancel-safe."""
+        layer = ShardedChannelLayer({name: {"BACKEND": "chat.tests.UnsafeChannelLayer"} for name in "abc"})
+        group = self.group_on_other_shard(layer)
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+
+        for index in range(10):
+            await layer.send(channel, {"type": "direct", "index": index})
+            await layer.group_send(group, {"type": "group", "index": index})
+        messages = [await asyncio.wait_for(layer.receive(channel), 1) for _ in range(20)]
+        self.assertEqual(
+            sorted((message["type"], message["index"]) for message in messages),
+            sorted((kind, index) for kind in ("direct", "group") for index in range(10)),
+        )
+
+        await layer.group_discard(group, channel)
+        receiving = asyncio.ensure_future(layer.receive(channel))
+        await asyncio.sleep(0)
+        receiving.cancel()
+        await asyncio.gather(receiving, return_exceptions=True)
+        self.assertEqual(layer.readers, {})
+
+    @override_settings(CHANNEL_LAYERS=SHARDED_LAYERS)
+    async def test_room_over_shards(self):
+        """Connections to a room talk through the shard that owns it."""
+        layer = get_channel_layer()
+        room = self.group_on_other_shard(layer).removeprefix("chat_")
+
+        first, second = connect(room), connect(room)
+        await first.connect()
+        await second.connect()
+        await first.send_json_to({"message": "sharded"})
+        for communicator in (first, second):
+            self.assertEqual((await communicator.receive_json_from())["message"], "sharded")
+        await first.disconnect()
+        await second.disconnect()
+        await buffer.flush()
+
+
+class InboxTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username="alice", email="alice@example.com", password="password123")
+        self.bob = User.objects.create_user(username="bob", email="bob@example.com", password="password123")
+        self.conversation = inbox.open_conversation(self.alice, "bob")
+        self.sent = 0
+
+    def send(self, sender, body):
+        self.sent += 1
+        item = history.entry(self.sent, sender.username, body, timezone.now())
+        inbox.sent(self.conversation.id, self.conversation.member_ids, sender.id, item)
+
+    def test_open_conversation(self):
+        again = inbox.open_conversation(self.bob, "alice")
+        self.assertEqual(again.id, self.conversation.id)
+        self.assertEqual(again.room.name, inbox.room_name(self.alice.id, self.bob.id))
+        self.assertIsNone(inbox.open_conversation(self.alice, "alice"))
+        self.assertIsNone(inbox.open_conversation(self.alice, "nobody"))
+
+    def test_warm_inbox_is_read_without_queries(self):
+        self.send(self.alice, "hi")
+        inbox.page(self.bob.id)
+        with CaptureQueriesContext(connection) as context:
+            items, _ = inbox.page(self.bob.id)
+        self.assertEqual(select_queries(context), [])
+        self.assertEqual((items[0]["user"], items[0]["unread"]), ("alice", 1))
+
+    def test_read_resets_unread(self):
+        self.send(self.alice, "one")
+        self.send(self.alice, "two")
+        inbox.mark_read(self.conversation.id, self.bob.id)
+        self.send(self.alice, "three")
+        self.assertEqual(inbox.page(self.bob.id)[0][0]["unread"], 1)
+
+    def test_persisted_inbox_survives_redis_loss(self):
+        self.send(self.alice, "one")
+        self.send(self.alice, "two")
+        self.assertEqual(inbox.persist(), 1)
+        participant = Participant.objects.get(user=self.bob)
+        self.assertEqual(participant.unread_count, 2)
+
+        cache.clear()
+        items, _ = inbox.page(self.bob.id)
+        self.assertEqual(items[0]["unread"], 2)
+        self.assertEqual(items[0]["last_message"]["message"], "two")
+
+        # A cold inbox is loaded before it is updated, not restarted from zero.
+        cache.clear()
+        self.send(self.alice, "three")
+        self.assertEqual(inbox.page(self.bob.id)[0][0]["unread"], 3)
+
+
+    def test_failed_persist_is_retried(self):
+        self.send(self.alice, "one")
+        with mock.patch.object(Participant.objects, 'bulk_update', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                inbox.persist()
+        self.assertEqual(Participant.objects.get(user=self.bob).unread_count, 0)
+
+        self.assertEqual(inbox.persist(), 1)
+        self.assertEqual(Participant.objects.get(user=self.bob).unread_count, 1)
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class DirectMessageConsumerTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        buffer.pending.clear()
+        self.alice = User.objects.create_user(username="alice", email="alice@example.com", password="password123")
+        self.bob = User.objects.create_user(username="bob", email="bob@example.com", password="password123")
+
+    async def test_messages_update_the_inbox(self):
+        alice = connect("bob", self.alice, path="dm")
+        self.assertTrue((await alice.connect())[0])
+        await alice.send_json_to({"message": "hi bob"})
+        self.assertEqual((await alice.receive_json_from())["message"], "hi bob")
+        await asyncio.sleep(0.1)
+
+        page = database_sync_to_async(inbox.page)
+        items, _ = await page(self.bob.id)
+        self.assertEqual((items[0]["user"], items[0]["unread"]), ("alice", 1))
+        self.assertEqual(items[0]["last_message"]["message"], "hi bob")
+
+        bob = connect("alice", self.bob, path="dm")
+        await bob.connect()
+        await bob.send_json_to({"command": "read"})
+        await bob.send_json_to({"command": "ping"})
+        self.assertEqual((await bob.receive_json_from())["type"], "pong")
+        self.assertEqual((await page(self.bob.id))[0][0]["unread"], 0)
+        await alice.disconnect()
+        await bob.disconnect()
+        await buffer.flush()
+
+    async def test_refused_connections(self):
+        """Anonymous users, unknown peers and public access to DM rooms are refused."""
+        for communicator in [
+            connect("bob", path="dm"),
+            connect("nobody", self.alice, path="dm"),
+            connect(inbox.room_name(self.alice.id, self.bob.id), self.alice),
+        ]:
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
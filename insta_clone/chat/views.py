@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.shortcuts import render
 
 
@@ -6,4 +7,7 @@ def index(request):
 
 
 def room(request, room_name):
-    return render(request, "chat/room.html", {"room_name": room_name})
\ No newline at end of file
+    return render(request, "chat/room.html", {
+        "room_name": room_name,
+        "typing_debounce_ms": settings.CHAT_TYPING_DEBOUNCE_MS,
+    })
\ No newline at end of file
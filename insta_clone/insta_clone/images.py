@@ -0,0 +1,232 @@
+"""
+Image renditions for post images and profile pictures.
+
+``render`` decodes an upload once, applies and then drops its EXIF
+orientation, and writes WebP and JPEG copies at each size in
+``IMAGE_RENDITION_SIZES`` next to a tiny base64 placeholder for blur-up
+loading. The returned map holds storage names and pixel dimensions and is
+stored on the model's ``renditions`` field, so serializers can describe
+every rendition without opening an image file.
+
+Originals are stored without their metadata too: ``strip_metadata`` drops
+the EXIF (GPS included), XMP, ICC and comment blocks of a JPEG or PNG
+without decoding or re-encoding its pixels, keeping only the orientation.
+"""
+import base64
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_field
+
+from PIL import Image, ImageOps
+
+from rest_framework import serializers
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+PLACEHOLDER_SIZE = 16
+
+ORIENTATION = 0x0112
+JPEG_SOI = b'\xff\xd8'
+JPEG_SOS = 0xDA
+# APP1-APP13, APP15 (EXIF, XMP, ICC, Photoshop IPTC, ...) and COM. APP0
+# (JFIF) and APP14 (Adobe colour transform) are needed to decode the image.
+JPEG_METADATA = set(range(0xE1, 0xEE)) | {0xEF, 0xFE}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_METADATA = {b'eXIf', b'iCCP', b'tEXt', b'zTXt', b'iTXt', b'tIME'}
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+def _flatten(image):
+    """Orient the pixels and drop alpha and metadata (EXIF, ICC, comments)."""
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _encode(image, fmt):
+    pil_format, options = FORMATS[fmt]
+    buffer = BytesIO()
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def _placeholder(image):
+    tiny = image.copy()
+    tiny.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    buffer = BytesIO()
+    tiny.save(buffer, 'WEBP', quality=30)
+    return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def _copy(source, target, length):
+    while length > 0:
+        chunk = source.read(min(length, COPY_CHUNK_SIZE))
+        if not chunk:
+            return
+        target.write(chunk)
+        length -= len(chunk)
+
+
+def _orientation_exif(payload):
+    """Return an EXIF block holding only the orientation of ``payload``, if any."""
+    exif = Image.Exif()
+    try:
+        exif.load(payload)
+    except Exception:
+        return None
+    orientation = exif.get(ORIENTATION)
+    if orientation in (None, 1):
+        return None
+    kept = Image.Exif()
+    kept[ORIENTATION] = orientation
+    return kept.tobytes()
+
+
+def _jpeg_parts(source):
+    """
+    Yield ``(offset, length, replacement)`` for each metadata segment before
+    the scan data, ``replacement`` being the bytes written in its place.
+    """
+    offset = 2
+    while True:
+        source.seek(offset)
+        marker = source.read(4)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise ValueError("Not a JPEG segment")
+        if marker[1] == JPEG_SOS:
+            return
+        if marker[1] == 0xFF:
+            offset += 1
+            continue
+        (length,) = struct.unpack('>H', marker[2:4])
+        if marker[1] in JPEG_METADATA:
+            replacement = b''
+            if marker[1] == 0xE1:
+                exif = _orientation_exif(source.read(length - 2))
+                if exif is not None:
+                    replacement = b'\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif
+            yield offset, 2 + length, replacement
+        offset += 2 + length
+
+
+def _png_parts(source):
+    offset = len(PNG_SIGNATURE)
+    while True:
+        source.seek(offset)
+        header = source.read(8)
+        if len(header) < 8:
+            return
+        length, kind = struct.unpack('>I4s', header)
+        if kind in PNG_METADATA:
+            replacement = b''
+            if kind == b'eXIf':
+                exif = _orientation_exif(source.read(length))
+                if exif is not None:
+                    body = b'eXIf' + exif[6:]
+                    replacement = struct.pack('>I', len(body) - 4) + body + struct.pack('>I', zlib.crc32(body))
+            yield offset, 12 + length, replacement
+        if kind == b'IEND':
+            return
+        offset += 12 + length
+
+
+def strip_metadata(content):
+    """
+    Return a copy of the JPEG or PNG ``content`` without its metadata, or
+    ``None`` if it has none (or is not such an image).
+    """
+    content.seek(0)
+    head = content.read(len(PNG_SIGNATURE))
+    parts = _png_parts if head == PNG_SIGNATURE else _jpeg_parts if head.startswith(JPEG_SOI) else None
+    if parts is None:
+        return None
+    try:
+        changes = list(parts(content))
+    except (ValueError, struct.error):
+        return None
+    if not changes:
+        return None
+
+    stripped = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    position = 0
+    for offset, length, replacement in changes:
+        content.seek(position)
+        _copy(content, stripped, offset - position)
+        stripped.write(replacement)
+        position = offset + length
+    content.seek(position)
+    # The pixel data, which may be large, is copied in chunks.
+    shutil.copyfileobj(content, stripped, COPY_CHUNK_SIZE)
+    stripped.seek(0)
+    return File(stripped, name=content.name)
+
+
+def render(field_file, storage=None):
+    """Write the renditions of ``field_file`` and return the renditions map."""
+    storage = storage or default_storage
+    with field_file.open('rb') as source:
+        image = _flatten(Image.open(source))
+
+    stem = os.path.splitext(os.path.basename(field_file.name))[0]
+    directory = os.path.join('renditions', os.path.dirname(field_file.name))
+
+    sizes = {}
+    for label, edge in settings.IMAGE_RENDITION_SIZES.items():
+        resized = image.copy()
+        # Never upscales, so small uploads keep their own size.
+        resized.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        entry = {'width': resized.width, 'height': resized.height}
+        for fmt in FORMATS:
+            name = os.path.join(directory, f'{stem}_{label}.{fmt}')
+            entry[fmt] = storage.save(name, ContentFile(_encode(resized, fmt)))
+        sizes[label] = entry
+
+    return {
+        'width': image.width,
+        'height': image.height,
+        'placeholder': _placeholder(image),
+        'sizes': sizes,
+    }
+
+
+def rendition_urls(renditions, build_url=None, storage=None):
+    """Replace the storage names in a renditions map with URLs."""
+    if not renditions:
+        return None
+    storage = storage or default_storage
+    build_url = build_url or (lambda url: url)
+    return {
+        **renditions,
+        'sizes': {
+            label: {
+                key: build_url(storage.url(value)) if key in FORMATS else value
+                for key, value in entry.items()
+            }
+            for label, entry in renditions['sizes'].items()
+        },
+    }
+
+
+@extend_schema_field(OpenApiTypes.OBJECT)
+class RenditionsField(serializers.ReadOnlyField):
+    """A renditions map with URLs, absolute when rendered for a request."""
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        return rendition_urls(value, request.build_absolute_uri if request else None)
@@ -0,0 +1,172 @@
+"""
+Media serving.
+
+``serve_media`` authorizes a request for a file under ``MEDIA_ROOT`` and
+then, depending on ``MEDIA_SENDFILE_BACKEND``, hands the transfer to the
+front-end server:
+
+* ``'x-accel-redirect'`` - nginx serves ``MEDIA_ACCEL_REDIRECT_PREFIX`` +
+  path from an ``internal`` location;
+* ``'x-sendfile'`` - Apache (mod_xsendfile) or lighttpd serves the path;
+* ``''`` - a ``FileResponse``, which WSGI servers with ``wsgi.file_wrapper``
+  (gunicorn) send with ``os.sendfile``.
+
+Either way the response carries a strong ETag, answers conditional requests
+with 304 and, in the fallback, honours single ``Range`` requests with 206.
+Files named by their SHA-256 digest never change, so they are cached as
+``immutable`` for a year.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+CONTENT_ADDRESSED = re.compile(r'^(?P<digest>[0-9a-f]{64})\.[a-z0-9]+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+
+class _RangeReader:
+    """Reads at most ``length`` bytes of ``file`` starting at ``start``."""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _is_authorized(request, path):
+    if path.startswith(tuple(settings.MEDIA_PRIVATE_PREFIXES)):
+        return False
+    if not settings.MEDIA_REQUIRE_AUTHENTICATION:
+        return True
+    drf_request = Request(
+        request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    )
+    try:
+        return drf_request.user.is_authenticated
+    except APIException:
+        return False
+
+
+def etag_for(name, stat):
+    match = CONTENT_ADDRESSED.match(name)
+    if match:
+        return f'"{match["digest"]}"'
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def cache_control(name):
+    scope = 'private' if settings.MEDIA_REQUIRE_AUTHENTICATION else 'public'
+    if CONTENT_ADDRESSED.match(name):
+        return f'{scope}, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return f'{scope}, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+
+
+def parse_range(header, size):
+    """Return ``(start, end)`` for a satisfiable single byte range, else ``None``."""
+    match = RANGE.match(header or '')
+    if not match or not size:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        return None
+    return (start, end) if start <= end and start < size else None
+
+
+def _sendfile_response(path, relative):
+    response = HttpResponse()
+    if settings.MEDIA_SENDFILE_BACKEND == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_REDIRECT_PREFIX + relative)
+    else:
+        response['X-Sendfile'] = path
+    # Let the front-end server set the type and length of the body.
+    del response['Content-Type']
+    return response
+
+
+def _file_response(request, path, stat, etag):
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if 'Range' in request.headers and (if_range is None or if_range == etag):
+        byte_range = parse_range(request.headers['Range'], stat.st_size)
+        if byte_range is None:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = FileResponse(
+            _RangeReader(open(path, 'rb'), start, length),
+            status=206, content_type=content_type,
+        )
+        response['Content-Length'] = length
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("File not found.")
+    relative = os.path.relpath(full_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+
+    if not _is_authorized(request, relative):
+        raise Http404("File not found.")
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404("File not found.")
+    if not os.path.isfile(full_path):
+        raise Http404("File not found.")
+
+    name = os.path.basename(relative)
+    etag = etag_for(name, stat)
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        if settings.MEDIA_SENDFILE_BACKEND:
+            response = _sendfile_response(full_path, relative)
+        else:
+            response = _file_response(request, full_path, stat, etag)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control(name)
+    return response
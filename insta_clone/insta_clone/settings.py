@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework_simplejwt',
@@ -102,6 +103,64 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Optional Redis shards for the channel layer (chat.layers), as
+# "name=redis://host:port/db" pairs separated by commas. Shard names place
+# rooms on the hash ring: keep them stable and add shards under new names.
+CHAT_REDIS_SHARDS = dict(
+    shard.split('=', 1) for shard in os.getenv('CHAT_REDIS_SHARDS', '').split(',') if shard
+)
+if CHAT_REDIS_SHARDS:
+    CHANNEL_LAYERS["default"] = {
+        "BACKEND": "chat.layers.ShardedChannelLayer",
+        "CONFIG": {
+            "shards": {
+                name: {"BACKEND": "channels_redis.core.RedisChannelLayer", "CONFIG": {"hosts": [url]}}
+                for name, url in CHAT_REDIS_SHARDS.items()
+            },
+            "virtual_nodes": 160,
+        },
+    }
+
+# Chat messages are written in batches (chat.buffer).
+CHAT_FLUSH_SIZE = 100
+CHAT_FLUSH_INTERVAL_MS = 100
+CHAT_ID_BLOCK_SIZE = 100
+# While the database is failing, at most this many messages wait for a retry;
+# the oldest are dropped beyond it.
+CHAT_BUFFER_MAX_PENDING = 10_000
+# Recent messages per room kept in Redis for history (chat.history).
+CHAT_HISTORY_SIZE = 100
+CHAT_HISTORY_PAGE_SIZE = 50
+# Presence and typing indicators (chat.presence). Clients ping well within
+# the TTL; roster/typing snapshots go out at most once per interval.
+CHAT_PRESENCE_TTL = 60
+CHAT_PRESENCE_INTERVAL_MS = 1000
+CHAT_TYPING_TTL_MS = 5000
+CHAT_TYPING_DEBOUNCE_MS = 2000
+# Per-connection outbound queues (chat.outbound). A connection more than
+# CHAT_OUTBOUND_MAX_QUEUE frames or CHAT_OUTBOUND_MAX_LAG_MS behind is
+# handled by CHAT_OUTBOUND_OVERFLOW: 'drop' (oldest frames) or 'close'.
+CHAT_OUTBOUND_MAX_QUEUE = 1000
+CHAT_OUTBOUND_MAX_LAG_MS = 10_000
+CHAT_OUTBOUND_MAX_BATCH = 100
+CHAT_OUTBOUND_OVERFLOW = 'drop'
+CHAT_OUTBOUND_STATS_INTERVAL = 10
+# Inbound limits (chat.ratelimit): frame size, per-connection frames and
+# per-user messages per second, and a per-user budget across processes.
+# Frames over a limit are handled by CHAT_RATE_ACTION: 'drop', 'warn' or 'close'.
+CHAT_MAX_FRAME_SIZE = 16 * 1024  # bytes
+CHAT_RATE_CONNECTION = 10
+CHAT_RATE_CONNECTION_BURST = 20
+CHAT_RATE_USER = 5
+CHAT_RATE_USER_BURST = 10
+CHAT_RATE_USER_BUDGET = 300
+CHAT_RATE_USER_WINDOW = 60
+CHAT_RATE_LEASE = 10
+CHAT_RATE_ACTION = 'warn'
+# Direct-message inboxes are kept in Redis (chat.inbox) and copied to the
+# database by the persist-chat-inboxes task.
+CHAT_INBOX_PAGE_SIZE = 20
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -188,7 +247,9 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '2/minute',
-        'user': '3/minute'
+        'user': '3/minute',
+        'user_search': '60/minute',
+        'uploads': '120/minute',
     }
 }
 
@@ -209,15 +270,102 @@ CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:9000",
 ]
 
+TIMELINE_MAX_LENGTH = 800
+
+RANKED_FEED_CANDIDATES = 300
+RANKED_FEED_TTL = 60
+RANKED_FEED_SNAPSHOT_TTL = 15 * 60
+
+EXPLORE_SIZE = 300
+EXPLORE_MAX_AGE = 60 * 60 * 24 * 7
+EXPLORE_PAGE_TTL = 60 * 60
+EXPLORE_RENDER_LOCK_TTL = 30
+
+# Trending hashtags are counted over this many one-minute buckets.
+TRENDING_TAGS_WINDOW = 60
+TRENDING_TAGS_LIMIT = 20
+
+# Buffer likes in Redis and flush them to Postgres in batches.
+LIKES_WRITE_BEHIND = os.getenv('LIKES_WRITE_BEHIND', 'false').lower() == 'true'
+
+FOLLOW_GRAPH_TTL = 60 * 60 * 24
+FOLLOW_GRAPH_LOCAL_CACHE_SIZE = 10000
+FOLLOW_GRAPH_LOCAL_CACHE_TTL = 5
+FOLLOW_GRAPH_LOCAL_MAX_IDS = 5000
+
+USER_SEARCH_LIMIT = 10
+USER_SEARCH_CACHE_SIZE = 10000
+USER_SEARCH_CACHE_TTL = 30
+# Only prefixes up to this length are cached in-process.
+USER_SEARCH_CACHE_MAX_PREFIX = 3
+
 CELERY_BROKER_URL = "redis://127.0.0.1:6379/1"
 
 CELERY_RESULTS_BACKEND = "redis://127.0.0.1:6379/1"
 
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-post-counters': {
+        'task': 'apis.tasks.reconcile_post_counters',
+        'schedule': timedelta(hours=6),
+    },
+    'recount-follow-counters': {
+        'task': 'apis.tasks.recount_follow_counters',
+        'schedule': timedelta(hours=6),
+    },
+    'refresh-feed-rankings': {
+        'task': 'apis.tasks.refresh_feed_rankings',
+        'schedule': timedelta(minutes=1),
+    },
+    'refresh-explore': {
+        'task': 'apis.tasks.refresh_explore',
+        'schedule': timedelta(minutes=1),
+    },
+    'expire-upload-sessions': {
+        'task': 'apis.tasks.expire_upload_sessions',
+        'schedule': timedelta(hours=1),
+    },
+    'flush-pending-likes': {
+        'task': 'apis.tasks.flush_pending_likes',
+        'schedule': timedelta(seconds=5),
+    },
+    'persist-chat-inboxes': {
+        'task': 'apis.tasks.persist_inboxes',
+        'schedule': timedelta(seconds=30),
+    },
+}
+
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# How media bytes leave the server: '' streams a FileResponse (sendfile under
+# gunicorn), 'x-accel-redirect' hands off to nginx, 'x-sendfile' to Apache.
+MEDIA_SENDFILE_BACKEND = os.getenv('MEDIA_SENDFILE_BACKEND', '')
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_REQUIRE_AUTHENTICATION = False
+MEDIA_PRIVATE_PREFIXES = ['uploads/']
+MEDIA_CACHE_MAX_AGE = 60 * 60
+# Hamming distance between dHashes for ``insta_clone.storage.near_duplicates``;
+# up to 3 every match is found through the band index.
+MEDIA_NEAR_DUPLICATE_DISTANCE = 3
+
+# Resumable uploads (posts.uploads).
+UPLOAD_MAX_SIZE = 50 * 1024 * 1024
+UPLOAD_MAX_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_CHUNK_READ_SIZE = 64 * 1024
+UPLOAD_MAX_PIXELS = 50_000_000
+UPLOAD_SESSION_TTL = 60 * 60 * 24
+# A range still being written after this many seconds may be taken over.
+UPLOAD_WRITE_TIMEOUT = 5 * 60
+
+# Longest edge, in pixels, of each image rendition.
+IMAGE_RENDITION_SIZES = {
+    'thumbnail': 150,
+    'feed': 640,
+    'full': 1080,
+}
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
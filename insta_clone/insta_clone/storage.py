@@ -0,0 +1,195 @@
+"""
+Content-addressed media storage.
+
+Post images and profile pictures are stored as ``<upload_to>/<sha256>.<ext>``,
+so identical uploads share one file (and one URL, which ``insta_clone.media``
+caches as immutable). Each file has a ``StoredFile`` row counting the fields
+that reference it: saving known content only bumps the count, and deleting
+drops it, removing the file and its renditions once nothing refers to it.
+Image metadata is stripped first (``insta_clone.images.strip_metadata``),
+so the digest is of the file that is served.
+
+Rendering (in the Celery render tasks, once per content) also records a
+64-bit difference hash (dHash) of the image, so uploads are never decoded in
+the request that saves them. The hash is indexed as four tagged 16-bit bands
+in a GIN-indexed array; two hashes within Hamming distance 3 share at least
+one band, so ``near_duplicates`` finds every such image with an index lookup
+and checks the distance of the few candidates in Python.
+"""
+import hashlib
+import os
+import posixpath
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.db.models import F
+
+from PIL import Image, ImageOps
+
+HASH_SIZE = 8
+BAND_BITS = 16
+BANDS = 64 // BAND_BITS
+
+
+def _sha256(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dhash(image):
+    """Return the 64-bit difference hash of ``image`` as an unsigned int."""
+    # JPEGs are decoded at reduced scale; the hash only needs 9x8 pixels.
+    image.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+    image = ImageOps.exif_transpose(image).convert('L')
+    pixels = list(
+        image.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS).getdata()
+    )
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            value = value << 1 | (left > pixels[row * (HASH_SIZE + 1) + col + 1])
+    return value
+
+
+def to_signed(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value & ((1 << 64) - 1)
+
+
+def bands(value):
+    """Split an unsigned hash into bands tagged with their position."""
+    mask = (1 << BAND_BITS) - 1
+    return [
+        index << BAND_BITS | (value >> (index * BAND_BITS)) & mask
+        for index in range(BANDS)
+    ]
+
+
+def distance(a, b):
+    return (to_unsigned(a) ^ to_unsigned(b)).bit_count()
+
+
+def _image_hash(field_file):
+    try:
+        with field_file.open('rb') as source, Image.open(source) as image:
+            return dhash(image)
+    except Exception:
+        return None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """A ``FileSystemStorage`` that deduplicates files by content."""
+
+    def _save(self, name, content):
+        from posts.models import StoredFile
+
+        from . import images
+
+        stripped = images.strip_metadata(content)
+        if stripped is not None:
+            content = stripped
+        digest = _sha256(content)
+        extension = os.path.splitext(name)[1].lower()
+        name = posixpath.join(posixpath.dirname(name), digest + extension)
+
+        with transaction.atomic():
+            # The row lock serializes writers and collectors of this file.
+            stored, created = StoredFile.objects.select_for_update().get_or_create(
+                name=name, defaults={'size': content.size},
+            )
+            if not created:
+                StoredFile.objects.filter(pk=stored.pk).update(refcount=F('refcount') + 1)
+            # Also rewrites a file collected while its count was zero.
+            if not self.exists(name):
+                super()._save(name, content)
+        return name
+
+    def delete(self, name):
+        """Release one reference to ``name``, removing the file after the last."""
+        from posts.models import StoredFile
+
+        with transaction.atomic():
+            updated = StoredFile.objects.filter(name=name, refcount__gt=0).update(
+                refcount=F('refcount') - 1
+            )
+            if updated:
+                transaction.on_commit(lambda: self.collect(name))
+
+    def collect(self, name):
+        """Remove ``name`` and its renditions if it is no longer referenced."""
+        from posts.models import StoredFile
+
+        with transaction.atomic():
+            stored = StoredFile.objects.select_for_update().filter(name=name, refcount=0).first()
+            if stored is None:
+                return False
+            super().delete(name)
+            for entry in stored.renditions.get('sizes', {}).values():
+                for value in entry.values():
+                    if isinstance(value, str):
+                        default_storage.delete(value)
+            stored.delete()
+            return True
+
+
+media_storage = ContentAddressedStorage()
+
+
+def get_media_storage():
+    return media_storage
+
+
+def renditions_for(field_file):
+    """
+    Return the renditions map of ``field_file``, rendering each content
+    once and recording its dHash alongside.
+    """
+    from posts.models import StoredFile
+
+    from . import images
+
+    stored = StoredFile.objects.filter(name=field_file.name).first()
+    if stored is not None and stored.renditions:
+        return stored.renditions
+    renditions = images.render(field_file)
+    if stored is not None:
+        image_hash = _image_hash(field_file) if stored.dhash is None else None
+        hashed = {} if image_hash is None else {
+            'dhash': to_signed(image_hash), 'dhash_bands': bands(image_hash),
+        }
+        StoredFile.objects.filter(pk=stored.pk, renditions={}).update(renditions=renditions, **hashed)
+    return renditions
+
+
+def near_duplicates(name, max_distance=None):
+    """
+    Return ``[(StoredFile, distance)]`` for images that look like ``name``,
+    closest first, excluding ``name`` itself.
+    """
+    from posts.models import StoredFile
+
+    max_distance = settings.MEDIA_NEAR_DUPLICATE_DISTANCE if max_distance is None else max_distance
+    stored = StoredFile.objects.filter(name=name).exclude(dhash=None).first()
+    if stored is None:
+        return []
+
+    candidates = (
+        StoredFile.objects.filter(dhash_bands__overlap=stored.dhash_bands, refcount__gt=0)
+        .exclude(pk=stored.pk)
+        .only('name', 'dhash', 'refcount')
+    )
+    matches = [
+        (candidate, distance(candidate.dhash, stored.dhash))
+        for candidate in candidates
+    ]
+    return sorted(
+        [match for match in matches if match[1] <= max_distance],
+        key=lambda match: (match[1], match[0].name),
+    )
@@ -0,0 +1,61 @@
+"""
+Maintenance of the denormalized ``likes_count``/``comments_count`` columns.
+
+The counters are adjusted with F-expressions on every like, unlike and
+comment; ``reconcile`` repairs any drift (e.g. from cascading deletes)
+by recounting in primary-key chunks so no long table locks are taken.
+"""
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Post, Like, Comment
+
+
+def increment(post_id, field, delta=1):
+    """Atomically shift a post counter by ``delta``, stopping at zero."""
+    return Post.objects.filter(id=post_id).update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def _count_subquery(model):
+    counts = (
+        model.objects.filter(post=OuterRef('pk'))
+        .order_by()
+        .values('post')
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def reconcile(chunk_size=1000):
+    """Recount likes and comments for every post, returning the rows repaired."""
+    repaired = 0
+    last_id = 0
+
+    while True:
+        ids = list(
+            Post.objects.filter(pk__gt=last_id)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return repaired
+        last_id = ids[-1]
+
+        with transaction.atomic():
+            drifted = list(
+                Post.objects.filter(pk__in=ids)
+                .annotate(
+                    actual_likes=_count_subquery(Like),
+                    actual_comments=_count_subquery(Comment),
+                )
+                .exclude(
+                    likes_count=F('actual_likes'),
+                    comments_count=F('actual_comments'),
+                )
+                .values_list('pk', 'actual_likes', 'actual_comments')
+            )
+            for pk, likes, comments in drifted:
+                Post.objects.filter(pk=pk).update(likes_count=likes, comments_count=comments)
+        repaired += len(drifted)
@@ -0,0 +1,134 @@
+"""
+Global Explore surface.
+
+The trending list is the top of the ``ranking:velocity`` sorted set, which
+``posts.ranking.refresh`` keeps as a time-decayed score over new likes and
+comments. The ``refresh_explore`` Celery task renders that list once, as a
+viewer-neutral ``PostSerializer`` payload split into pages, and publishes
+the pages under a new version so readers never see a half-written set.
+Requests are then a single cache read plus the viewer's own flags, and
+cursors name the version they page through. If the
+pages are missing (the task stopped, or the cache evicted them), one request
+renders them under a lock while concurrent ones get an empty page.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+from rest_framework.settings import api_settings
+
+from insta_clone.images import rendition_urls
+
+from . import likes, ranking, timeline
+from .models import Post
+from .serializers import PostSerializer
+from users import graph
+
+VERSION_KEY = 'explore:version'
+RENDER_LOCK_KEY = 'explore:rendering'
+
+
+def page_key(version, number):
+    # Each page is stored with whether another follows it.
+    return f"explore:{version}:page:{number}"
+
+
+def trending_post_ids(now=None):
+    """Return up to ``EXPLORE_SIZE`` trending post ids, hottest first."""
+    now = now or time.time()
+    scored = [
+        int(post_id) for post_id in
+        ranking.get_connection().zrevrange(ranking.VELOCITY_KEY, 0, settings.EXPLORE_SIZE * 2 - 1)
+    ]
+    cutoff = datetime.fromtimestamp(now, tz=timezone.utc) - timedelta(seconds=settings.EXPLORE_MAX_AGE)
+    fresh = set(
+        Post.objects.filter(id__in=scored, created_at__gte=cutoff).values_list('id', flat=True)
+    )
+    return [post_id for post_id in scored if post_id in fresh][:settings.EXPLORE_SIZE]
+
+
+def render(now=None):
+    """Pre-render the trending pages and publish them as a new version."""
+    post_ids = trending_post_ids(now)
+    posts = timeline.hydrate(post_ids, Post.objects.select_related('user'))
+    # Rendered without a request, so the rows are viewer-neutral. The author
+    # id (for ``author_followed``) and the raw renditions map are kept so
+    # each request can fill in its flags and absolute URLs.
+    rows = [
+        dict(row, user_id=post.user_id, renditions=post.renditions)
+        for post, row in zip(posts, PostSerializer(posts, many=True).data)
+    ]
+
+    page_size = api_settings.PAGE_SIZE
+    pages = [rows[i:i + page_size] for i in range(0, len(rows), page_size)] or [[]]
+
+    current = (time.time_ns(), len(pages))
+    cache.set_many(
+        {
+            page_key(current[0], number): (page, number + 1 < len(pages))
+            for number, page in enumerate(pages)
+        },
+        settings.EXPLORE_PAGE_TTL,
+    )
+    cache.set(VERSION_KEY, current, None)
+    return current
+
+
+def _first_page():
+    current = cache.get(VERSION_KEY)
+    page = cache.get(page_key(current[0], 0)) if current is not None else None
+    if page is not None:
+        return current[0], page
+
+    # Nothing published yet, or the pages expired because the task stopped.
+    if not cache.add(RENDER_LOCK_KEY, 1, settings.EXPLORE_RENDER_LOCK_TTL):
+        # Someone else is rendering; don't pile on.
+        return None, None
+    try:
+        current = render()
+    finally:
+        cache.delete(RENDER_LOCK_KEY)
+    return current[0], cache.get(page_key(current[0], 0))
+
+
+def get_page(position=None):
+    """
+    Return ``(rows, next_position)`` for a pre-rendered page, rendering if
+    cold. Positions are ``(version, number)``, so a reader keeps paging
+    through the version it started on; once that version has expired it
+    starts over from the first page of the current one.
+    """
+    if position is not None:
+        version, number = position
+        page = cache.get(page_key(version, number))
+        if page is None and number and cache.get(page_key(version, 0)) is not None:
+            # Past the end of a version that is still around.
+            return [], None
+    if position is None or page is None:
+        (version, page), number = _first_page(), 0
+    if page is None:
+        return [], None
+
+    rows, has_next = page
+    return list(rows), (version, number + 1) if has_next else None
+
+
+def apply_viewer(rows, request):
+    """Fill in absolute urls and the viewer's flags on pre-rendered rows."""
+    viewer = request.user
+    liked = likes.liked_post_ids(viewer.id, [row['id'] for row in rows])
+    followed = graph.following_among(viewer.id, {row['user_id'] for row in rows})
+
+    results = []
+    for row in rows:
+        row = dict(row)
+        row['url'] = request.build_absolute_uri(row['url'])
+        if row['image']:
+            row['image'] = request.build_absolute_uri(row['image'])
+        row['renditions'] = rendition_urls(row['renditions'], request.build_absolute_uri)
+        row['liked_by_me'] = row['id'] in liked
+        row['author_followed'] = row.pop('user_id') in followed
+        results.append(row)
+    return results
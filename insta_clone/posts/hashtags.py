@@ -0,0 +1,127 @@
+"""
+Hashtag inverted index and trending tags.
+
+Captions are parsed once, when a post is created, into ``Hashtag`` rows
+and ``PostHashtag`` links (two ``bulk_create(ignore_conflicts=True)``
+calls), so listing a tag's posts is an index scan on
+``(hashtag_id, post_id)``.
+
+Every use of a tag also bumps a per-minute sorted set in Redis
+(``tags:minute:<minute>``). Trending tags are the ``ZUNIONSTORE`` of the
+last ``TRENDING_TAGS_WINDOW`` buckets, computed at most once a minute, so
+the trending query never touches the posts table.
+"""
+import re
+import time
+
+from django.conf import settings
+
+from django_redis import get_redis_connection
+
+from .models import Post, Hashtag, PostHashtag
+
+MAX_LENGTH = Hashtag._meta.get_field('name').max_length
+
+HASHTAG_RE = re.compile(r'(?<![\w#])#(\w+)')
+
+
+def get_connection():
+    return get_redis_connection('default')
+
+
+def normalize(tag):
+    return tag.lstrip('#').lower()
+
+
+def extract(caption):
+    """Return the caption's distinct hashtags, normalized, in order of appearance."""
+    names = []
+    for match in HASHTAG_RE.finditer(caption or ''):
+        name = normalize(match.group(1))
+        if len(name) <= MAX_LENGTH and name not in names:
+            names.append(name)
+    return names
+
+
+def index_posts(posts):
+    """Link ``posts`` to the hashtags in their captions. Returns the tags per post."""
+    tags = {post.id: extract(post.caption) for post in posts}
+    names = {name for post_names in tags.values() for name in post_names}
+    if not names:
+        return tags
+
+    Hashtag.objects.bulk_create(
+        [Hashtag(name=name) for name in names], ignore_conflicts=True
+    )
+    ids = dict(Hashtag.objects.filter(name__in=names).values_list('name', 'id'))
+    PostHashtag.objects.bulk_create(
+        [
+            PostHashtag(post_id=post_id, hashtag_id=ids[name])
+            for post_id, post_names in tags.items()
+            for name in post_names
+        ],
+        ignore_conflicts=True,
+    )
+    return tags
+
+
+def reindex(chunk_size=1000):
+    """Index hashtags of every existing post, returning the posts scanned."""
+    scanned = 0
+    last_id = 0
+
+    while True:
+        posts = list(
+            Post.objects.filter(pk__gt=last_id)
+            .order_by('pk')
+            .only('id', 'caption')[:chunk_size]
+        )
+        if not posts:
+            return scanned
+        last_id = posts[-1].pk
+
+        index_posts(posts)
+        scanned += len(posts)
+
+
+def bucket_key(minute):
+    return f"tags:minute:{minute}"
+
+
+def trending_key(minute):
+    return f"tags:trending:{minute}"
+
+
+def record(names, now=None):
+    """Count a use of each of ``names`` in the current minute's bucket."""
+    if not names:
+        return
+    minute = int(now or time.time()) // 60
+    key = bucket_key(minute)
+
+    pipe = get_connection().pipeline()
+    for name in names:
+        pipe.zincrby(key, 1, name)
+    pipe.expire(key, (settings.TRENDING_TAGS_WINDOW + 1) * 60)
+    pipe.execute()
+
+
+def trending(limit=None, now=None):
+    """Return ``[(tag, uses)]`` over the sliding window, most used first."""
+    limit = limit or settings.TRENDING_TAGS_LIMIT
+    minute = int(now or time.time()) // 60
+    key = trending_key(minute)
+
+    conn = get_connection()
+    if not conn.exists(key):
+        window = [bucket_key(minute - offset) for offset in range(settings.TRENDING_TAGS_WINDOW)]
+        pipe = conn.pipeline()
+        pipe.zunionstore(key, window)
+        # The current minute keeps filling, so the union is only reused briefly.
+        pipe.expire(key, 60)
+        pipe.execute()
+
+    return [
+        (name.decode(), int(score))
+        for name, score in conn.zrevrange(key, 0, limit - 1, withscores=True)
+    ]
@@ -0,0 +1,245 @@
+"""
+Write-behind buffer for likes (enabled with ``LIKES_WRITE_BEHIND``).
+
+A tap records the user's desired state in a per-post Redis hash
+(``likes:pending:<post>``), marks the post dirty and adjusts a pending
+count delta; nothing is written to ``posts_like``. The periodic
+``flush_pending_likes`` task moves each dirty post's hash aside, applies
+it with ``bulk_create(ignore_conflicts=True)`` and one batched delete,
+recounts ``likes_count`` and then retires the delta it applied. A post
+whose flush fails is marked dirty again and retried on the next run.
+
+Readers merge the pending and in-flight hashes over the database, so the
+acting user always sees their own taps. A tap with no buffered state uses
+the database's, unless a flush of the post finished after it was read
+(counted in ``likes:flushes:<post>``); then it is read again.
+"""
+import logging
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from django_redis import get_redis_connection
+
+from .models import Post, Like
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+DIRTY_KEY = 'likes:dirty'
+DELTA_KEY = 'likes:delta'
+
+LIKED = '1'
+UNLIKED = '0'
+TOGGLE = 'toggle'
+
+# KEYS: pending, processing, delta, dirty, flushes
+# ARGV: user id, post id, desired state (or 'toggle'), database state, the
+# post's flush count when that state was read
+# Falls back to the database state only if no flush finished since it was
+# read; returns an empty reply to have it read again.
+_SET_STATE = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if not current then current = redis.call('HGET', KEYS[2], ARGV[1]) end
+if not current then
+    if (redis.call('GET', KEYS[5]) or '0') ~= ARGV[5] then return {} end
+    current = ARGV[4]
+end
+
+local desired = ARGV[3]
+if desired == 'toggle' then
+    if current == '1' then desired = '0' else desired = '1' end
+end
+
+local changed = 0
+if desired ~= current then
+    changed = 1
+    redis.call('HSET', KEYS[1], ARGV[1], desired)
+    redis.call('SADD', KEYS[4], ARGV[2])
+    redis.call('HINCRBY', KEYS[3], ARGV[2], desired == '1' and 1 or -1)
+end
+return {desired, tonumber(redis.call('HGET', KEYS[3], ARGV[2]) or '0'), changed}
+"""
+
+# KEYS: pending, processing, delta; ARGV: post id
+# Moves the pending hash aside (merging into a leftover from a failed
+# flush) and returns it with the delta it accounts for.
+_GRAB = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        local pending = redis.call('HGETALL', KEYS[1])
+        for i = 1, #pending, 2 do
+            redis.call('HSET', KEYS[2], pending[i], pending[i + 1])
+        end
+        redis.call('DEL', KEYS[1])
+    else
+        redis.call('RENAME', KEYS[1], KEYS[2])
+    end
+end
+return {redis.call('HGETALL', KEYS[2]), tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or '0')}
+"""
+
+# KEYS: processing, delta, flushes; ARGV: post id, negated applied delta
+_RETIRE = """
+redis.call('DEL', KEYS[1])
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], 3600)
+if redis.call('HINCRBY', KEYS[2], ARGV[1], ARGV[2]) == 0 then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+return 1
+"""
+
+_STATE_SQL = """
+    SELECT likes_count, EXISTS (
+        SELECT 1 FROM {like} WHERE user_id = %s AND post_id = {post}.id
+    )
+    FROM {post} WHERE id = %s
+"""
+
+
+def get_connection():
+    return get_redis_connection('default')
+
+
+def pending_key(post_id):
+    return f"likes:pending:{post_id}"
+
+
+def processing_key(post_id):
+    return f"likes:processing:{post_id}"
+
+
+def flushes_key(post_id):
+    return f"likes:flushes:{post_id}"
+
+
+def _database_state(user_id, post_id):
+    sql = _STATE_SQL.format(like=Like._meta.db_table, post=Post._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, post_id])
+        return cursor.fetchone()
+
+
+def record(user_id, post_id, desired):
+    """
+    Record a like, unlike or toggle (``LIKED``, ``UNLIKED`` or ``TOGGLE``).
+
+    Returns ``(liked, likes_count, changed)`` or ``None`` if the post does
+    not exist.
+    """
+    conn = get_connection()
+    script = conn.register_script(_SET_STATE)
+    keys = [pending_key(post_id), processing_key(post_id), DELTA_KEY, DIRTY_KEY, flushes_key(post_id)]
+    while True:
+        # A flush finishing after the database is read makes its state stale.
+        flushes = conn.get(flushes_key(post_id)) or b'0'
+        row = _database_state(user_id, post_id)
+        if row is None:
+            return None
+
+        likes_count, liked_in_db = row
+        result = script(
+            keys=keys,
+            args=[user_id, post_id, desired, LIKED if liked_in_db else UNLIKED, flushes],
+        )
+        if result:
+            state, delta, changed = result
+            return state.decode() == LIKED, max(likes_count + delta, 0), bool(changed)
+
+
+def pending_states(user_id, post_ids):
+    """Return ``{post_id: liked}`` for posts with unflushed taps by ``user_id``."""
+    pipe = get_connection().pipeline(transaction=False)
+    for post_id in post_ids:
+        pipe.hget(pending_key(post_id), user_id)
+        pipe.hget(processing_key(post_id), user_id)
+    values = pipe.execute()
+
+    states = {}
+    for index, post_id in enumerate(post_ids):
+        state = values[2 * index] or values[2 * index + 1]
+        if state is not None:
+            states[post_id] = state.decode() == LIKED
+    return states
+
+
+def pending_deltas(post_ids):
+    """Return ``{post_id: delta}`` of unflushed changes to ``likes_count``."""
+    if not post_ids:
+        return {}
+    values = get_connection().hmget(DELTA_KEY, list(post_ids))
+    return {
+        post_id: int(value)
+        for post_id, value in zip(post_ids, values)
+        if value is not None
+    }
+
+
+def _count_subquery():
+    counts = (
+        Like.objects.filter(post=OuterRef('pk'))
+        .order_by()
+        .values('post')
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def flush_post(post_id):
+    """Apply one post's buffered taps to the database."""
+    conn = get_connection()
+    entries, delta = conn.register_script(_GRAB)(
+        keys=[pending_key(post_id), processing_key(post_id), DELTA_KEY],
+        args=[post_id],
+    )
+    states = {
+        int(entries[i]): entries[i + 1].decode()
+        for i in range(0, len(entries), 2)
+    }
+    liked = [user_id for user_id, state in states.items() if state == LIKED]
+    unliked = [user_id for user_id, state in states.items() if state == UNLIKED]
+
+    with transaction.atomic():
+        # Taps on a post or by a user deleted since are dropped with them.
+        if Post.objects.select_for_update().filter(id=post_id).exists():
+            liked = User.objects.filter(id__in=liked).values_list('id', flat=True)
+            Like.objects.bulk_create(
+                [Like(user_id=user_id, post_id=post_id) for user_id in liked],
+                ignore_conflicts=True,
+            )
+            if unliked:
+                Like.objects.filter(post_id=post_id, user_id__in=unliked).delete()
+            Post.objects.filter(id=post_id).update(likes_count=_count_subquery())
+
+    conn.register_script(_RETIRE)(
+        keys=[processing_key(post_id), DELTA_KEY, flushes_key(post_id)],
+        args=[post_id, -delta],
+    )
+    return len(states)
+
+
+def flush(max_posts=1000):
+    """Flush up to ``max_posts`` dirty posts, returning how many were flushed."""
+    conn = get_connection()
+    flushed = 0
+    failed = []
+    for _ in range(max_posts):
+        post_id = conn.spop(DIRTY_KEY)
+        if post_id is None:
+            break
+        try:
+            flush_post(int(post_id))
+        except Exception:
+            logger.exception("Flushing likes of post %s failed", int(post_id))
+            failed.append(post_id)
+        else:
+            flushed += 1
+    if failed:
+        # Their processing hashes are merged into and retried on the next run.
+        conn.sadd(DIRTY_KEY, *failed)
+    return flushed
@@ -0,0 +1,127 @@
+"""
+Race-free like primitives.
+
+Each operation is a single SQL statement: the like row is inserted with
+``ON CONFLICT DO NOTHING`` and/or deleted with ``DELETE ... RETURNING`` in
+data-modifying CTEs, and the post's ``likes_count`` is adjusted in the same
+statement, which also reports the resulting state. The count never goes
+below zero, even for a like it did not account for.
+
+With ``LIKES_WRITE_BEHIND`` enabled the same calls are recorded in the
+Redis buffer of ``posts.like_buffer`` instead, and the read helpers merge
+its unflushed state over the database.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection
+
+from . import like_buffer
+from .models import Post, Like
+
+LikeResult = namedtuple('LikeResult', ['liked', 'likes_count', 'changed'])
+
+_NOTHING = "SELECT 1 WHERE FALSE"
+
+_REMOVE = """
+    DELETE FROM {like} WHERE user_id = %(user_id)s AND post_id = %(post_id)s
+    RETURNING 1
+"""
+
+_ADD = """
+    INSERT INTO {like} (user_id, post_id, created_at)
+    SELECT %(user_id)s, %(post_id)s, now()
+    WHERE EXISTS (SELECT 1 FROM {post} WHERE id = %(post_id)s) {guard}
+    ON CONFLICT (user_id, post_id) DO NOTHING
+    RETURNING 1
+"""
+
+_STATEMENT = """
+    WITH removed AS ({removed}), added AS ({added})
+    UPDATE {post}
+    SET likes_count = GREATEST(likes_count
+        + (SELECT count(*) FROM added)
+        - (SELECT count(*) FROM removed), 0)
+    WHERE id = %(post_id)s
+    RETURNING likes_count, {liked},
+        EXISTS (SELECT 1 FROM added) OR EXISTS (SELECT 1 FROM removed)
+"""
+
+
+def _build(removed, added, liked, guard=''):
+    tables = {'like': Like._meta.db_table, 'post': Post._meta.db_table}
+    return _STATEMENT.format(
+        removed=removed.format(**tables),
+        added=added.format(guard=guard, **tables),
+        liked=liked,
+        **tables
+    )
+
+
+# A toggle only inserts when nothing was deleted. If a concurrent request
+# inserted the row first, the conflict leaves the post liked.
+TOGGLE_SQL = _build(
+    _REMOVE, _ADD,
+    liked="EXISTS (SELECT 1 FROM added) OR NOT EXISTS (SELECT 1 FROM removed)",
+    guard="AND NOT EXISTS (SELECT 1 FROM removed)",
+)
+LIKE_SQL = _build(_NOTHING, _ADD, liked="TRUE")
+UNLIKE_SQL = _build(_REMOVE, _NOTHING, liked="FALSE")
+
+
+def _execute(sql, user_id, post_id):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'user_id': user_id, 'post_id': post_id})
+        row = cursor.fetchone()
+    return LikeResult(row[1], row[0], row[2]) if row else None
+
+
+def _record(user_id, post_id, desired):
+    result = like_buffer.record(user_id, post_id, desired)
+    return LikeResult(*result) if result else None
+
+
+def toggle(user_id, post_id):
+    """Flip the like state. Returns ``None`` if the post does not exist."""
+    if settings.LIKES_WRITE_BEHIND:
+        return _record(user_id, post_id, like_buffer.TOGGLE)
+    return _execute(TOGGLE_SQL, user_id, post_id)
+
+
+def like(user_id, post_id):
+    """Idempotently like a post. Returns ``None`` if the post does not exist."""
+    if settings.LIKES_WRITE_BEHIND:
+        return _record(user_id, post_id, like_buffer.LIKED)
+    return _execute(LIKE_SQL, user_id, post_id)
+
+
+def unlike(user_id, post_id):
+    """Idempotently unlike a post. Returns ``None`` if the post does not exist."""
+    if settings.LIKES_WRITE_BEHIND:
+        return _record(user_id, post_id, like_buffer.UNLIKED)
+    return _execute(UNLIKE_SQL, user_id, post_id)
+
+
+def liked_post_ids(user_id, post_ids):
+    """Return the subset of ``post_ids`` liked by ``user_id`` in one query."""
+    if not post_ids:
+        return set()
+    liked = set(
+        Like.objects.filter(user_id=user_id, post_id__in=post_ids)
+        .values_list('post_id', flat=True)
+    )
+
+    if settings.LIKES_WRITE_BEHIND:
+        for post_id, state in like_buffer.pending_states(user_id, post_ids).items():
+            if state:
+                liked.add(post_id)
+            else:
+                liked.discard(post_id)
+    return liked
+
+
+def likes_count_deltas(post_ids):
+    """Return unflushed ``likes_count`` changes keyed by post id."""
+    if not settings.LIKES_WRITE_BEHIND:
+        return {}
+    return like_buffer.pending_deltas(post_ids)
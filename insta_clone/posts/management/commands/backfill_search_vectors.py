@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = "Fill in the caption search vector for posts created before it existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help="Number of posts updated per statement.",
+        )
+
+    def handle(self, *args, **options):
+        updated = search.backfill(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} posts."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts import hashtags
+
+
+class Command(BaseCommand):
+    help = "Index the hashtags in the captions of existing posts."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help="Number of posts indexed per batch.",
+        )
+
+    def handle(self, *args, **options):
+        scanned = hashtags.reindex(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed hashtags of {scanned} posts."))
@@ -0,0 +1,32 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Backfill or rebuild materialized home timelines."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', action='append', dest='usernames', default=[],
+            help="Only rebuild the timeline of this username (repeatable).",
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help="Number of users loaded per database round trip.",
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        rebuilt = 0
+        for user_id in users.values_list('id', flat=True).iterator(chunk_size=options['chunk_size']):
+            timeline.rebuild(user_id)
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} timelines."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = "Repair drift in the denormalized like and comment counters on posts."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help="Number of posts recounted per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        repaired = counters.reconcile(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Repaired {repaired} posts."))
@@ -0,0 +1,35 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Builds the GIN index without blocking writes; existing rows are
+    # filled in afterwards by ``manage.py backfill_search_vectors``.
+    atomic = False
+
+    dependencies = [
+        ('posts', '0005_engagement_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            sql=(
+                "CREATE TRIGGER post_search_vector_update "
+                "BEFORE INSERT OR UPDATE OF caption, search_vector ON posts_post "
+                "FOR EACH ROW EXECUTE FUNCTION "
+                "tsvector_update_trigger(search_vector, 'pg_catalog.english', caption);"
+            ),
+            reverse_sql="DROP TRIGGER post_search_vector_update ON posts_post;",
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='post_search_vector_idx'),
+        ),
+    ]
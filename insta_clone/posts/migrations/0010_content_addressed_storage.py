@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:07
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import insta_clone.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_upload_session'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=insta_clone.storage.get_media_storage, upload_to='posts/'),
+        ),
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('refcount', models.PositiveIntegerField(default=1)),
+                ('dhash', models.BigIntegerField(blank=True, null=True)),
+                ('dhash_bands', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, size=None)),
+                ('renditions', models.JSONField(blank=True, default=dict, editable=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [django.contrib.postgres.indexes.GinIndex(fields=['dhash_bands'], name='storedfile_dhash_bands_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 04:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='writing_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,13 @@
+import uuid
+
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
+from insta_clone.storage import get_media_storage
+
 User  = get_user_model()
 
 
@@ -10,15 +17,41 @@ class Post(models.Model):
         related_name='posts'
     )
     image = models.ImageField(
-        upload_to='posts/',
+        upload_to='posts/', storage=get_media_storage,
         blank=True, null=True
     )
+    # Written by the ``render_post_image`` task; see ``insta_clone.images``.
+    renditions = models.JSONField(
+        default=dict, blank=True, editable=False
+    )
     caption = models.TextField(
         blank=True
     )
+    likes_count = models.PositiveIntegerField(
+        default=0
+    )
+    comments_count = models.PositiveIntegerField(
+        default=0
+    )
     created_at = models.DateTimeField(
         auto_now_add=True
     )
+    # Maintained from ``caption`` by a database trigger (see migration 0006).
+    search_vector = SearchVectorField(
+        null=True, editable=False
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', '-created_at', '-id'],
+                name='post_user_created_idx'
+            ),
+            GinIndex(
+                fields=['search_vector'],
+                name='post_search_vector_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user} | {self.caption}"
@@ -39,6 +72,9 @@ class Like(models.Model):
 
     class Meta:
         unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['created_at'], name='like_created_idx'),
+        ]
 
 
 class Comment(models.Model):
@@ -56,3 +92,115 @@ class Comment(models.Model):
     created_at = models.DateTimeField(
         auto_now_add=True
     )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['post', '-created_at', '-id'],
+                name='comment_post_created_idx'
+            ),
+            models.Index(fields=['created_at'], name='comment_created_idx'),
+        ]
+
+
+class Hashtag(models.Model):
+    name = models.CharField(
+        max_length=100, unique=True
+    )
+
+    def __str__(self):
+        return f"#{self.name}"
+
+
+class PostHashtag(models.Model):
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE,
+        related_name='post_hashtags'
+    )
+    hashtag = models.ForeignKey(
+        Hashtag, on_delete=models.CASCADE,
+        related_name='post_hashtags'
+    )
+
+    class Meta:
+        # Also the index for listing a tag's posts newest (highest id) first.
+        unique_together = ('hashtag', 'post')
+
+
+class UploadSession(models.Model):
+    id = models.UUIDField(
+        primary_key=True, default=uuid.uuid4, editable=False
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        related_name='upload_sessions'
+    )
+    caption = models.TextField(
+        blank=True
+    )
+    size = models.PositiveBigIntegerField(
+
+    )
+    received = models.PositiveBigIntegerField(
+        default=0
+    )
+    # Filled in from the first bytes, before the rest is accepted.
+    format = models.CharField(
+        max_length=10, blank=True
+    )
+    width = models.PositiveIntegerField(
+        null=True, blank=True
+    )
+    height = models.PositiveIntegerField(
+        null=True, blank=True
+    )
+    # Set while a range is being written; see posts.uploads.
+    writing_since = models.DateTimeField(
+        null=True, blank=True
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    def __str__(self):
+        return f"{self.user} | {self.received}/{self.size}"
+
+
+class StoredFile(models.Model):
+    """A content-addressed file and the number of fields referencing it."""
+    # ``<upload_to>/<sha256>.<ext>``; see ``insta_clone.storage``.
+    name = models.CharField(
+        max_length=255, unique=True
+    )
+    size = models.PositiveBigIntegerField(
+
+    )
+    refcount = models.PositiveIntegerField(
+        default=1
+    )
+    # 64-bit difference hash of the image, stored signed.
+    dhash = models.BigIntegerField(
+        null=True, blank=True
+    )
+    # The dhash split into tagged 16-bit bands for near-duplicate lookups.
+    dhash_bands = ArrayField(
+        models.IntegerField(), default=list, blank=True
+    )
+    # Shared by every post or profile picture with this content.
+    renditions = models.JSONField(
+        default=dict, blank=True, editable=False
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    class Meta:
+        indexes = [
+            GinIndex(
+                fields=['dhash_bands'],
+                name='storedfile_dhash_bands_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
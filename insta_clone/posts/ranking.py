@@ -0,0 +1,206 @@
+"""
+Ranked home feed.
+
+The ``refresh_feed_rankings`` Celery task folds the likes and comments
+added since its previous run (by id, so rows that commit late are still
+seen) into two exponentially decayed scores:
+
+* ``ranking:velocity`` - a sorted set of post id -> recent engagement.
+  Each run first decays the whole set in Redis (``ZUNIONSTORE`` with a
+  weight) and then adds the new events, so the database is only asked
+  for new rows.
+* ``ranking:affinity:<user>`` - a sorted set of author id -> how much the
+  user recently engaged with that author, decayed lazily from the time
+  stored in ``ranking:affinity_updated``.
+
+A ranked request scores the newest candidates of the user's feed by
+recency x velocity x affinity in Python and caches the ordered window
+as a snapshot, current for ``RANKED_FEED_TTL`` seconds. Cursors name the
+snapshot, so later pages are a cache read from the same ordering.
+"""
+import math
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+
+from django_redis import get_redis_connection
+
+from . import timeline
+from .models import Post, Like, Comment
+
+VELOCITY_KEY = 'ranking:velocity'
+AFFINITY_UPDATED_KEY = 'ranking:affinity_updated'
+LAST_RUN_KEY = 'ranking:last_run'
+LAST_IDS_KEY = 'ranking:last_ids'
+
+VELOCITY_HALF_LIFE = 60 * 60 * 6
+AFFINITY_HALF_LIFE = 60 * 60 * 24 * 14
+RECENCY_HALF_LIFE = 60 * 60 * 12
+AFFINITY_TTL = 60 * 60 * 24 * 60
+
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+ENGAGEMENT = {'like': (Like, LIKE_WEIGHT), 'comment': (Comment, COMMENT_WEIGHT)}
+
+# Scores below this are dropped from the velocity set.
+MIN_SCORE = 0.01
+
+
+def get_connection():
+    return get_redis_connection('default')
+
+
+def affinity_key(user_id):
+    return f"ranking:affinity:{user_id}"
+
+
+def decay(elapsed, half_life):
+    """Multiplier for a score that has aged ``elapsed`` seconds."""
+    return 0.5 ** (max(elapsed, 0) / half_life)
+
+
+def _events(model, after_id, since):
+    """
+    Yield ``(id, post_id, viewer_id, author_id, created_at)`` for ``model``
+    rows after ``after_id``, or created after ``since`` on the first run.
+    """
+    if after_id is not None:
+        rows = model.objects.filter(id__gt=after_id)
+    else:
+        rows = model.objects.filter(created_at__gt=since)
+    yield from (
+        rows.order_by('id')
+        .values_list('id', 'post_id', 'user_id', 'post__user_id', 'created_at')
+        .iterator(chunk_size=2000)
+    )
+
+
+def refresh(now=None):
+    """Fold engagement since the previous run into the decayed scores."""
+    conn = get_connection()
+    now = now or time.time()
+    last_run = float(conn.get(LAST_RUN_KEY) or now - VELOCITY_HALF_LIFE)
+    since = datetime.fromtimestamp(last_run, tz=timezone.utc)
+    last_ids = conn.hgetall(LAST_IDS_KEY)
+
+    velocity = {}
+    affinity = {}
+    seen = {}
+    for name, (model, weight) in ENGAGEMENT.items():
+        after_id = last_ids.get(name.encode())
+        if after_id is not None:
+            after_id = int(after_id)
+        else:
+            # First run: pick up from the newest row now, even with no engagement.
+            seen[name] = model.objects.aggregate(last=Max('id'))['last'] or 0
+        for row_id, post_id, viewer_id, author_id, created_at in _events(model, after_id, since):
+            seen[name] = max(seen.get(name, 0), row_id)
+            timestamp = created_at.timestamp()
+            velocity[post_id] = velocity.get(post_id, 0) + weight * decay(now - timestamp, VELOCITY_HALF_LIFE)
+            if viewer_id != author_id:
+                scores = affinity.setdefault(viewer_id, {})
+                scores[author_id] = scores.get(author_id, 0) + weight * decay(now - timestamp, AFFINITY_HALF_LIFE)
+
+    updated = dict(zip(affinity, conn.hmget(AFFINITY_UPDATED_KEY, list(affinity)))) if affinity else {}
+
+    pipe = conn.pipeline()
+    pipe.zunionstore(VELOCITY_KEY, {VELOCITY_KEY: decay(now - last_run, VELOCITY_HALF_LIFE)})
+    for post_id, score in velocity.items():
+        pipe.zincrby(VELOCITY_KEY, score, post_id)
+    pipe.zremrangebyscore(VELOCITY_KEY, '-inf', MIN_SCORE)
+
+    for viewer_id, scores in affinity.items():
+        key = affinity_key(viewer_id)
+        previous = updated.get(viewer_id)
+        if previous is not None:
+            pipe.zunionstore(key, {key: decay(now - float(previous), AFFINITY_HALF_LIFE)})
+        for author_id, score in scores.items():
+            pipe.zincrby(key, score, author_id)
+        pipe.expire(key, AFFINITY_TTL)
+        pipe.hset(AFFINITY_UPDATED_KEY, viewer_id, now)
+
+    if seen:
+        pipe.hset(LAST_IDS_KEY, mapping=seen)
+    pipe.set(LAST_RUN_KEY, now)
+    pipe.execute()
+    return len(velocity)
+
+
+def ranked_feed_key(user_id):
+    return f"ranked_feed:{user_id}"
+
+
+def ranked_window_key(user_id, snapshot):
+    return f"ranked_feed:{user_id}:{snapshot}"
+
+
+def _candidates(user_id):
+    post_ids = timeline.get_post_ids(user_id, count=settings.RANKED_FEED_CANDIDATES)
+    if post_ids is None:
+        post_ids = (
+            Post.objects.filter(user__followers__id=user_id)
+            .order_by('-created_at', '-id')
+            .values_list('id', flat=True)[:settings.RANKED_FEED_CANDIDATES]
+        )
+    return Post.objects.filter(id__in=list(post_ids)).values_list('id', 'user_id', 'created_at')
+
+
+def score_posts(user_id, rows, now=None):
+    """Order ``(id, author_id, created_at)`` rows by their ranked score."""
+    if not rows:
+        return []
+    now = now or time.time()
+    post_ids = [post_id for post_id, _, _ in rows]
+    author_ids = list({author_id for _, author_id, _ in rows})
+
+    conn = get_connection()
+    pipe = conn.pipeline(transaction=False)
+    pipe.zmscore(VELOCITY_KEY, post_ids)
+    pipe.zmscore(affinity_key(user_id), author_ids)
+    pipe.hget(AFFINITY_UPDATED_KEY, user_id)
+    velocities, affinities, updated = pipe.execute()
+
+    affinity_decay = decay(now - float(updated), AFFINITY_HALF_LIFE) if updated else 0
+    affinity = {
+        author_id: (score or 0) * affinity_decay
+        for author_id, score in zip(author_ids, affinities)
+    }
+    velocity = dict(zip(post_ids, velocities))
+
+    def score(row):
+        post_id, author_id, created_at = row
+        recency = decay(now - created_at.timestamp(), RECENCY_HALF_LIFE)
+        return (
+            recency
+            * (1 + math.log1p(velocity[post_id] or 0))
+            * (1 + math.log1p(affinity[author_id])),
+            post_id,
+        )
+
+    return [row[0] for row in sorted(rows, key=score, reverse=True)]
+
+
+def ranked_window(user_id, snapshot=None):
+    """
+    Return ``(snapshot, post_ids)``: the ranked window ``snapshot`` while it
+    is cached, otherwise the user's current window, ranked afresh every
+    ``RANKED_FEED_TTL`` seconds.
+    """
+    if snapshot is not None:
+        post_ids = cache.get(ranked_window_key(user_id, snapshot))
+        if post_ids is not None:
+            return snapshot, post_ids
+
+    snapshot = cache.get(ranked_feed_key(user_id))
+    post_ids = cache.get(ranked_window_key(user_id, snapshot)) if snapshot is not None else None
+    if post_ids is None:
+        snapshot = time.time_ns()
+        post_ids = score_posts(user_id, list(_candidates(user_id)))
+        # Kept longer than it is current, for readers still paging through it.
+        cache.set(ranked_window_key(user_id, snapshot), post_ids, settings.RANKED_FEED_SNAPSHOT_TTL)
+        cache.set(ranked_feed_key(user_id), snapshot, settings.RANKED_FEED_TTL)
+    return snapshot, post_ids
+
@@ -0,0 +1,55 @@
+"""
+Full-text caption search.
+
+``Post.search_vector`` holds ``to_tsvector('english', caption)``. A
+``BEFORE INSERT OR UPDATE OF caption`` trigger keeps it current on every
+write path (``save()``, ``update()`` and raw SQL alike), and the
+``post_search_vector_idx`` GIN index answers ``@@`` matches. Results are
+ordered by ``ts_rank`` and then id, which ``RankKeysetPagination`` pages
+through.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+
+from .models import Post
+
+# Must match the configuration used by the trigger in migration 0006.
+SEARCH_CONFIG = 'english'
+
+
+def search_posts(query, queryset=None):
+    """Annotate matching posts with a ``rank``; unordered, for the paginator."""
+    queryset = Post.objects.all() if queryset is None else queryset
+    query = (query or '').strip()
+    if not query:
+        return queryset.none()
+
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+    return (
+        queryset.filter(search_vector=search_query)
+        # ts_rank returns a float4; as a double it round-trips through the
+        # cursor exactly, so the keyset comparison does not skip rows.
+        .annotate(rank=Cast(SearchRank(F('search_vector'), search_query), FloatField()))
+    )
+
+
+def backfill(chunk_size=1000):
+    """Fill ``search_vector`` for rows missing it, returning how many were updated."""
+    updated = 0
+    last_id = 0
+
+    while True:
+        ids = list(
+            Post.objects.filter(pk__gt=last_id, search_vector__isnull=True)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return updated
+        last_id = ids[-1]
+
+        # Each chunk commits on its own, so row locks are held briefly.
+        updated += Post.objects.filter(pk__in=ids, search_vector__isnull=True).update(
+            search_vector=SearchVector('caption', config=SEARCH_CONFIG)
+        )
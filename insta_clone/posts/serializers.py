@@ -1,14 +1,28 @@
+from django.conf import settings
 from django.urls import reverse
 
 from drf_spectacular.utils import extend_schema_field
 
 from rest_framework import serializers
 
-from .models import Post, Comment
+from insta_clone.images import RenditionsField
+
+from users import graph
+
+from . import likes
+from .models import Post, Comment, UploadSession
 
 MB = 1024 * 1024
 
 
+def get_viewer(context):
+    request = context.get('request')
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return None
+    return user
+
+
 class CommentSerializer(serializers.ModelSerializer):
     user = serializers.ReadOnlyField(source='user.username') 
 
@@ -18,23 +32,88 @@ class CommentSerializer(serializers.ModelSerializer):
         read_only_fields = ['user', 'post', 'created_at']
 
 
-class PostSerializer(serializers.ModelSerializer):
+class TrendingTagSerializer(serializers.Serializer):
+    tag = serializers.CharField()
+    uses = serializers.IntegerField()
+
+
+class ViewerFlagsListSerializer(serializers.ListSerializer):
+    """
+    Looks up the viewer's likes and follows for a whole page at once (one
+    ``Like`` query and one follow-graph probe) before rendering the rows.
+    """
+    def to_representation(self, data):
+        posts = list(data.all() if hasattr(data, 'all') else data)
+        viewer = get_viewer(self.context)
+
+        if viewer is not None:
+            self.context['liked_post_ids'] = likes.liked_post_ids(
+                viewer.id, [post.id for post in posts]
+            )
+            self.context['followed_user_ids'] = graph.following_among(
+                viewer.id, {post.user_id for post in posts}
+            )
+        self.context['likes_deltas'] = likes.likes_count_deltas([post.id for post in posts])
+        return super().to_representation(posts)
+
+
+class ViewerFlagsMixin:
+    """
+    ``liked_by_me`` and ``author_followed`` fields for the requesting user,
+    and a ``likes_count`` that includes unflushed write-behind likes.
+    """
+
+    @extend_schema_field(serializers.IntegerField())
+    def get_likes_count(self, obj):
+        deltas = self.context.get('likes_deltas')
+        if deltas is None:
+            deltas = likes.likes_count_deltas([obj.id])
+        return max(obj.likes_count + deltas.get(obj.id, 0), 0)
+
+    @extend_schema_field(serializers.BooleanField(allow_null=True))
+    def get_liked_by_me(self, obj):
+        viewer = get_viewer(self.context)
+        if viewer is None:
+            return None
+
+        liked = self.context.get('liked_post_ids')
+        if liked is None:
+            liked = likes.liked_post_ids(viewer.id, [obj.id])
+        return obj.id in liked
+
+    @extend_schema_field(serializers.BooleanField(allow_null=True))
+    def get_author_followed(self, obj):
+        viewer = get_viewer(self.context)
+        if viewer is None:
+            return None
+
+        followed = self.context.get('followed_user_ids')
+        if followed is None:
+            return graph.is_following(viewer.id, obj.user_id)
+        return obj.user_id in followed
+
+
+class PostSerializer(ViewerFlagsMixin, serializers.ModelSerializer):
     url = serializers.SerializerMethodField()
     user = serializers.ReadOnlyField(source='user.username') 
-    likes_count = serializers.IntegerField(read_only=True)  
+    renditions = RenditionsField()
+    likes_count = serializers.SerializerMethodField()
     comments_count = serializers.IntegerField(read_only=True)
+    liked_by_me = serializers.SerializerMethodField()
+    author_followed = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
-        fields = ['url', 'id', 'user', 'image', 'caption', 
-                  'likes_count', 'comments_count']
+        fields = ['url', 'id', 'user', 'image', 'renditions', 'caption', 
+                  'likes_count', 'comments_count',
+                  'liked_by_me', 'author_followed']
+        list_serializer_class = ViewerFlagsListSerializer
     
     @extend_schema_field(serializers.CharField())
     def get_url(self, obj):
+        url = reverse('post-detail', kwargs={'post_id': obj.id})
         request = self.context.get('request')
-        return request.build_absolute_uri(
-            reverse('post-detail', kwargs={'post_id': obj.id})
-        )
+        return request.build_absolute_uri(url) if request else url
     
     def validate_image(self, value):
         if value.size > 2 * MB: 
@@ -44,13 +123,33 @@ class PostSerializer(serializers.ModelSerializer):
         return value
     
 
-class PostDetailSerializer(serializers.ModelSerializer):
+class PostDetailSerializer(ViewerFlagsMixin, serializers.ModelSerializer):
     user = serializers.ReadOnlyField(source='user.username')
-    likes_count = serializers.IntegerField(read_only=True)
+    renditions = RenditionsField()
+    likes_count = serializers.SerializerMethodField()
     comments_count = serializers.IntegerField(read_only=True)
+    liked_by_me = serializers.SerializerMethodField()
+    author_followed = serializers.SerializerMethodField()
     comments = CommentSerializer(many=True, read_only=True) 
 
     class Meta:
         model = Post
-        fields = ['id', 'user', 'image', 'caption', 
-                  'created_at', 'likes_count', 'comments_count', 'comments']
+        fields = ['id', 'user', 'image', 'renditions', 'caption', 
+                  'created_at', 'likes_count', 'comments_count',
+                  'liked_by_me', 'author_followed', 'comments']
+        list_serializer_class = ViewerFlagsListSerializer
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'size', 'received', 'caption', 'format',
+                  'width', 'height', 'created_at']
+        read_only_fields = ['id', 'received', 'format', 'width', 'height', 'created_at']
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"Size must be between 1 and {settings.UPLOAD_MAX_SIZE} bytes."
+            )
+        return value
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Post
+
+
+@receiver(post_delete, sender=Post)
+def release_post_image(sender, instance, **kwargs):
+    """Drop the post's reference to its (possibly shared) image file."""
+    if instance.image:
+        instance.image.storage.delete(instance.image.name)
@@ -1,7 +1,41 @@
+import os
+import random
+import shutil
+import struct
+import tempfile
+import zlib
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from PIL import Image
+
+from rest_framework.settings import api_settings
+from rest_framework.test import APIRequestFactory
 
-from posts.models import Post, Like, Comment
+from apis.tasks import render_post_image
+
+from posts import (
+    counters, explore, hashtags, like_buffer, likes,
+    ranking, search, timeline, uploads,
+)
+from insta_clone import storage
+
+from posts.models import (
+    Post, Like, Comment, Hashtag, PostHashtag, StoredFile, UploadSession,
+)
+from posts.serializers import PostSerializer, PostDetailSerializer
+from users import graph
 
 User = get_user_model()
 
@@ -76,3 +110,813 @@ class CommentModelTest(TestCase):
         self.post.delete()
         self.assertEqual(Comment.objects.count(), 0)
 
+
+class LikePrimitivesTest(TestCase):
+    def setUp(self):
+        """Set up a user and a post to like."""
+        self.user = User.objects.create_user(
+            username="user1", email="user1@example.com", password="password123"
+        )
+        self.post = Post.objects.create(user=self.user, caption="Post to be liked.")
+
+    def test_toggle_in_one_query(self):
+        """Toggling flips the state and returns the new count in one statement."""
+        with self.assertNumQueries(1):
+            result = likes.toggle(self.user.id, self.post.id)
+        self.assertEqual(result, likes.LikeResult(True, 1, True))
+        self.assertEqual(likes.toggle(self.user.id, self.post.id), likes.LikeResult(False, 0, True))
+        self.assertEqual(Like.objects.count(), 0)
+
+    def test_like_and_unlike_are_idempotent(self):
+        """Repeating like/unlike does not change state or counters."""
+        likes.like(self.user.id, self.post.id)
+        self.assertEqual(likes.like(self.user.id, self.post.id), likes.LikeResult(True, 1, False))
+        likes.unlike(self.user.id, self.post.id)
+        self.assertEqual(likes.unlike(self.user.id, self.post.id), likes.LikeResult(False, 0, False))
+
+    def test_unlike_uncounted_like(self):
+        """A like the counter never saw is removed without going below zero."""
+        Like.objects.create(user=self.user, post=self.post)
+        self.assertEqual(likes.unlike(self.user.id, self.post.id), likes.LikeResult(False, 0, True))
+
+    def test_missing_post(self):
+        """Operations on a missing post return None instead of failing."""
+        self.assertIsNone(likes.toggle(self.user.id, self.post.id + 1000))
+        self.assertIsNone(likes.like(self.user.id, self.post.id + 1000))
+
+
+@override_settings(LIKES_WRITE_BEHIND=True)
+class WriteBehindLikesTest(TestCase):
+    def setUp(self):
+        """Set up users and a post with an empty like buffer."""
+        cache.clear()
+        self.user1 = User.objects.create_user(
+            username="user1", email="user1@example.com", password="password123"
+        )
+        self.user2 = User.objects.create_user(
+            username="user2", email="user2@example.com", password="password123"
+        )
+        self.post = Post.objects.create(user=self.user1, caption="Viral post.")
+
+    def test_taps_are_buffered(self):
+        """Taps are visible to readers before anything is written."""
+        self.assertEqual(likes.toggle(self.user1.id, self.post.id), likes.LikeResult(True, 1, True))
+        self.assertEqual(likes.like(self.user2.id, self.post.id), likes.LikeResult(True, 2, True))
+        self.assertEqual(Like.objects.count(), 0)
+        self.assertEqual(likes.liked_post_ids(self.user1.id, [self.post.id]), {self.post.id})
+        self.assertEqual(likes.likes_count_deltas([self.post.id]), {self.post.id: 2})
+
+    def test_flush(self):
+        """Flushing writes the final state and retires the pending delta."""
+        Like.objects.create(user=self.user2, post=self.post)
+        Post.objects.filter(id=self.post.id).update(likes_count=1)
+        likes.toggle(self.user1.id, self.post.id)
+        likes.toggle(self.user2.id, self.post.id)
+
+        self.assertEqual(like_buffer.flush(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(list(Like.objects.values_list('user_id', flat=True)), [self.user1.id])
+        self.assertEqual(likes.likes_count_deltas([self.post.id]), {})
+        self.assertEqual(likes.liked_post_ids(self.user2.id, [self.post.id]), set())
+
+    def test_flush_between_read_and_record(self):
+        """A database state read before a flush finished is read again."""
+        likes.toggle(self.user1.id, self.post.id)
+        read = like_buffer._database_state
+
+        def flush_after_read(*args):
+            row = read(*args)
+            if like_buffer.get_connection().scard(like_buffer.DIRTY_KEY):
+                like_buffer.flush()
+            return row
+
+        with mock.patch.object(like_buffer, '_database_state', side_effect=flush_after_read):
+            self.assertEqual(likes.toggle(self.user1.id, self.post.id), likes.LikeResult(False, 0, True))
+        like_buffer.flush()
+        self.assertFalse(Like.objects.exists())
+
+    def test_failed_flush_is_retried(self):
+        """A post whose flush fails stays dirty for the next run."""
+        likes.toggle(self.user1.id, self.post.id)
+        with mock.patch.object(like_buffer, 'flush_post', side_effect=DatabaseError), \
+                self.assertLogs('posts.like_buffer', 'ERROR'):
+            self.assertEqual(like_buffer.flush(), 0)
+
+        self.assertEqual(like_buffer.flush(), 1)
+        self.assertEqual(list(Like.objects.values_list('user_id', flat=True)), [self.user1.id])
+
+    def test_missing_post(self):
+        """Taps on a missing post are rejected."""
+        self.assertIsNone(likes.toggle(self.user1.id, self.post.id + 1000))
+
+
+class PostCountersTest(TestCase):
+    def setUp(self):
+        """Set up a post whose stored counters have drifted."""
+        self.user = User.objects.create_user(
+            username="user1", email="user1@example.com", password="password123"
+        )
+        self.post = Post.objects.create(user=self.user, caption="Counted post.")
+        self.other = Post.objects.create(user=self.user, caption="Accurate post.")
+        Like.objects.create(user=self.user, post=self.post)
+        Comment.objects.create(user=self.user, post=self.post, text="First")
+        Comment.objects.create(user=self.user, post=self.post, text="Second")
+
+    def test_increment(self):
+        """Counters are shifted in place by the given delta."""
+        counters.increment(self.post.id, 'likes_count')
+        counters.increment(self.post.id, 'likes_count', 2)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 3)
+
+    def test_decrement_stops_at_zero(self):
+        counters.increment(self.post.id, 'comments_count', -1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+
+    def test_reconcile_repairs_drift(self):
+        """Reconciling recounts only the posts that drifted."""
+        self.assertEqual(counters.reconcile(chunk_size=1), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(self.post.comments_count, 2)
+        self.assertEqual(counters.reconcile(), 0)
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        """Set up a follower, two authors and a cold timeline."""
+        cache.clear()
+        self.reader = User.objects.create_user(
+            username="reader", email="reader@example.com", password="password123"
+        )
+        self.author1 = User.objects.create_user(
+            username="author1", email="author1@example.com", password="password123"
+        )
+        self.author2 = User.objects.create_user(
+            username="author2", email="author2@example.com", password="password123"
+        )
+        self.author1.followers.add(self.reader)
+        self.post1 = Post.objects.create(user=self.author1, caption="first")
+        self.post2 = Post.objects.create(user=self.author2, caption="second")
+
+    def test_cold_timeline(self):
+        """A timeline that was never built reads as cold."""
+        self.assertIsNone(timeline.get_post_ids(self.reader.id))
+
+    def test_rebuild(self):
+        """Rebuilding only includes posts from followed authors."""
+        timeline.rebuild(self.reader.id)
+        self.assertEqual(timeline.get_post_ids(self.reader.id), [self.post1.id])
+
+    def test_rebuild_empty_timeline_is_warm(self):
+        """A user following nobody gets a warm, empty timeline."""
+        timeline.rebuild(self.author2.id)
+        self.assertEqual(timeline.get_post_ids(self.author2.id), [])
+
+    def test_fan_out_skips_cold_timelines(self):
+        """Fan-out does not create partial timelines for cold users."""
+        timeline.fan_out(Post.objects.create(user=self.author1, caption="new"))
+        self.assertIsNone(timeline.get_post_ids(self.reader.id))
+
+    def test_fan_out_orders_newest_first(self):
+        """New posts are pushed to the front of warm timelines."""
+        timeline.rebuild(self.reader.id)
+        post = Post.objects.create(user=self.author1, caption="new")
+        timeline.fan_out(post)
+        self.assertEqual(timeline.get_post_ids(self.reader.id), [post.id, self.post1.id])
+
+    @override_settings(TIMELINE_MAX_LENGTH=2)
+    def test_fan_out_trims_timeline(self):
+        """Timelines are capped at TIMELINE_MAX_LENGTH entries."""
+        timeline.rebuild(self.reader.id)
+        posts = [Post.objects.create(user=self.author1, caption=str(i)) for i in range(3)]
+        for post in posts:
+            timeline.fan_out(post)
+        self.assertEqual(timeline.get_post_ids(self.reader.id), [posts[2].id, posts[1].id])
+
+    def test_follow_and_unfollow(self):
+        """Following merges an author's posts and unfollowing removes them."""
+        timeline.rebuild(self.reader.id)
+        timeline.add_author(self.reader.id, self.author2.id)
+        self.assertEqual(timeline.get_post_ids(self.reader.id), [self.post2.id, self.post1.id])
+
+        timeline.remove_author(self.reader.id, self.author1.id)
+        self.assertEqual(timeline.get_post_ids(self.reader.id), [self.post2.id])
+
+    def test_remove_post(self):
+        """Deleted posts are removed from followers' timelines."""
+        timeline.rebuild(self.reader.id)
+        timeline.remove_post(self.post1.id, self.author1.id)
+        self.assertEqual(timeline.get_post_ids(self.reader.id), [])
+
+
+class RankingTest(TestCase):
+    def setUp(self):
+        """Set up a reader following two authors with one post each."""
+        cache.clear()
+        self.reader = User.objects.create_user(
+            username="reader", email="reader@example.com", password="password123"
+        )
+        self.fan = User.objects.create_user(
+            username="fan", email="fan@example.com", password="password123"
+        )
+        self.author1 = User.objects.create_user(
+            username="author1", email="author1@example.com", password="password123"
+        )
+        self.author2 = User.objects.create_user(
+            username="author2", email="author2@example.com", password="password123"
+        )
+        self.author1.followers.add(self.reader)
+        self.author2.followers.add(self.reader)
+        self.older = Post.objects.create(user=self.author1, caption="older")
+        self.newer = Post.objects.create(user=self.author2, caption="newer")
+
+    def test_unscored_posts_rank_by_recency(self):
+        """Without engagement the ranking falls back to newest first."""
+        self.assertEqual(ranking.ranked_window(self.reader.id)[1], [self.newer.id, self.older.id])
+
+    def test_velocity_boosts_post(self):
+        """Recent likes and comments lift a post above newer ones."""
+        Like.objects.create(user=self.fan, post=self.older)
+        Comment.objects.create(user=self.fan, post=self.older, text="nice")
+        self.assertEqual(ranking.refresh(), 1)
+        self.assertEqual(ranking.ranked_window(self.reader.id)[1], [self.older.id, self.newer.id])
+
+    def test_affinity_boosts_author(self):
+        """Authors the reader engages with rank higher for that reader only."""
+        Like.objects.create(user=self.reader, post=self.older)
+        ranking.refresh()
+        # The like's velocity is shared with every viewer, so neutralise it.
+        ranking.get_connection().delete(ranking.VELOCITY_KEY)
+
+        rows = list(ranking._candidates(self.reader.id))
+        self.assertEqual(ranking.score_posts(self.reader.id, rows), [self.older.id, self.newer.id])
+        self.assertEqual(ranking.score_posts(self.fan.id, rows), [self.newer.id, self.older.id])
+
+    def test_refresh_is_incremental(self):
+        """Each run only folds in engagement since the previous one."""
+        Like.objects.create(user=self.fan, post=self.older)
+        ranking.refresh()
+        self.assertEqual(ranking.refresh(), 0)
+
+    def test_velocity_decays(self):
+        """Scores halve every VELOCITY_HALF_LIFE seconds."""
+        Like.objects.create(user=self.fan, post=self.older)
+        now = ranking.time.time()
+        ranking.refresh(now)
+        before = ranking.get_connection().zscore(ranking.VELOCITY_KEY, self.older.id)
+        ranking.refresh(now + ranking.VELOCITY_HALF_LIFE)
+        after = ranking.get_connection().zscore(ranking.VELOCITY_KEY, self.older.id)
+        self.assertAlmostEqual(after, before / 2)
+
+    def test_late_commit_is_folded_in(self):
+        """Engagement stamped before the previous run is still counted once."""
+        ranking.refresh()
+        like = Like.objects.create(user=self.fan, post=self.older)
+        Like.objects.filter(pk=like.pk).update(created_at=like.created_at - timedelta(minutes=5))
+        self.assertEqual(ranking.refresh(), 1)
+        self.assertEqual(ranking.refresh(), 0)
+
+    def test_ranked_window_is_cached(self):
+        """Later requests within RANKED_FEED_TTL reuse the ranked window."""
+        ranking.ranked_window(self.reader.id)[1]
+        Post.objects.create(user=self.author1, caption="newest")
+        self.assertEqual(ranking.ranked_window(self.reader.id)[1], [self.newer.id, self.older.id])
+
+    def test_snapshot_outlives_current_window(self):
+        """A snapshot keeps its ordering after the current window is re-ranked."""
+        snapshot, post_ids = ranking.ranked_window(self.reader.id)
+        newest = Post.objects.create(user=self.author1, caption="newest")
+        cache.delete(ranking.ranked_feed_key(self.reader.id))
+
+        current, current_ids = ranking.ranked_window(self.reader.id)
+        self.assertNotEqual(current, snapshot)
+        self.assertEqual(current_ids[0], newest.id)
+        self.assertEqual(ranking.ranked_window(self.reader.id, snapshot), (snapshot, post_ids))
+
+
+class ExploreTest(TestCase):
+    def setUp(self):
+        """Set up an author with three posts and a fan who engages with two."""
+        cache.clear()
+        self.author = User.objects.create_user(
+            username="author", email="author@example.com", password="password123"
+        )
+        self.fan = User.objects.create_user(
+            username="fan", email="fan@example.com", password="password123"
+        )
+        self.quiet, self.liked, self.hot = [
+            Post.objects.create(user=self.author, caption=str(i)) for i in range(3)
+        ]
+        Like.objects.create(user=self.fan, post=self.liked)
+        Like.objects.create(user=self.fan, post=self.hot)
+        Comment.objects.create(user=self.fan, post=self.hot, text="wow")
+        ranking.refresh()
+
+    def test_trending_post_ids(self):
+        """Only engaged posts trend, hottest first."""
+        self.assertEqual(explore.trending_post_ids(), [self.hot.id, self.liked.id])
+
+    @override_settings(EXPLORE_MAX_AGE=60)
+    def test_old_posts_do_not_trend(self):
+        """Posts older than EXPLORE_MAX_AGE are left out."""
+        Post.objects.filter(id=self.hot.id).update(created_at=self.hot.created_at - timedelta(hours=1))
+        self.assertEqual(explore.trending_post_ids(), [self.liked.id])
+
+    def test_render_publishes_pages(self):
+        """Pages are rendered once and served from the cache afterwards."""
+        explore.render()
+        with CaptureQueriesContext(connection) as queries:
+            rows, next_position = explore.get_page()
+        self.assertEqual(len(queries), 0)
+        self.assertEqual([row['id'] for row in rows], [self.hot.id, self.liked.id])
+        self.assertIsNone(next_position)
+        self.assertIsNone(rows[0]['liked_by_me'])
+
+    def test_cold_cache_renders(self):
+        """The first reader renders the pages when nothing is published."""
+        rows, _ = explore.get_page()
+        self.assertEqual(len(rows), 2)
+        self.assertIsNotNone(cache.get(explore.VERSION_KEY))
+
+    def test_cold_cache_renders_once(self):
+        """While one reader renders, the others get an empty page instead of rendering too."""
+        cache.add(explore.RENDER_LOCK_KEY, 1)
+        with mock.patch.object(explore, 'render') as render:
+            self.assertEqual(explore.get_page(), ([], None))
+        render.assert_not_called()
+
+        cache.delete(explore.RENDER_LOCK_KEY)
+        self.assertEqual(len(explore.get_page()[0]), 2)
+        self.assertIsNone(cache.get(explore.RENDER_LOCK_KEY))
+
+    def test_page_past_the_end(self):
+        """Pages past the end are empty."""
+        version, _ = explore.render()
+        self.assertEqual(explore.get_page((version, 5)), ([], None))
+
+    @mock.patch.object(api_settings, 'PAGE_SIZE', 1)
+    def test_pages_stay_on_their_version(self):
+        """A reader finishes the version it started on, or starts over once it expired."""
+        version, _ = explore.render()
+        first, next_position = explore.get_page()
+        self.assertEqual((first[0]['id'], next_position), (self.hot.id, (version, 1)))
+
+        for index in range(3):
+            fan = User.objects.create_user(username=f"fan{index}", email=f"fan{index}@example.com")
+            Like.objects.create(user=fan, post=self.quiet)
+        ranking.refresh()
+        explore.render()
+        self.assertEqual(explore.get_page(next_position)[0][0]['id'], self.liked.id)
+
+        cache.delete_many([explore.page_key(version, 0), explore.page_key(version, 1)])
+        rows, _ = explore.get_page(next_position)
+        self.assertEqual(rows[0]['id'], self.quiet.id)
+
+
+class CaptionSearchTest(TestCase):
+    def setUp(self):
+        """Create posts with overlapping captions."""
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password123"
+        )
+        self.sunset = Post.objects.create(user=self.user, caption="Sunset at the beach")
+        self.beach = Post.objects.create(user=self.user, caption="Beach day, beach vibes, beaches")
+        self.city = Post.objects.create(user=self.user, caption="City lights")
+
+    def test_vector_maintained_on_write(self):
+        """The trigger fills the vector on insert and refreshes it on update."""
+        self.assertEqual(list(search.search_posts("sunsets")), [self.sunset])
+
+        self.city.caption = "City sunset"
+        self.city.save()
+        self.assertEqual({post.id for post in search.search_posts("sunset")}, {self.sunset.id, self.city.id})
+
+    def test_ranked(self):
+        """Posts matching the terms more often rank higher."""
+        posts = search.search_posts("beach").order_by('-rank', '-id')
+        self.assertEqual([post.id for post in posts], [self.beach.id, self.sunset.id])
+
+    def test_websearch_syntax(self):
+        """Exclusions and blank queries are handled."""
+        self.assertEqual(list(search.search_posts("beach -sunset")), [self.beach])
+        self.assertEqual(list(search.search_posts("  ")), [])
+
+    def test_backfill(self):
+        """The backfill fills vectors missing from older rows."""
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute("ALTER TABLE posts_post DISABLE TRIGGER post_search_vector_update")
+            cursor.execute("UPDATE posts_post SET search_vector = NULL")
+            cursor.execute("ALTER TABLE posts_post ENABLE TRIGGER post_search_vector_update")
+        self.assertEqual(list(search.search_posts("city")), [])
+
+        self.assertEqual(search.backfill(chunk_size=2), 3)
+        self.assertEqual(list(search.search_posts("city")), [self.city])
+        self.assertEqual(search.backfill(), 0)
+
+
+class HashtagTest(TestCase):
+    def setUp(self):
+        """Create a user and clear the trending counters."""
+        cache.clear()
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password123"
+        )
+
+    def test_extract(self):
+        """Tags are lowercased and deduplicated; emails and ## are ignored."""
+        self.assertEqual(
+            hashtags.extract("#Sun and #sun, #beach_day! mail@x.com ##no #été"),
+            ["sun", "beach_day", "été"]
+        )
+
+    def test_index_posts(self):
+        """Posts are linked to shared Hashtag rows in bulk."""
+        first = Post.objects.create(user=self.user, caption="#sun #sea")
+        second = Post.objects.create(user=self.user, caption="#sun")
+        with CaptureQueriesContext(connection) as queries:
+            hashtags.index_posts([first, second])
+        hashtags.index_posts([first])
+
+        statements = [q['sql'] for q in queries if not q['sql'].startswith('EXPLAIN')]
+        self.assertEqual(len(statements), 3)
+
+        self.assertEqual(Hashtag.objects.count(), 2)
+        self.assertEqual(PostHashtag.objects.filter(hashtag__name="sun").count(), 2)
+
+    def test_reindex(self):
+        """Existing posts are indexed in chunks."""
+        for i in range(3):
+            Post.objects.create(user=self.user, caption=f"#tag{i} #all")
+        self.assertEqual(hashtags.reindex(chunk_size=2), 3)
+        self.assertEqual(PostHashtag.objects.filter(hashtag__name="all").count(), 3)
+
+    def test_trending_sliding_window(self):
+        """Only uses within TRENDING_TAGS_WINDOW minutes count."""
+        now = 1_000_000 * 60
+        window = settings.TRENDING_TAGS_WINDOW
+        hashtags.record(["old"] * 1, now - window * 60)
+        hashtags.record(["sun", "sea"], now - 60)
+        hashtags.record(["sun"], now)
+
+        self.assertEqual(hashtags.trending(now=now), [("sun", 2), ("sea", 1)])
+        self.assertEqual(hashtags.trending(limit=1, now=now), [("sun", 2)])
+
+
+class ImageRenditionTest(TestCase):
+    def setUp(self):
+        """Store a rotated 2000x1000 JPEG with EXIF in a temporary MEDIA_ROOT."""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise
+        exif[0x010F] = "CameraMaker"
+        buffer = BytesIO()
+        Image.new('RGB', (2000, 1000), (200, 30, 30)).save(buffer, 'JPEG', exif=exif)
+
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password123"
+        )
+        self.post = Post.objects.create(user=self.user, caption="photo")
+        self.post.image.save('photo.jpg', ContentFile(buffer.getvalue()))
+
+    def test_render(self):
+        """Renditions are oriented, resized, EXIF-free and recorded on the post."""
+        render_post_image(self.post.id, self.post.image.name)
+        renditions = Post.objects.get(id=self.post.id).renditions
+
+        self.assertEqual((renditions['width'], renditions['height']), (1000, 2000))
+        self.assertTrue(renditions['placeholder'].startswith('data:image/webp;base64,'))
+        self.assertEqual(set(renditions['sizes']), set(settings.IMAGE_RENDITION_SIZES))
+
+        feed = renditions['sizes']['feed']
+        self.assertEqual((feed['width'], feed['height']), (320, 640))
+        for fmt, pil_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+            with default_storage.open(feed[fmt]) as stored:
+                image = Image.open(stored)
+                self.assertEqual(image.format, pil_format)
+                self.assertEqual(image.size, (320, 640))
+                self.assertEqual(len(image.getexif()), 0)
+
+    def test_original_is_stripped(self):
+        """The stored original keeps its pixels and orientation but no other metadata."""
+        with self.post.image.open('rb') as stored:
+            image = Image.open(stored)
+            self.assertEqual(image.size, (2000, 1000))
+            self.assertEqual(dict(image.getexif()), {0x0112: 6})
+
+        exif = Image.Exif()
+        exif.get_ifd(0x8825)[2] = (52.0, 31.0, 0.0)  # GPS latitude
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10)).save(buffer, 'PNG', exif=exif, icc_profile=b'profile')
+        self.post.image.save('located.png', ContentFile(buffer.getvalue()))
+        with self.post.image.open('rb') as stored:
+            image = Image.open(stored)
+            self.assertEqual(len(image.getexif()), 0)
+            self.assertNotIn('icc_profile', image.info)
+
+    def test_serialized_urls(self):
+        """Serializers return URLs instead of storage names."""
+        render_post_image(self.post.id, self.post.image.name)
+        request = APIRequestFactory().get('/')
+        request.user = self.user
+        post = Post.objects.get(id=self.post.id)
+
+        data = PostSerializer(post, context={'request': request}).data
+        self.assertTrue(data['renditions']['sizes']['thumbnail']['webp'].startswith('http://testserver/media/'))
+        bare = Post.objects.create(user=self.user, caption="no image")
+        self.assertIsNone(PostSerializer(bare).data['renditions'])
+
+    def test_stale_task_is_skipped(self):
+        """A task queued for a replaced image does nothing."""
+        render_post_image(self.post.id, 'posts/other.jpg')
+        self.assertEqual(Post.objects.get(id=self.post.id).renditions, {})
+
+
+def pattern_jpeg(size=(64, 64), seed=0, brightness=0):
+    """A JPEG of 8x8 blocks with shades drawn from ``seed``."""
+    shades = random.Random(seed).choices(range(0, 200), k=64)
+    image = Image.frombytes('L', (8, 8), bytes(shades)).resize(size, Image.Resampling.NEAREST)
+    image = image.point(lambda value: value + brightness).convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        """Use a temporary MEDIA_ROOT."""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password123"
+        )
+
+    def post_with(self, data, name='photo.jpg'):
+        post = Post.objects.create(user=self.user, caption="photo")
+        post.image.save(name, ContentFile(data))
+        return post
+
+    def test_identical_uploads_share_a_file(self):
+        """Reposted bytes get the same sha256 name and one reference each."""
+        data = pattern_jpeg()
+        first = self.post_with(data, 'a.JPG')
+        second = self.post_with(data, 'b.jpg')
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^posts/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(len(os.listdir(os.path.join(settings.MEDIA_ROOT, 'posts'))), 1)
+        self.assertEqual(StoredFile.objects.get(name=first.image.name).refcount, 2)
+
+    def test_file_removed_after_last_reference(self):
+        """Deleting posts releases references; the last one removes the file."""
+        data = pattern_jpeg()
+        first = self.post_with(data)
+        second = self.post_with(data)
+        name = first.image.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(storage.media_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(storage.media_storage.exists(name))
+        self.assertFalse(StoredFile.objects.exists())
+
+    def test_reupload_after_release(self):
+        """Content released but not yet collected is reused and kept."""
+        data = pattern_jpeg()
+        first = self.post_with(data)
+        name = first.image.name
+        first.delete()  # collection waits for a commit that never comes
+        second = self.post_with(data)
+
+        self.assertEqual(second.image.name, name)
+        self.assertFalse(storage.media_storage.collect(name))
+        self.assertTrue(storage.media_storage.exists(name))
+
+    def test_renditions_are_shared(self):
+        """A repost reuses the renditions rendered for the first post."""
+        data = pattern_jpeg()
+        first = self.post_with(data)
+        second = self.post_with(data)
+
+        render_post_image(first.id, first.image.name)
+        render_post_image(second.id, second.image.name)
+        renditions = Post.objects.get(id=first.id).renditions
+        self.assertEqual(Post.objects.get(id=second.id).renditions, renditions)
+        rendered = os.listdir(os.path.join(settings.MEDIA_ROOT, 'renditions', 'posts'))
+        self.assertEqual(len(rendered), len(settings.IMAGE_RENDITION_SIZES) * 2)
+
+    def test_near_duplicates(self):
+        """Re-encoded, brightened copies are found; unrelated images are not."""
+        original = self.post_with(pattern_jpeg((64, 64)))
+        resized = self.post_with(pattern_jpeg((128, 128), brightness=10))
+        unrelated = self.post_with(pattern_jpeg((64, 64), seed=1))
+        # Hashes are recorded by the render task, not while saving.
+        self.assertIsNone(StoredFile.objects.get(name=original.image.name).dhash)
+        for post in (original, resized, unrelated):
+            render_post_image(post.id, post.image.name)
+
+        matches = storage.near_duplicates(original.image.name)
+        self.assertEqual([match.name for match, _ in matches], [resized.image.name])
+        self.assertLessEqual(matches[0][1], settings.MEDIA_NEAR_DUPLICATE_DISTANCE)
+
+    def test_dhash_bands(self):
+        """Hashes within distance 3 always share a band."""
+        value = 0x0123456789ABCDEF
+        close = value ^ (1 << 3) ^ (1 << 20) ^ (1 << 40)
+        self.assertEqual(storage.distance(storage.to_signed(value), storage.to_signed(close)), 3)
+        self.assertTrue(set(storage.bands(value)) & set(storage.bands(close)))
+        self.assertEqual(storage.to_unsigned(storage.to_signed(2 ** 64 - 1)), 2 ** 64 - 1)
+
+
+def png_bytes(width=40, height=20):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), (0, 128, 255)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def png_header(width, height):
+    """A PNG signature and IHDR chunk claiming the given dimensions."""
+    ihdr = b'IHDR' + struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + ihdr + struct.pack('>I', zlib.crc32(ihdr))
+
+
+class UploadTest(TestCase):
+    def setUp(self):
+        """Use a temporary MEDIA_ROOT for partial files."""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(
+            username="user", email="user@example.com", password="password123"
+        )
+
+    def start(self, data):
+        return UploadSession.objects.create(user=self.user, size=len(data))
+
+    def write(self, session, data, start, end=None):
+        end = len(data) - 1 if end is None else end
+        return uploads.write_range(
+            session.id, self.user, f"bytes {start}-{end}/{len(data)}", BytesIO(data[start:end + 1])
+        )
+
+    def test_parse_content_range(self):
+        """Malformed or out-of-bounds ranges are rejected."""
+        self.assertEqual(uploads.parse_content_range("bytes 0-9/10"), (0, 9, 10))
+        for header in [None, "bytes 0-10/10", "bytes 5-4/10", "items 0-1/2", "bytes a-b/c"]:
+            with self.assertRaises(uploads.UploadError):
+                uploads.parse_content_range(header)
+
+    def test_resume_after_short_range(self):
+        """Bytes that arrived before a dropped connection are kept."""
+        data = png_bytes()
+        session = self.start(data)
+        session = uploads.write_range(
+            session.id, self.user, f"bytes 0-{len(data) - 1}/{len(data)}", BytesIO(data[:30])
+        )
+        self.assertEqual(session.received, 30)
+        self.assertEqual((session.format, session.width, session.height), ('png', 40, 20))
+
+        with self.assertRaises(uploads.OffsetMismatch):
+            self.write(session, data, 10)
+        self.write(session, data, 30)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post = uploads.finalize(UploadSession.objects.get(id=session.id))
+        with post.image.open('rb') as stored:
+            self.assertEqual(stored.read(), data)
+        self.assertFalse(default_storage.exists(uploads.partial_name(session)))
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_concurrent_range_is_refused(self):
+        """A range being written keeps others out until it ends or goes stale."""
+        data = png_bytes()
+        session = self.start(data)
+
+        class Racing(BytesIO):
+            def read(stream, size=-1):
+                with self.assertRaises(uploads.RangeInProgress):
+                    self.write(session, data, 0)
+                return super().read(size)
+
+        uploads.write_range(session.id, self.user, f"bytes 0-{len(data) - 1}/{len(data)}", Racing(data))
+        self.assertEqual(UploadSession.objects.get(id=session.id).received, len(data))
+        self.assertIsNone(UploadSession.objects.get(id=session.id).writing_since)
+
+    def test_stale_claim_is_taken_over(self):
+        data = png_bytes()
+        session = self.start(data)
+        UploadSession.objects.filter(id=session.id).update(
+            writing_since=timezone.now() - timedelta(seconds=settings.UPLOAD_WRITE_TIMEOUT + 1)
+        )
+        self.assertEqual(self.write(session, data, 0).received, len(data))
+
+    def test_rejects_non_images(self):
+        """Unknown magic bytes discard the session on the first range."""
+        data = b'GIF89a' + b'\0' * 100
+        session = self.start(data)
+        with self.assertRaises(uploads.UploadError):
+            self.write(session, data, 0)
+        self.assertFalse(UploadSession.objects.exists())
+
+    @override_settings(UPLOAD_MAX_PIXELS=1_000_000)
+    def test_rejects_decompression_bomb(self):
+        """Oversized dimensions are rejected from the header alone."""
+        data = png_header(100_000, 100_000) + b'\0' * 1000
+        session = self.start(data)
+        with self.assertRaises(uploads.UploadError):
+            self.write(session, data, 0, 99)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_finalize_incomplete(self):
+        """Sessions can only be finalized once every byte arrived."""
+        data = png_bytes()
+        session = self.write(self.start(data), data, 0, 49)
+        with self.assertRaises(uploads.UploadError):
+            uploads.finalize(session)
+
+    def test_finalize_once(self):
+        """A session already turned into a post cannot be finalized again."""
+        data = png_bytes()
+        session = self.write(self.start(data), data, 0)
+        uploads.finalize(session)
+        with self.assertRaises(uploads.UploadError):
+            uploads.finalize(session)
+        self.assertEqual(Post.objects.count(), 1)
+
+    def test_expire(self):
+        """Stale sessions and their partial files are removed."""
+        data = png_bytes()
+        session = self.write(self.start(data), data, 0, 49)
+        UploadSession.objects.update(created_at=session.created_at - timedelta(days=2))
+        self.assertEqual(uploads.expire(), 1)
+        self.assertFalse(default_storage.exists(uploads.partial_name(session)))
+
+
+class ViewerFlagsTest(TestCase):
+    def setUp(self):
+        """Set up a viewer, two authors and a page of posts."""
+        cache.clear()
+        graph._local_following.clear()
+        self.viewer = User.objects.create_user(
+            username="viewer", email="viewer@example.com", password="password123"
+        )
+        self.author1 = User.objects.create_user(
+            username="author1", email="author1@example.com", password="password123"
+        )
+        self.author2 = User.objects.create_user(
+            username="author2", email="author2@example.com", password="password123"
+        )
+        self.author1.followers.add(self.viewer)
+        self.posts = [
+            Post.objects.create(user=author, caption=str(i))
+            for i, author in enumerate([self.author1, self.author2] * 5)
+        ]
+        Like.objects.create(user=self.viewer, post=self.posts[0])
+
+        self.request = APIRequestFactory().get('/')
+        self.request.user = self.viewer
+
+    def test_flags(self):
+        """Each row reports the viewer's like and follow state."""
+        data = PostSerializer(self.posts[:2], many=True, context={'request': self.request}).data
+        self.assertEqual(
+            [(row['liked_by_me'], row['author_followed']) for row in data],
+            [(True, True), (False, False)]
+        )
+
+    def test_constant_query_count(self):
+        """A page costs one Like query however many posts it holds."""
+        posts = list(Post.objects.select_related('user').filter(id__in=[p.id for p in self.posts]))
+        graph.following_ids(self.viewer.id)
+        with CaptureQueriesContext(connection) as queries:
+            PostSerializer(posts, many=True, context={'request': self.request}).data
+        # django-silk may add EXPLAIN statements for the queries it profiles.
+        statements = [q['sql'] for q in queries if not q['sql'].startswith('EXPLAIN')]
+        self.assertEqual(len(statements), 1)
+
+    def test_detail_flags(self):
+        """The detail serializer answers for a single post."""
+        data = PostDetailSerializer(self.posts[0], context={'request': self.request}).data
+        self.assertTrue(data['liked_by_me'])
+        self.assertTrue(data['author_followed'])
+
+    def test_anonymous_flags(self):
+        """Without a viewer the flags are null."""
+        data = PostDetailSerializer(self.posts[0]).data
+        self.assertIsNone(data['liked_by_me'])
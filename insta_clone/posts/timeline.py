@@ -0,0 +1,183 @@
+"""
+Materialized home timelines (fan-out on write).
+
+Each user's home feed is kept in a Redis sorted set of post ids scored by
+the post's creation time. A sentinel member with score 0 marks a timeline
+as warm, so an empty feed can be told apart from one that was never built.
+Reads fall back to the database when a timeline is cold.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from django_redis import get_redis_connection
+
+from .models import Post
+
+User = get_user_model()
+
+SENTINEL = '0'
+FAN_OUT_BATCH_SIZE = 1000
+
+# Posts sharing the exact same microsecond are ordered by id in Python, so
+# reads fetch a few extra rows to cover ties at the page boundary.
+TIE_SLACK = 16
+
+# Adds a post to every timeline in KEYS that already exists, then trims it.
+_FAN_OUT_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('ZADD', key, ARGV[1], ARGV[2])
+        redis.call('ZREMRANGEBYRANK', key, 1, -(tonumber(ARGV[3]) + 1))
+    end
+end
+return 1
+"""
+
+
+def get_connection():
+    return get_redis_connection('default')
+
+
+def timeline_key(user_id):
+    return f"timeline:{user_id}"
+
+
+def post_score(created_at):
+    """Microsecond timestamps are exact in a Redis double."""
+    return int(created_at.timestamp() * 1_000_000)
+
+
+def follower_ids(user_id):
+    """Ids of the users following ``user_id``."""
+    return User.followers.through.objects.filter(
+        from_user_id=user_id
+    ).values_list('to_user_id', flat=True)
+
+
+def is_warm(user_id):
+    return bool(get_connection().exists(timeline_key(user_id)))
+
+
+def rebuild(user_id):
+    """Rebuild a user's timeline from the database."""
+    rows = (
+        Post.objects.filter(user__followers__id=user_id)
+        .order_by('-created_at', '-id')
+        .values_list('id', 'created_at')[:settings.TIMELINE_MAX_LENGTH]
+    )
+    mapping = {SENTINEL: 0}
+    mapping.update({str(post_id): post_score(created_at) for post_id, created_at in rows})
+
+    key = timeline_key(user_id)
+    pipe = get_connection().pipeline()
+    pipe.delete(key)
+    pipe.zadd(key, mapping)
+    pipe.execute()
+    return len(mapping) - 1
+
+
+def fan_out(post):
+    """Push a new post into the warm timelines of its author's followers."""
+    script = get_connection().register_script(_FAN_OUT_SCRIPT)
+    args = [post_score(post.created_at), post.id, settings.TIMELINE_MAX_LENGTH]
+
+    batch = []
+    for user_id in follower_ids(post.user_id).iterator(chunk_size=FAN_OUT_BATCH_SIZE):
+        batch.append(timeline_key(user_id))
+        if len(batch) >= FAN_OUT_BATCH_SIZE:
+            script(keys=batch, args=args)
+            batch = []
+    if batch:
+        script(keys=batch, args=args)
+
+
+def remove_post(post_id, author_id):
+    """Drop a deleted post from its author's followers' timelines."""
+    conn = get_connection()
+    batch = []
+    for user_id in follower_ids(author_id).iterator(chunk_size=FAN_OUT_BATCH_SIZE):
+        batch.append(user_id)
+        if len(batch) >= FAN_OUT_BATCH_SIZE:
+            _zrem_many(conn, batch, [post_id])
+            batch = []
+    if batch:
+        _zrem_many(conn, batch, [post_id])
+
+
+def add_author(user_id, author_id):
+    """Merge an author's recent posts into a user's timeline after a follow."""
+    if not is_warm(user_id):
+        return
+
+    rows = (
+        Post.objects.filter(user_id=author_id)
+        .order_by('-created_at', '-id')
+        .values_list('id', 'created_at')[:settings.TIMELINE_MAX_LENGTH]
+    )
+    mapping = {str(post_id): post_score(created_at) for post_id, created_at in rows}
+    if not mapping:
+        return
+
+    key = timeline_key(user_id)
+    pipe = get_connection().pipeline()
+    pipe.zadd(key, mapping)
+    pipe.zremrangebyrank(key, 1, -(settings.TIMELINE_MAX_LENGTH + 1))
+    pipe.execute()
+
+
+def remove_author(user_id, author_id):
+    """Remove an author's posts from a user's timeline after an unfollow."""
+    if not is_warm(user_id):
+        return
+
+    post_ids = list(
+        Post.objects.filter(user_id=author_id)
+        .order_by('-created_at', '-id')
+        .values_list('id', flat=True)[:settings.TIMELINE_MAX_LENGTH]
+    )
+    if post_ids:
+        _zrem_many(get_connection(), [user_id], post_ids)
+
+
+def _zrem_many(conn, user_ids, post_ids):
+    members = [str(post_id) for post_id in post_ids]
+    pipe = conn.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.zrem(timeline_key(user_id), *members)
+    pipe.execute()
+
+
+def get_post_ids(user_id, before=None, count=None):
+    """
+    Return up to ``count`` post ids from a user's timeline, newest first.
+
+    ``before`` is an optional ``(created_at, id)`` keyset position; only
+    posts strictly older than it are returned. Returns ``None`` when the
+    timeline is cold so callers can fall back to the database.
+    """
+    count = count or settings.TIMELINE_MAX_LENGTH
+    key = timeline_key(user_id)
+    max_score = '+inf' if before is None else post_score(before[0])
+
+    pipe = get_connection().pipeline()
+    pipe.exists(key)
+    pipe.zrevrangebyscore(key, max_score, '(0', start=0, num=count + TIE_SLACK, withscores=True)
+    exists, rows = pipe.execute()
+    if not exists:
+        return None
+
+    entries = sorted(
+        ((int(score), int(member)) for member, score in rows),
+        reverse=True,
+    )
+    if before is not None:
+        entries = [entry for entry in entries if entry < (max_score, before[1])]
+    return [post_id for _, post_id in entries[:count]]
+
+
+def hydrate(post_ids, queryset=None):
+    """Load posts for ``post_ids`` in one query, preserving timeline order."""
+    if queryset is None:
+        queryset = Post.objects.select_related('user')
+    posts = queryset.in_bulk(post_ids)
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
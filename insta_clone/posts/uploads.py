@@ -0,0 +1,284 @@
+"""
+Resumable image uploads.
+
+A client creates an ``UploadSession`` with the total size, PUTs byte ranges
+(``Content-Range: bytes <start>-<end>/<size>``) in order, and finalizes the
+session into a ``Post``. Each range is copied from the request stream to a
+partial file in ``UPLOAD_CHUNK_READ_SIZE`` pieces, so memory stays flat
+however large the upload. A dropped range keeps the bytes that arrived and
+the client resumes from ``received``.
+
+A range is written under a claim (``writing_since``) taken with one
+conditional UPDATE, not under a row lock: the body is read from the
+network outside any transaction, so a slow client holds no database
+connection or lock. A claim older than ``UPLOAD_WRITE_TIMEOUT`` is assumed
+to belong to a dead request and may be taken over.
+
+The leading bytes are checked as soon as they arrive: the magic number must
+be JPEG or PNG and the header's pixel dimensions must fit
+``UPLOAD_MAX_PIXELS``, so an oversized or decompression-bomb image is
+rejected before the rest of it is accepted. Finalizing moves the partial
+file into place instead of copying it.
+
+Partial files are written in place, which needs a storage backed by the
+local filesystem (``FileSystemStorage``).
+"""
+import os
+import struct
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from PIL import Image
+
+from .models import Post, UploadSession
+
+MAGIC_NUMBERS = {
+    'jpeg': b'\xff\xd8\xff',
+    'png': b'\x89PNG\r\n\x1a\n',
+}
+
+EXTENSIONS = {'jpeg': 'jpg', 'png': 'png'}
+
+# Image headers (including EXIF blocks) are expected within this many bytes.
+HEADER_LIMIT = 256 * 1024
+
+# JPEG start-of-frame markers (SOF0-SOF15 without DHT, JPG and DAC).
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+STANDALONE_MARKERS = set(range(0xD0, 0xDA)) | {0x01}
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    """The range does not start where the session left off."""
+
+    def __init__(self, received):
+        super().__init__(f"Expected a range starting at {received}.")
+        self.received = received
+
+
+class RangeInProgress(OffsetMismatch):
+    """Another range of the session is being written."""
+
+    def __init__(self, received):
+        UploadError.__init__(self, "Another range is being written.")
+        self.received = received
+
+
+class _PartialFile(File):
+    # ``FileSystemStorage`` moves files that report a temporary path
+    # instead of copying their contents.
+    def temporary_file_path(self):
+        return self.name
+
+
+def partial_name(session):
+    return f"uploads/partial/{session.id}.part"
+
+
+def partial_path(session):
+    return default_storage.path(partial_name(session))
+
+
+def parse_content_range(header):
+    """Parse ``bytes <start>-<end>/<total>`` into integers."""
+    try:
+        unit, spec = (header or '').split(' ', 1)
+        span, total = spec.split('/', 1)
+        start, end = span.split('-', 1)
+        start, end, total = int(start), int(end), int(total)
+    except ValueError:
+        raise UploadError("Content-Range must be 'bytes <start>-<end>/<size>'.")
+    if unit != 'bytes' or not 0 <= start <= end < total:
+        raise UploadError("Content-Range must be 'bytes <start>-<end>/<size>'.")
+    return start, end, total
+
+
+def _detect_format(head):
+    for fmt, magic in MAGIC_NUMBERS.items():
+        if head.startswith(magic[:len(head)]):
+            return fmt if len(head) >= len(magic) else ''
+    raise UploadError("Only JPEG and PNG images are accepted.")
+
+
+def _png_size(head):
+    # The IHDR chunk must come first, at a fixed offset.
+    if len(head) < 24:
+        return None
+    if head[12:16] != b'IHDR':
+        raise UploadError("Could not read the image header.")
+    return struct.unpack('>II', head[16:24])
+
+
+def _jpeg_size(head):
+    # Walk the marker segments up to the first start-of-frame.
+    offset = 2
+    while offset + 4 <= len(head):
+        if head[offset] != 0xFF:
+            raise UploadError("Could not read the image header.")
+        marker = head[offset + 1]
+        if marker in SOF_MARKERS:
+            if offset + 9 > len(head):
+                return None
+            height, width = struct.unpack('>HH', head[offset + 5:offset + 9])
+            return width, height
+        if marker == 0xFF:
+            offset += 1
+        elif marker in STANDALONE_MARKERS:
+            offset += 2
+        else:
+            offset += 2 + struct.unpack('>H', head[offset + 2:offset + 4])[0]
+    return None
+
+
+def _inspect(session, path):
+    """Validate the leading bytes once enough of them have arrived."""
+    with open(path, 'rb') as partial:
+        head = partial.read(min(session.received, HEADER_LIMIT))
+
+    fmt = _detect_format(head)
+    size = (_png_size if fmt == 'png' else _jpeg_size)(head) if fmt else None
+    if size is None:
+        # Wait for more bytes, unless the header will never fit.
+        if len(head) < min(session.size, HEADER_LIMIT):
+            return
+        raise UploadError("Could not read the image header.")
+
+    width, height = size
+    if not width or not height:
+        raise UploadError("Could not read the image header.")
+    if width * height > settings.UPLOAD_MAX_PIXELS:
+        raise UploadError("Image has too many pixels.")
+
+    session.format, session.width, session.height = fmt, width, height
+
+
+def write_range(session_id, user, content_range, stream):
+    """
+    Append one byte range read from ``stream`` to the session.
+
+    Returns the updated session. Raises ``OffsetMismatch`` if the range does
+    not start at ``received`` and ``UploadError`` if the data is rejected, in
+    which case the session is discarded.
+    """
+    start, end, total = parse_content_range(content_range)
+    length = end - start + 1
+    if length > settings.UPLOAD_MAX_CHUNK_SIZE:
+        raise UploadError(f"Ranges may not exceed {settings.UPLOAD_MAX_CHUNK_SIZE} bytes.")
+
+    claimed_at = timezone.now()
+    stale = claimed_at - timedelta(seconds=settings.UPLOAD_WRITE_TIMEOUT)
+    claimed = (
+        UploadSession.objects.filter(id=session_id, user=user, size=total, received=start)
+        .filter(Q(writing_since=None) | Q(writing_since__lt=stale))
+        .update(writing_since=claimed_at)
+    )
+    if not claimed:
+        session = UploadSession.objects.get(id=session_id, user=user)
+        if total != session.size:
+            raise UploadError("Content-Range size does not match the session.")
+        if start != session.received:
+            raise OffsetMismatch(session.received)
+        raise RangeInProgress(session.received)
+
+    session = UploadSession.objects.get(id=session_id)
+    path = partial_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = 0
+    rejected = None
+    try:
+        with open(path, 'r+b' if start else 'wb') as partial:
+            partial.seek(start)
+            try:
+                while written < length:
+                    data = stream.read(min(settings.UPLOAD_CHUNK_READ_SIZE, length - written)) if stream else b''
+                    if not data:
+                        break
+                    partial.write(data)
+                    written += len(data)
+            finally:
+                partial.truncate()
+
+        session.received = start + written
+        if not session.format:
+            _inspect(session, path)
+    except UploadError as error:
+        rejected = error
+    finally:
+        # Keep whatever arrived and release the claim, unless it was taken over.
+        session.received = start + written
+        session.writing_since = None
+        UploadSession.objects.filter(id=session_id, writing_since=claimed_at).update(
+            received=session.received, format=session.format,
+            width=session.width, height=session.height, writing_since=None,
+        )
+
+    if rejected is not None:
+        discard(session)
+        raise rejected
+    return session
+
+
+def finalize(session):
+    """
+    Turn a complete session into a ``Post``, moving the file into place.
+
+    The session row is locked and deleted with the post's creation, so of
+    two concurrent calls the second finds it gone and is refused.
+    """
+    path = partial_path(session)
+    with transaction.atomic():
+        locked = UploadSession.objects.select_for_update().filter(pk=session.pk).first()
+        if locked is None:
+            raise UploadError("Upload was already finalized.")
+        if locked.received != locked.size or not locked.format:
+            raise UploadError("Upload is not complete.")
+
+        try:
+            with Image.open(path) as image:
+                image.verify()
+        except Exception:
+            corrupt = True
+        else:
+            corrupt = False
+            post = Post(user=session.user, caption=locked.caption)
+            with open(path, 'rb') as partial:
+                post.image.save(
+                    f"{session.id}.{EXTENSIONS[locked.format]}",
+                    _PartialFile(partial, name=path),
+                    save=False,
+                )
+            post.save()
+            locked.delete()
+            # Content already in storage is not moved; drop the leftover copy.
+            transaction.on_commit(lambda: default_storage.delete(partial_name(session)))
+
+    if corrupt:
+        discard(session)
+        raise UploadError("Image data is corrupt.")
+    return post
+
+
+def discard(session):
+    """Delete a session and its partial file."""
+    default_storage.delete(partial_name(session))
+    session.delete()
+
+
+def expire(max_age=None):
+    """Discard sessions older than ``max_age`` seconds, returning how many."""
+    max_age = max_age or settings.UPLOAD_SESSION_TTL
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    expired = 0
+    for session in UploadSession.objects.filter(created_at__lt=cutoff).iterator():
+        discard(session)
+        expired += 1
+    return expired
@@ -17,12 +17,4 @@ class CustomUserAdmin(UserAdmin):
         ('Important dates', {'fields': ('last_login', 'date_joined')}),
     )
 
-    def followers_count(self, obj):
-        return obj.followers.count()
-    followers_count.short_description = "Followers"
-
-    def following_count(self, obj):
-        return obj.following.count()
-    following_count.short_description = "Following"
-
 admin.site.register(User, CustomUserAdmin)
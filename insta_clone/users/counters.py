@@ -0,0 +1,71 @@
+"""
+Maintenance of the denormalized ``followers_count``/``following_count``
+columns on ``User``.
+
+The counters are kept in step by the ``m2m_changed`` and ``pre_delete``
+receivers in ``users.signals``; ``recount`` repairs drift from writes
+that bypass them (raw SQL, bulk inserts into the through table).
+"""
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import User
+
+Follow = User.followers.through
+
+
+def adjust(user_ids, field, delta):
+    """
+    Atomically shift ``field`` by ``delta`` for every user in ``user_ids``,
+    stopping at zero.
+    """
+    if not user_ids or not delta:
+        return 0
+    return User.objects.filter(pk__in=user_ids).update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def _count_subquery(column):
+    counts = (
+        Follow.objects.filter(**{column: OuterRef('pk')})
+        .order_by()
+        .values(column)
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def recount(chunk_size=1000):
+    """Recount follows for every user, returning the rows repaired."""
+    repaired = 0
+    last_id = 0
+
+    while True:
+        ids = list(
+            User.objects.filter(pk__gt=last_id)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return repaired
+        last_id = ids[-1]
+
+        with transaction.atomic():
+            drifted = list(
+                User.objects.filter(pk__in=ids)
+                .annotate(
+                    actual_followers=_count_subquery('from_user'),
+                    actual_following=_count_subquery('to_user'),
+                )
+                .exclude(
+                    followers_count=F('actual_followers'),
+                    following_count=F('actual_following'),
+                )
+                .values_list('pk', 'actual_followers', 'actual_following')
+            )
+            for pk, followers, following in drifted:
+                User.objects.filter(pk=pk).update(
+                    followers_count=followers, following_count=following
+                )
+        repaired += len(drifted)
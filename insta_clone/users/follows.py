@@ -0,0 +1,102 @@
+"""
+Race-free follow primitives.
+
+Each operation is a single SQL statement over the ``followers`` through
+table using ``ON CONFLICT DO NOTHING``/``DELETE ... RETURNING`` CTEs. The
+statement also moves both users' denormalized counters, so it bypasses the
+``m2m_changed`` receivers in ``users.signals`` on purpose and mirrors the
+change into the follow graph itself.
+"""
+from collections import namedtuple
+
+from django.db import connection, transaction
+
+from . import graph
+from .models import User
+
+Follow = User.followers.through
+
+FollowResult = namedtuple('FollowResult', ['is_following', 'followers_count', 'changed'])
+
+_NOTHING = "SELECT 1 WHERE FALSE"
+
+_REMOVE = """
+    DELETE FROM {follow}
+    WHERE from_user_id = %(target_id)s AND to_user_id = %(follower_id)s
+    RETURNING 1
+"""
+
+_ADD = """
+    INSERT INTO {follow} (from_user_id, to_user_id)
+    SELECT %(target_id)s, %(follower_id)s
+    WHERE EXISTS (SELECT 1 FROM {user} WHERE id = %(target_id)s) {guard}
+    ON CONFLICT (from_user_id, to_user_id) DO NOTHING
+    RETURNING 1
+"""
+
+_STATEMENT = """
+    WITH removed AS ({removed}), added AS ({added}),
+    delta AS (
+        SELECT (SELECT count(*) FROM added) - (SELECT count(*) FROM removed) AS value
+    ),
+    follower AS (
+        UPDATE {user} SET following_count = GREATEST(following_count + (SELECT value FROM delta), 0)
+        WHERE id = %(follower_id)s
+    )
+    UPDATE {user} SET followers_count = GREATEST(followers_count + (SELECT value FROM delta), 0)
+    WHERE id = %(target_id)s
+    RETURNING {following}, followers_count,
+        EXISTS (SELECT 1 FROM added) OR EXISTS (SELECT 1 FROM removed)
+"""
+
+
+def _build(removed, added, following, guard=''):
+    tables = {'follow': Follow._meta.db_table, 'user': User._meta.db_table}
+    return _STATEMENT.format(
+        removed=removed.format(**tables),
+        added=added.format(guard=guard, **tables),
+        following=following,
+        **tables
+    )
+
+
+TOGGLE_SQL = _build(
+    _REMOVE, _ADD,
+    following="EXISTS (SELECT 1 FROM added) OR NOT EXISTS (SELECT 1 FROM removed)",
+    guard="AND NOT EXISTS (SELECT 1 FROM removed)",
+)
+FOLLOW_SQL = _build(_NOTHING, _ADD, following="TRUE")
+UNFOLLOW_SQL = _build(_REMOVE, _NOTHING, following="FALSE")
+
+
+def _execute(sql, follower_id, target_id):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'follower_id': follower_id, 'target_id': target_id})
+        row = cursor.fetchone()
+    if row is None:
+        return None
+
+    result = FollowResult(*row)
+    if result.changed:
+        transaction.on_commit(
+            lambda: graph.record([(follower_id, target_id)], result.is_following)
+        )
+    return result
+
+
+def toggle(follower_id, target_id):
+    """
+    Flip whether ``follower_id`` follows ``target_id``. Returns ``None`` if
+    the target does not exist.
+    """
+    return _execute(TOGGLE_SQL, follower_id, target_id)
+
+
+def follow(follower_id, target_id):
+    """Idempotently follow ``target_id``. Returns ``None`` if it does not exist."""
+    return _execute(FOLLOW_SQL, follower_id, target_id)
+
+
+def unfollow(follower_id, target_id):
+    """Idempotently unfollow ``target_id``. Returns ``None`` if it does not exist."""
+    return _execute(UNFOLLOW_SQL, follower_id, target_id)
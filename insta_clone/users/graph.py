@@ -0,0 +1,154 @@
+"""
+Follow-graph membership cache.
+
+Each user's following and follower ids are mirrored into Redis sets,
+loaded lazily from the ``followers`` through table and kept warm by
+incremental updates from ``users.follows`` and ``users.signals``, applied
+once the database change commits. Small
+following sets are additionally held in a short-lived in-process cache,
+so ``is_following`` and batched ``following_among`` lookups rarely leave
+the process. A sentinel member marks a loaded set, so users with no
+follows are not reloaded on every read.
+"""
+from django.conf import settings
+
+from django_redis import get_redis_connection
+
+from insta_clone.local_cache import TTLCache
+
+from .models import User
+
+Follow = User.followers.through
+
+SENTINEL = 0
+LOAD_BATCH_SIZE = 5000
+
+_local_following = TTLCache(
+    maxsize=settings.FOLLOW_GRAPH_LOCAL_CACHE_SIZE,
+    ttl=settings.FOLLOW_GRAPH_LOCAL_CACHE_TTL,
+)
+
+# Applies SADD/SREM (ARGV[1]) to each key in KEYS that is already loaded.
+_UPDATE_IF_LOADED = """
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call(ARGV[1], key, ARGV[i + 1])
+    end
+end
+return 1
+"""
+
+
+def get_connection():
+    return get_redis_connection('default')
+
+
+def following_key(user_id):
+    return f"graph:following:{user_id}"
+
+
+def followers_key(user_id):
+    return f"graph:followers:{user_id}"
+
+
+def _load(key, ids):
+    pipe = get_connection().pipeline()
+    pipe.delete(key)
+    pipe.sadd(key, SENTINEL)
+    batch = []
+    for user_id in ids.iterator(chunk_size=LOAD_BATCH_SIZE):
+        batch.append(user_id)
+        if len(batch) >= LOAD_BATCH_SIZE:
+            pipe.sadd(key, *batch)
+            batch = []
+    if batch:
+        pipe.sadd(key, *batch)
+    pipe.expire(key, settings.FOLLOW_GRAPH_TTL)
+    pipe.execute()
+
+
+def _ensure_following(user_id):
+    key = following_key(user_id)
+    if not get_connection().exists(key):
+        _load(key, Follow.objects.filter(to_user_id=user_id).values_list('from_user_id', flat=True))
+    return key
+
+
+def _ensure_followers(user_id):
+    key = followers_key(user_id)
+    if not get_connection().exists(key):
+        _load(key, Follow.objects.filter(from_user_id=user_id).values_list('to_user_id', flat=True))
+    return key
+
+
+def following_ids(user_id):
+    """Return the ids ``user_id`` follows as a frozenset."""
+    cached = _local_following.get(user_id)
+    if cached is not None:
+        return cached
+
+    members = get_connection().smembers(_ensure_following(user_id))
+    ids = frozenset(int(member) for member in members) - {SENTINEL}
+    if len(ids) <= settings.FOLLOW_GRAPH_LOCAL_MAX_IDS:
+        _local_following.set(user_id, ids)
+    return ids
+
+
+def is_following(follower_id, target_id):
+    cached = _local_following.get(follower_id)
+    if cached is not None:
+        return target_id in cached
+    return bool(get_connection().sismember(_ensure_following(follower_id), target_id))
+
+
+def following_among(follower_id, user_ids):
+    """Return the subset of ``user_ids`` that ``follower_id`` follows."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return set()
+
+    cached = _local_following.get(follower_id)
+    if cached is not None:
+        return cached.intersection(user_ids)
+
+    flags = get_connection().smismember(_ensure_following(follower_id), user_ids)
+    return {user_id for user_id, flag in zip(user_ids, flags) if flag}
+
+
+def followers_among(user_id, user_ids):
+    """Return the subset of ``user_ids`` that follow ``user_id``."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return set()
+
+    flags = get_connection().smismember(_ensure_followers(user_id), user_ids)
+    return {follower_id for follower_id, flag in zip(user_ids, flags) if flag}
+
+
+def _record(pairs, following, client):
+    keys, args = [], ['SADD' if following else 'SREM']
+    for follower_id, target_id in pairs:
+        keys += [following_key(follower_id), followers_key(target_id)]
+        args += [target_id, follower_id]
+    get_connection().register_script(_UPDATE_IF_LOADED)(keys=keys, args=args, client=client)
+    for follower_id, _ in pairs:
+        _local_following.delete(follower_id)
+
+
+def record(pairs, following):
+    """Mirror follows or unfollows of ``(follower_id, target_id)`` pairs into any loaded sets."""
+    if pairs:
+        _record(pairs, following, None)
+
+
+def forget(user_id, pairs=()):
+    """
+    Drop a user's cached sets, e.g. when the account is deleted, and remove
+    their follow ``pairs`` from other users' sets in the same round trip.
+    """
+    pipe = get_connection().pipeline(transaction=False)
+    if pairs:
+        _record(pairs, False, pipe)
+    pipe.delete(following_key(user_id), followers_key(user_id))
+    pipe.execute()
+    _local_following.delete(user_id)
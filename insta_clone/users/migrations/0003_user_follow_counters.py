@@ -0,0 +1,58 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:20
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(Follow, column):
+    counts = (
+        Follow.objects.filter(**{column: OuterRef('pk')})
+        .order_by()
+        .values(column)
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def backfill_counters(apps, schema_editor, chunk_size=1000):
+    # Existing follows are counted in primary-key chunks, as in
+    # ``users.counters.recount``.
+    User = apps.get_model('users', 'User')
+    Follow = User.followers.through
+    last_id = 0
+    while True:
+        ids = list(
+            User.objects.filter(pk__gt=last_id)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return
+        last_id = ids[-1]
+        User.objects.filter(pk__in=ids).update(
+            followers_count=_count(Follow, 'from_user'),
+            following_count=_count(Follow, 'to_user'),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_user_date_joined_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_follow_counters'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "CREATE INDEX user_followers_from_id_idx "
+                "ON users_user_followers (from_user_id, id DESC);",
+                "CREATE INDEX user_followers_to_id_idx "
+                "ON users_user_followers (to_user_id, id DESC);",
+            ],
+            reverse_sql=[
+                "DROP INDEX user_followers_from_id_idx;",
+                "DROP INDEX user_followers_to_id_idx;",
+            ],
+        ),
+    ]
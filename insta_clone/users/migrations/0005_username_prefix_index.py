@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_follow_keyset_indexes'),
+    ]
+
+    # Serves ``LOWER(username)::text LIKE 'q%'`` for the typeahead search.
+    # Written as SQL because Django renders an ``OpClass`` over an
+    # expression without the parentheses Postgres requires.
+    operations = [
+        migrations.RunSQL(
+            sql=(
+                "CREATE INDEX user_username_prefix_idx "
+                "ON users_user ((LOWER(username)) text_pattern_ops);"
+            ),
+            reverse_sql="DROP INDEX user_username_prefix_idx;",
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 03:07
+
+import insta_clone.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='profile_picture',
+            field=models.ImageField(blank=True, null=True, storage=insta_clone.storage.get_media_storage, upload_to='profile_pics/'),
+        ),
+    ]
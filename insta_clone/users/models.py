@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from insta_clone.storage import get_media_storage
+
 
 class User(AbstractUser):
     username = models.CharField(
@@ -14,7 +16,12 @@ class User(AbstractUser):
         max_length=128
     )
     profile_picture = models.ImageField(
-        upload_to='profile_pics/', blank=True, null=True
+        upload_to='profile_pics/', storage=get_media_storage,
+        blank=True, null=True
+    )
+    # Written by the ``render_profile_picture`` task; see ``insta_clone.images``.
+    renditions = models.JSONField(
+        default=dict, blank=True, editable=False
     )
     bio = models.TextField(
         blank=True
@@ -22,6 +29,20 @@ class User(AbstractUser):
     followers = models.ManyToManyField(
         'self', symmetrical=False, related_name='following'
     )
+    followers_count = models.PositiveIntegerField(
+        default=0
+    )
+    following_count = models.PositiveIntegerField(
+        default=0
+    )
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(
+                fields=['-date_joined', '-id'],
+                name='user_date_joined_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.username
@@ -0,0 +1,55 @@
+"""
+Username typeahead.
+
+Matches are ``LOWER(username) LIKE 'q%'`` lookups served by the
+``user_username_prefix_idx`` expression index (``text_pattern_ops``), so a
+keystroke is an index range scan instead of the ``UPPER(...) LIKE '%q%'``
+sequential scan of ``SearchFilter``. Results rank an exact match first and
+then by follower count. Short prefixes are hit by almost every session, so
+their result rows are held in a short-lived in-process cache.
+"""
+from django.conf import settings
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.functions import Lower
+
+from insta_clone.local_cache import TTLCache
+
+from .models import User
+
+MAX_QUERY_LENGTH = 150
+
+_hot_prefixes = TTLCache(
+    maxsize=settings.USER_SEARCH_CACHE_SIZE,
+    ttl=settings.USER_SEARCH_CACHE_TTL,
+)
+
+
+def normalize(query):
+    return (query or '').strip().lower()[:MAX_QUERY_LENGTH]
+
+
+def search(query, limit=None):
+    """Return up to ``limit`` lightweight users whose username starts with ``query``."""
+    prefix = normalize(query)
+    if not prefix:
+        return []
+    limit = limit or settings.USER_SEARCH_LIMIT
+
+    key = (prefix, limit)
+    users = _hot_prefixes.get(key)
+    if users is None:
+        users = list(
+            User.objects
+            .annotate(username_lower=Lower('username'))
+            .filter(username_lower__startswith=prefix)
+            .annotate(exact=Case(
+                When(username_lower=prefix, then=Value(1)),
+                default=Value(0),
+                output_field=IntegerField(),
+            ))
+            .order_by('-exact', '-followers_count', 'id')
+            .only('id', 'username', 'profile_picture', 'renditions')[:limit]
+        )
+        if len(prefix) <= settings.USER_SEARCH_CACHE_MAX_PREFIX:
+            _hot_prefixes.set(key, users)
+    return users
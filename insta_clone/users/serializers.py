@@ -1,5 +1,7 @@
 from rest_framework import serializers
 
+from insta_clone.images import RenditionsField
+
 from .models import User
 
 
@@ -20,6 +22,7 @@ class UserSerializer(serializers.ModelSerializer):
         view_name='user-detail',  
         lookup_field='username'   
     )
+    renditions = RenditionsField()
     followers_count = serializers.IntegerField(read_only=True)
     following_count = serializers.IntegerField(read_only=True)
 
@@ -27,18 +30,27 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = [
             'url', 'id', 'username', 'email', 
-            'profile_picture', 'followers_count', 'following_count',
+            'profile_picture', 'renditions', 'followers_count', 'following_count',
         ]
     
 
+class UserSearchSerializer(serializers.ModelSerializer):
+    renditions = RenditionsField()
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'profile_picture', 'renditions']
+
+
 class UserDetailSerializer(serializers.ModelSerializer):
+    renditions = RenditionsField()
     followers_count = serializers.IntegerField(read_only=True)  
     following_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
         fields = [
-            'id', 'username', 'email', 'profile_picture',
+            'id', 'username', 'email', 'profile_picture', 'renditions',
             'bio', 'followers_count', 'following_count'
         ]
         read_only_fields = ['id', 'email', 'followers_count', 'following_count']
@@ -0,0 +1,78 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
+
+from . import counters, graph
+from .models import User
+
+Follow = User.followers.through
+
+
+def _existing_pairs(instance, reverse, pk_set):
+    """
+    Return the other side's ids that are actually linked to ``instance``.
+
+    ``remove()`` and ``clear()`` report the ids they were given rather than
+    the rows they delete, so the existing rows are read before deletion.
+    """
+    if reverse:
+        rows = Follow.objects.filter(to_user_id=instance.pk)
+        column = 'from_user_id'
+    else:
+        rows = Follow.objects.filter(from_user_id=instance.pk)
+        column = 'to_user_id'
+
+    if pk_set is not None:
+        rows = rows.filter(**{f'{column}__in': pk_set})
+    return set(rows.values_list(column, flat=True))
+
+
+def _apply(instance, reverse, pk_set, delta):
+    if not pk_set:
+        return
+
+    if reverse:
+        # ``instance.following`` changed: instance follows the users in pk_set.
+        counters.adjust([instance.pk], 'following_count', delta * len(pk_set))
+        counters.adjust(pk_set, 'followers_count', delta)
+        pairs = [(instance.pk, pk) for pk in pk_set]
+    else:
+        # ``instance.followers`` changed: the users in pk_set follow instance.
+        counters.adjust([instance.pk], 'followers_count', delta * len(pk_set))
+        counters.adjust(pk_set, 'following_count', delta)
+        pairs = [(pk, instance.pk) for pk in pk_set]
+
+    transaction.on_commit(lambda: graph.record(pairs, delta > 0))
+
+
+@receiver(m2m_changed, sender=Follow)
+def update_follow_counters(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('pre_remove', 'pre_clear'):
+        instance._removed_follow_ids = _existing_pairs(instance, reverse, pk_set)
+    elif action == 'post_add':
+        _apply(instance, reverse, pk_set, 1)
+    elif action in ('post_remove', 'post_clear'):
+        _apply(instance, reverse, instance.__dict__.pop('_removed_follow_ids', set()), -1)
+
+
+@receiver(pre_delete, sender=User)
+def release_follow_counters(sender, instance, **kwargs):
+    """The through rows cascade without m2m signals, so settle counters here."""
+    follower_ids = list(
+        Follow.objects.filter(from_user_id=instance.pk).values_list('to_user_id', flat=True)
+    )
+    followed_ids = list(
+        Follow.objects.filter(to_user_id=instance.pk).values_list('from_user_id', flat=True)
+    )
+    counters.adjust(follower_ids, 'following_count', -1)
+    counters.adjust(followed_ids, 'followers_count', -1)
+
+    pairs = [(follower_id, instance.pk) for follower_id in follower_ids]
+    pairs += [(instance.pk, target_id) for target_id in followed_ids]
+    transaction.on_commit(lambda: graph.forget(instance.pk, pairs))
+
+
+@receiver(post_delete, sender=User)
+def release_profile_picture(sender, instance, **kwargs):
+    if instance.profile_picture:
+        instance.profile_picture.storage.delete(instance.profile_picture.name)
@@ -1,5 +1,8 @@
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
 from django.test import TestCase
 
+from users import counters, follows, graph, search
 from users.models import User  
 
 
@@ -49,3 +52,193 @@ class UserModelTest(TestCase):
         self.assertNotEqual(self.user1.password, "password123") 
         self.assertTrue(self.user1.check_password("password123"))  
 
+
+class FollowCountersTest(TestCase):
+
+    def setUp(self):
+        """Create a small follow graph."""
+        self.user1 = User.objects.create_user(
+            username="user1", email="user1@example.com", password="password123"
+        )
+        self.user2 = User.objects.create_user(
+            username="user2", email="user2@example.com", password="password123"
+        )
+        self.user3 = User.objects.create_user(
+            username="user3", email="user3@example.com", password="password123"
+        )
+
+    def assertCounts(self, user, followers, following):
+        user.refresh_from_db()
+        self.assertEqual((user.followers_count, user.following_count), (followers, following))
+
+    def test_add_and_remove_followers(self):
+        """Counters follow add/remove on the followers side."""
+        self.user1.followers.add(self.user2, self.user3)
+        self.assertCounts(self.user1, 2, 0)
+        self.assertCounts(self.user2, 0, 1)
+
+        self.user1.followers.remove(self.user2)
+        self.assertCounts(self.user1, 1, 0)
+        self.assertCounts(self.user2, 0, 0)
+
+    def test_add_and_clear_following(self):
+        """Counters follow add/clear on the reverse (following) side."""
+        self.user1.following.add(self.user2, self.user3)
+        self.assertCounts(self.user1, 0, 2)
+        self.assertCounts(self.user3, 1, 0)
+
+        self.user1.following.clear()
+        self.assertCounts(self.user1, 0, 0)
+        self.assertCounts(self.user3, 0, 0)
+
+    def test_duplicate_add_and_missing_remove(self):
+        """Re-adding or removing absent rows leaves counters unchanged."""
+        self.user1.followers.add(self.user2)
+        self.user1.followers.add(self.user2)
+        self.user1.followers.remove(self.user3)
+        self.assertCounts(self.user1, 1, 0)
+
+    def test_user_deletion(self):
+        """Deleting a user releases the counters of everyone linked to them."""
+        self.user1.followers.add(self.user2)
+        self.user2.followers.add(self.user3)
+        self.user2.delete()
+        self.assertCounts(self.user1, 0, 0)
+        self.assertCounts(self.user3, 0, 0)
+
+    def test_recount_repairs_drift(self):
+        """Recounting fixes rows written behind the signals' back."""
+        User.followers.through.objects.create(from_user=self.user1, to_user=self.user2)
+        self.assertEqual(counters.recount(chunk_size=2), 2)
+        self.assertCounts(self.user1, 1, 0)
+        self.assertCounts(self.user2, 0, 1)
+
+    def test_follow_primitives(self):
+        """Follow primitives move both counters without the m2m signals."""
+        with self.assertNumQueries(1):
+            result = follows.toggle(self.user2.id, self.user1.id)
+        self.assertEqual(result, follows.FollowResult(True, 1, True))
+        self.assertEqual(follows.follow(self.user2.id, self.user1.id), follows.FollowResult(True, 1, False))
+        self.assertCounts(self.user2, 0, 1)
+
+        self.assertEqual(follows.unfollow(self.user2.id, self.user1.id), follows.FollowResult(False, 0, True))
+        self.assertCounts(self.user2, 0, 0)
+        self.assertEqual(counters.recount(), 0)
+
+    def test_follow_missing_user(self):
+        """Operations on a missing user return None instead of failing."""
+        for operation in (follows.toggle, follows.follow, follows.unfollow):
+            self.assertIsNone(operation(self.user2.id, self.user3.id + 1000))
+        self.assertCounts(self.user2, 0, 0)
+
+    def test_unfollow_uncounted_follow(self):
+        """A follow the counters never saw is removed without going below zero."""
+        User.followers.through.objects.create(from_user=self.user1, to_user=self.user2)
+        self.assertEqual(follows.unfollow(self.user2.id, self.user1.id), follows.FollowResult(False, 0, True))
+        self.assertCounts(self.user2, 0, 0)
+
+
+class FollowGraphTest(TestCase):
+
+    def setUp(self):
+        """Create users with cold graph caches."""
+        cache.clear()
+        graph._local_following.clear()
+        self.user1 = User.objects.create_user(
+            username="user1", email="user1@example.com", password="password123"
+        )
+        self.user2 = User.objects.create_user(
+            username="user2", email="user2@example.com", password="password123"
+        )
+        self.user3 = User.objects.create_user(
+            username="user3", email="user3@example.com", password="password123"
+        )
+        self.user2.followers.add(self.user1)
+
+    def test_lazy_load(self):
+        """Sets are loaded from the database on first use."""
+        self.assertTrue(graph.is_following(self.user1.id, self.user2.id))
+        self.assertFalse(graph.is_following(self.user1.id, self.user3.id))
+        self.assertEqual(graph.following_ids(self.user1.id), {self.user2.id})
+
+    def test_batched_lookups(self):
+        """Batched lookups answer for many users at once."""
+        ids = [self.user2.id, self.user3.id]
+        self.assertEqual(graph.following_among(self.user1.id, ids), {self.user2.id})
+        self.assertEqual(graph.followers_among(self.user2.id, [self.user1.id, self.user3.id]), {self.user1.id})
+
+    def test_loaded_sets_follow_changes(self):
+        """Loaded sets are updated in place by both write paths."""
+        graph.following_among(self.user1.id, [self.user3.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            follows.follow(self.user1.id, self.user3.id)
+        self.assertTrue(graph.is_following(self.user1.id, self.user3.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user2.followers.remove(self.user1)
+        self.assertEqual(graph.following_ids(self.user1.id), {self.user3.id})
+
+    def test_rolled_back_follow_is_not_mirrored(self):
+        graph.following_ids(self.user1.id)
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            follows.follow(self.user1.id, self.user3.id)
+            raise DatabaseError
+        self.assertEqual(graph.following_ids(self.user1.id), {self.user2.id})
+
+    def test_deleted_user_leaves_loaded_sets(self):
+        self.user3.followers.add(self.user2)
+        graph.following_ids(self.user1.id)
+        graph.followers_among(self.user3.id, [self.user2.id])
+        deleted_id = self.user2.id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user2.delete()
+        self.assertEqual(graph.following_ids(self.user1.id), set())
+        self.assertEqual(graph.followers_among(self.user3.id, [deleted_id]), set())
+
+    def test_empty_set_is_loaded_once(self):
+        """Users following nobody keep a loaded, empty set."""
+        self.assertEqual(graph.following_ids(self.user3.id), set())
+        self.assertTrue(graph.get_connection().exists(graph.following_key(self.user3.id)))
+
+
+class UserSearchTest(TestCase):
+    def setUp(self):
+        """Create users sharing a prefix with different follower counts."""
+        search._hot_prefixes.clear()
+        self.popular, self.quiet, self.exact, self.other = [
+            User.objects.create_user(
+                username=name, email=f"{name}@example.com", password="password123"
+            )
+            for name in ["Annabel", "anna_b", "ann", "bob"]
+        ]
+        User.objects.filter(id=self.popular.id).update(followers_count=10)
+
+    def test_prefix_match_ranking(self):
+        """An exact match ranks first, then more-followed users."""
+        self.assertEqual(
+            [user.id for user in search.search("Ann")],
+            [self.exact.id, self.popular.id, self.quiet.id]
+        )
+
+    def test_no_infix_matches(self):
+        """Only usernames starting with the query match."""
+        self.assertEqual(search.search("nna"), [])
+
+    def test_wildcards_are_literal(self):
+        """LIKE wildcards in the query match literally."""
+        self.assertEqual([user.id for user in search.search("anna_")], [self.quiet.id])
+
+    def test_blank_query(self):
+        """A blank query returns nothing without querying."""
+        with self.assertNumQueries(0):
+            self.assertEqual(search.search("  "), [])
+
+    def test_hot_prefix_cache(self):
+        """Short prefixes are answered from the in-process cache."""
+        search.search("a")
+        with self.assertNumQueries(0):
+            self.assertEqual(len(search.search("A")), 3)
+
+    def test_limit(self):
+        """At most ``limit`` users are returned."""
+        self.assertEqual(len(search.search("ann", limit=2)), 2)